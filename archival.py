@@ -0,0 +1,103 @@
+"""
+Архивация пользователей, которые давно ушли с сервера.
+
+UserStats хранит строку для каждого, кто когда-либо заходил в голосовой
+канал сервера. Раз в ARCHIVE_INTERVAL_HOURS часов бот проходит по своим
+серверам и переносит в UserStatsArchive тех, кто не был в голосовых
+каналах дольше ARCHIVE_INACTIVE_DAYS дней и уже не состоит на сервере.
+Топ, ранги и итоги серверов после этого считаются только по оставшимся.
+
+Участие в сервере проверяется в Discord: по кэшу участников, если сервер
+загружен целиком, иначе запросом query_members по 100 идентификаторов.
+Когда пользователь снова заходит в голосовой канал, models.record_user_join_voice
+возвращает его статистику из архива.
+"""
+
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import models
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_INACTIVE_DAYS = float(os.environ.get('ARCHIVE_INACTIVE_DAYS', 180))  # 0 — не архивировать
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', 24))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+ARCHIVE_PAUSE = float(os.environ.get('ARCHIVE_PAUSE', 0.5))
+
+# Столько идентификаторов Discord принимает в одном запросе участников
+_QUERY_MEMBERS_LIMIT = 100
+
+_task = None
+
+
+async def _departed(guild, user_ids):
+    """The subset of user_ids who are no longer members of guild."""
+    if guild.chunked:
+        return [user_id for user_id in user_ids if guild.get_member(user_id) is None]
+    present = set()
+    for start in range(0, len(user_ids), _QUERY_MEMBERS_LIMIT):
+        chunk = user_ids[start:start + _QUERY_MEMBERS_LIMIT]
+        members = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=False)
+        present.update(member.id for member in members)
+    return [user_id for user_id in user_ids if user_id not in present]
+
+
+async def archive_guild(guild, inactive_before):
+    """Archive departed inactive users of one guild in batches; returns how many were archived."""
+    archived = 0
+    after_user_id = -1
+    while True:
+        candidates = await asyncio.to_thread(
+            models.get_archive_candidates, guild.id, inactive_before, after_user_id, ARCHIVE_BATCH_SIZE
+        )
+        if not candidates:
+            break
+        after_user_id = candidates[-1]
+
+        departed = await _departed(guild, candidates)
+        if departed:
+            archived += await asyncio.to_thread(models.archive_users, guild.id, departed, inactive_before)
+        if len(candidates) < ARCHIVE_BATCH_SIZE:
+            break
+        await asyncio.sleep(ARCHIVE_PAUSE)
+    return archived
+
+
+async def run_once(bot):
+    """Archive departed inactive users in every guild the bot is in."""
+    inactive_before = (datetime.now() - timedelta(days=ARCHIVE_INACTIVE_DAYS)).isoformat()
+    total = 0
+    for guild in list(bot.guilds):
+        try:
+            archived = await archive_guild(guild, inactive_before)
+        except Exception as e:
+            logger.error(f"Ошибка архивации сервера {guild.id}: {e}")
+            continue
+        if archived:
+            logger.info(f"Сервер {guild.id}: в архив перенесено {archived} пользователей")
+        total += archived
+    return total
+
+
+async def _run(bot):
+    while True:
+        try:
+            total = await run_once(bot)
+            logger.info(f"Архивация завершена, перенесено пользователей: {total}")
+        except Exception as e:
+            logger.error(f"Ошибка архивации: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+
+
+def start(bot):
+    """Start the periodic archival task (idempotent); call from inside the bot's loop."""
+    global _task
+    if ARCHIVE_INACTIVE_DAYS <= 0:
+        return
+    if _task is not None and not _task.done():
+        return
+    _task = asyncio.get_running_loop().create_task(_run(bot), name='archival')
+    logger.info(f"Архивация пользователей запущена: неактивны дольше {ARCHIVE_INACTIVE_DAYS:g} дней и ушли с сервера")
@@ -0,0 +1,155 @@
+"""
+Кэш аватаров для карточек.
+
+Аватары скачиваются через общую requests.Session с пулом соединений к CDN
+Discord, одновременно не больше AVATAR_FETCH_CONCURRENCY загрузок.
+Скачанный аватар сразу декодируется и уменьшается до размера на карточке,
+в LRU хранятся готовые изображения по хэшу аватара Discord.
+
+Хэш меняется вместе с аватаром, поэтому новый хэш пользователя
+вытесняет его старую запись. Функции блокирующие: их вызывают из потоков
+Flask или через asyncio.to_thread, но не из цикла событий бота.
+"""
+
+import io
+import os
+import logging
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image
+from future_card import AVATAR_SIZE
+import metrics
+
+logger = logging.getLogger(__name__)
+
+AVATAR_CACHE_MAX_ENTRIES = int(os.environ.get('AVATAR_CACHE_MAX_ENTRIES', 1024))
+AVATAR_FETCH_CONCURRENCY = int(os.environ.get('AVATAR_FETCH_CONCURRENCY', 8))
+AVATAR_FETCH_TIMEOUT = float(os.environ.get('AVATAR_FETCH_TIMEOUT', 5))
+
+_images = OrderedDict()  # avatar hash -> RGBA image AVATAR_SIZE x AVATAR_SIZE
+_owners = {}  # avatar hash -> set of user ids
+_user_hashes = {}  # user id -> avatar hash
+_fetching = {}  # avatar hash -> threading.Event
+_lock = threading.Lock()
+_semaphore = threading.BoundedSemaphore(AVATAR_FETCH_CONCURRENCY)
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AVATAR_FETCH_CONCURRENCY, max_retries=1)
+_session.mount('https://', _adapter)
+_session.mount('http://', _adapter)
+
+stats = {'hits': 0, 'misses': 0, 'downloads': 0, 'failures': 0, 'invalidations': 0}
+metrics.register_cache('avatar', stats)
+
+
+def _drop(avatar_hash):
+    """Forget an avatar and its owners (caller holds the lock)."""
+    _images.pop(avatar_hash, None)
+    for user_id in _owners.pop(avatar_hash, ()):
+        if _user_hashes.get(user_id) == avatar_hash:
+            del _user_hashes[user_id]
+
+
+def _track_owner(user_id, avatar_hash):
+    """Remember which avatar a user has; a changed hash drops the old image."""
+    old_hash = _user_hashes.get(user_id)
+    if old_hash == avatar_hash:
+        return
+    if old_hash is not None:
+        owners = _owners.get(old_hash)
+        if owners is not None:
+            owners.discard(user_id)
+            # Стандартные аватары общие для многих пользователей
+            if not owners:
+                _drop(old_hash)
+                stats['invalidations'] += 1
+    _user_hashes[user_id] = avatar_hash
+    _owners.setdefault(avatar_hash, set()).add(user_id)
+
+
+def _store(avatar_hash, image):
+    _images[avatar_hash] = image
+    _images.move_to_end(avatar_hash)
+    while len(_images) > AVATAR_CACHE_MAX_ENTRIES:
+        old_hash, _ = _images.popitem(last=False)
+        _drop(old_hash)
+
+
+def _download(url):
+    """Download and shrink an avatar; None on any error."""
+    with _semaphore:
+        try:
+            response = _session.get(url, timeout=AVATAR_FETCH_TIMEOUT)
+            response.raise_for_status()
+            stats['downloads'] += 1
+            image = Image.open(io.BytesIO(response.content))
+            image.seek(0)  # у анимированных аватаров берем первый кадр
+            return image.convert('RGBA').resize((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+        except Exception as e:
+            stats['failures'] += 1
+            logger.warning(f"Не удалось загрузить аватар {url}: {e}")
+            return None
+
+
+def get_avatar(user_id, avatar_hash, url):
+    """Resized avatar image for a user, downloading it once per hash; None if unavailable."""
+    if not avatar_hash or not url:
+        return None
+
+    while True:
+        with _lock:
+            _track_owner(user_id, avatar_hash)
+            image = _images.get(avatar_hash)
+            if image is not None:
+                _images.move_to_end(avatar_hash)
+                stats['hits'] += 1
+                return image
+
+            pending = _fetching.get(avatar_hash)
+            if pending is None:
+                pending = _fetching[avatar_hash] = threading.Event()
+                stats['misses'] += 1
+                break
+
+        # Аватар уже скачивает другой поток
+        pending.wait(AVATAR_FETCH_TIMEOUT * 2)
+        with _lock:
+            if avatar_hash in _images or avatar_hash not in _fetching:
+                image = _images.get(avatar_hash)
+                if image is not None:
+                    stats['hits'] += 1
+                return image
+
+    image = None
+    try:
+        image = _download(url)
+    finally:
+        with _lock:
+            # Пользователь мог сменить аватар, пока шла загрузка
+            if image is not None and avatar_hash in _owners:
+                _store(avatar_hash, image)
+            _fetching.pop(avatar_hash).set()
+    return image
+
+
+def attach_avatar(params):
+    """Fill params['avatar'] from the cache for a card that has to be rendered."""
+    if params.get('avatar') is None:
+        params['avatar'] = get_avatar(params['user_id'], params.get('avatar_hash'), params.get('avatar_url'))
+    return params
+
+
+def invalidate_user(user_id):
+    """Drop a user's cached avatar (e.g. on a member update event)."""
+    with _lock:
+        avatar_hash = _user_hashes.pop(user_id, None)
+        if avatar_hash is None:
+            return
+        owners = _owners.get(avatar_hash)
+        if owners is not None:
+            owners.discard(user_id)
+            if not owners:
+                _drop(avatar_hash)
+                stats['invalidations'] += 1
@@ -0,0 +1,180 @@
+"""
+Бенчмарк слоя данных (models.py) на синтетическом потоке голосовых событий.
+
+Скрипт заполняет Postgres серверами и пользователями, проигрывает поток
+из benchmarks/voice_events.py через record_user_join_voice,
+update_user_voice_state, record_user_leave_voice, периодически читает
+get_leaderboard и отдельно меряет update_user_level. Для каждой функции
+выводятся пропускная способность, p50/p95/p99 и число обращений к базе
+(соединения, запросы, коммиты) на вызов; --output сохраняет JSON для
+сравнения запусков.
+
+Время в базе идет по виртуальным часам потока, поэтому выход из канала
+начисляет столько секунд, сколько прошло в сценарии, а не в реальности.
+
+Запуск из корня репозитория (используется DATABASE_URL):
+python -m benchmarks.bench_models --guilds 5 --users 2000 --events 20000 --output bench.json
+
+Тестовые серверы получают идентификаторы начиная с --guild-base и
+удаляются после прогона (если не указан --keep).
+"""
+
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+import models
+from benchmarks.common import (round_trips, counting_db_connection, latency_summary, guild_ids_for,
+                               seed_guilds, cleanup_guilds, result_header, write_output, DEFAULT_GUILD_BASE)
+from benchmarks.voice_events import VoiceEventGenerator, JOIN, STATE, LEAVE
+
+
+class VirtualClock(datetime):
+    """datetime whose now() follows the replayed event stream."""
+    start = datetime.now()
+    offset = 0.0
+
+    @classmethod
+    def now(cls, tz=None):
+        return cls.start + timedelta(seconds=cls.offset)
+
+
+class Recorder:
+    """Latency samples and round-trips per measured function."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def measure(self, name, fn, *args):
+        before = round_trips.total()
+        started = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - started
+        entry = self.samples.setdefault(name, {'latencies': [], 'round_trips': 0})
+        entry['latencies'].append(elapsed)
+        entry['round_trips'] += round_trips.total() - before
+        return result
+
+    def summary(self):
+        report = {}
+        for name, entry in self.samples.items():
+            latencies = entry['latencies']
+            count = len(latencies)
+            total = sum(latencies)
+            report[name] = {
+                'calls': count,
+                'throughput_per_s': round(count / total, 1) if total else None,
+                **latency_summary(latencies),
+                'round_trips_per_call': round(entry['round_trips'] / count, 2),
+            }
+        return report
+
+
+def replay(generator, events, recorder, leaderboard_every, level_every):
+    """Feed the event stream into models and record every call."""
+    replayed = 0
+    started = time.perf_counter()
+    for event in events:
+        VirtualClock.offset = event.at
+        flags = (event.is_muted, event.is_deafened, event.is_server_muted, event.is_server_deafened)
+        if event.kind == JOIN:
+            recorder.measure('record_user_join_voice', models.record_user_join_voice,
+                             event.user_id, event.guild_id, event.channel_id, *flags)
+        elif event.kind == STATE:
+            recorder.measure('update_user_voice_state', models.update_user_voice_state,
+                             event.user_id, event.guild_id, *flags)
+        elif event.kind == LEAVE:
+            recorder.measure('record_user_leave_voice', models.record_user_leave_voice,
+                             event.user_id, event.guild_id)
+        replayed += 1
+
+        if leaderboard_every and replayed % leaderboard_every == 0:
+            recorder.measure('get_leaderboard', models.get_leaderboard, event.guild_id, 10)
+        if level_every and replayed % level_every == 0:
+            recorder.measure('update_user_level', measure_level_update, event.user_id, event.guild_id)
+
+    return replayed, time.perf_counter() - started
+
+
+def measure_level_update(user_id, guild_id):
+    """update_user_level takes a cursor; run it in its own transaction like the callers do."""
+    conn = models.get_db_connection(autocommit=False)
+    models.update_user_level(conn.cursor(), user_id, guild_id)
+    conn.commit()
+    conn.close()
+
+
+def print_report(result):
+    print(f"\n{'функция':<26}{'вызовов':>9}{'оп/с':>10}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'обращений':>11}")
+    for name, row in sorted(result['functions'].items()):
+        print(f"{name:<26}{row['calls']:>9}{row['throughput_per_s'] or 0:>10}{row['p50_ms']:>10}"
+              f"{row['p95_ms']:>10}{row['p99_ms']:>10}{row['round_trips_per_call']:>11}")
+    totals = result['totals']
+    print(f"\nсобытий: {totals['events']}, {totals['events_per_s']} событий/с, "
+          f"{totals['round_trips_per_event']} обращений к базе на событие")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк models.py на синтетических голосовых событиях")
+    parser.add_argument('--guilds', type=int, default=3)
+    parser.add_argument('--users', type=int, default=1000, help="пользователей на сервер")
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--leaderboard-every', type=int, default=25, help="чтение топа каждые N событий")
+    parser.add_argument('--level-every', type=int, default=10, help="update_user_level каждые N событий")
+    parser.add_argument('--guild-base', type=int, default=DEFAULT_GUILD_BASE)
+    parser.add_argument('--output', help="файл для JSON с результатами ('-' для stdout)")
+    parser.add_argument('--keep', action='store_true', help="не удалять тестовые данные")
+    args = parser.parse_args(argv)
+
+    if not models.DATABASE_URL:
+        parser.error("не задан DATABASE_URL")
+
+    models.init_db()
+    models.get_db_connection = counting_db_connection
+    models.datetime = VirtualClock
+
+    guild_ids = guild_ids_for(args.guilds, args.guild_base)
+    generator = VoiceEventGenerator(guild_ids, args.users, seed=args.seed)
+    recorder = Recorder()
+
+    cleanup_guilds(guild_ids)
+    try:
+        seed_started = time.perf_counter()
+        seed_guilds(guild_ids, generator.user_ids(guild_ids[0]), random.Random(args.seed))
+        seed_seconds = time.perf_counter() - seed_started
+
+        round_trips.reset()
+        events, elapsed = replay(generator, generator.events(args.events), recorder,
+                                 args.leaderboard_every, args.level_every)
+        # Закрываем оставшиеся сессии, чтобы выходы тоже попали в замеры
+        drained, drain_elapsed = replay(generator, generator.drain(), recorder, 0, 0)
+        events += drained
+        elapsed += drain_elapsed
+    finally:
+        if not args.keep:
+            cleanup_guilds(guild_ids)
+
+    result = {
+        **result_header(args),
+        'seed_seconds': round(seed_seconds, 3),
+        'totals': {
+            'events': events,
+            'elapsed_s': round(elapsed, 3),
+            'events_per_s': round(events / elapsed, 1) if elapsed else None,
+            'round_trips': round_trips.total(),
+            'round_trips_per_event': round(round_trips.total() / events, 2) if events else None,
+            'connects': round_trips.connects,
+            'queries': round_trips.queries,
+            'commits': round_trips.commits,
+        },
+        'functions': recorder.summary(),
+    }
+
+    print_report(result)
+    write_output(result, args.output)
+    return result
+
+
+if __name__ == "__main__":
+    main()
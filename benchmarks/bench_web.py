@@ -0,0 +1,257 @@
+"""
+Нагрузочный тест веб-интерфейса (main.py) на заполненной локальной базе.
+
+Скрипт заполняет Postgres тестовыми серверами, подменяет бота Discord
+заглушкой с названиями серверов и именами участников, поднимает Flask на
+локальном порту и гоняет по страницам /, /guild/<id>, /guild/<id>/user/<id>
+и /levels параллельных клиентов. Для каждого маршрута выводятся запросы в
+секунду, гистограмма и перцентили задержек и число обращений к базе на
+запрос (по нему видно N+1 и пользу кэша страниц).
+
+Запуск из корня репозитория (используется DATABASE_URL):
+python -m benchmarks.bench_web --guilds 5 --users 2000 --clients 16 --duration 30 --output web.json
+
+--no-page-cache выключает кэш страниц, чтобы сравнить с ним и без него;
+--max-queries N завершает скрипт с ошибкой, если какой-то маршрут сделал
+больше N обращений к базе за запрос.
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from werkzeug.serving import make_server
+import models
+from benchmarks.common import (round_trips, counting_db_connection, latency_summary, guild_ids_for,
+                               seed_guilds, cleanup_guilds, result_header, write_output, DEFAULT_GUILD_BASE)
+
+# Верхние границы корзин гистограммы задержек (мс)
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000]
+
+# Доли маршрутов в нагрузке
+ROUTE_WEIGHTS = {
+    'index': 0.1,
+    'guild': 0.35,
+    'user': 0.45,
+    'levels': 0.1,
+}
+
+
+class StubAvatar:
+    def __init__(self, user_id):
+        self.key = f"stub{user_id}"
+        self.url = f"https://cdn.discordapp.com/embed/avatars/{user_id % 5}.png"
+
+    def replace(self, **kwargs):
+        return self
+
+
+class StubMember:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = f"Участник {user_id}"
+        self.display_avatar = StubAvatar(user_id)
+
+
+class StubGuild:
+    def __init__(self, guild_id, index):
+        self.id = guild_id
+        self.name = f"Тестовый сервер {index + 1}"
+        self.icon = None
+        self.voice_channels = []
+        self.stage_channels = []
+
+    def get_member(self, user_id):
+        return StubMember(user_id)
+
+
+class StubBot:
+    """Guild metadata provider standing in for the Discord bot cache."""
+
+    def __init__(self, guild_ids):
+        self.guilds = {guild_id: StubGuild(guild_id, index) for index, guild_id in enumerate(guild_ids)}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_user(self, user_id):
+        return StubMember(user_id)
+
+
+class RouteStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.queries = []
+        self.statuses = {}
+        self.errors = 0
+
+    def add(self, elapsed, status, queries):
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if queries is not None:
+                self.queries.append(queries)
+
+    def summary(self, duration):
+        histogram = {f"<={bound}": 0 for bound in HISTOGRAM_BUCKETS_MS}
+        histogram['>2000'] = 0
+        for elapsed in self.latencies:
+            ms = elapsed * 1000
+            for bound in HISTOGRAM_BUCKETS_MS:
+                if ms <= bound:
+                    histogram[f"<={bound}"] += 1
+                    break
+            else:
+                histogram['>2000'] += 1
+        return {
+            'requests': len(self.latencies),
+            'requests_per_s': round(len(self.latencies) / duration, 1) if duration else None,
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': self.errors,
+            **latency_summary(self.latencies),
+            'histogram_ms': histogram,
+            'db_round_trips_avg': round(sum(self.queries) / len(self.queries), 2) if self.queries else None,
+            'db_round_trips_max': max(self.queries) if self.queries else None,
+        }
+
+
+def pick_path(rng, guild_ids, users):
+    """Random page; popular users (low ids) are viewed more often, like real leaderboards."""
+    route = rng.choices(list(ROUTE_WEIGHTS), list(ROUTE_WEIGHTS.values()))[0]
+    guild_id = rng.choice(guild_ids)
+    if route == 'index':
+        return route, '/'
+    if route == 'levels':
+        return route, '/levels'
+    if route == 'guild':
+        return route, f"/guild/{guild_id}"
+    user_id = min(users, int(rng.paretovariate(1.0)))
+    return route, f"/guild/{guild_id}/user/{user_id}"
+
+
+def run_client(base_url, deadline, seed, guild_ids, users, stats):
+    rng = random.Random(seed)
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        route, path = pick_path(rng, guild_ids, users)
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=30)
+        except requests.RequestException:
+            with stats[route].lock:
+                stats[route].errors += 1
+            continue
+        elapsed = time.perf_counter() - started
+        queries = response.headers.get('X-Bench-DB-Round-Trips')
+        stats[route].add(elapsed, response.status_code, int(queries) if queries is not None else None)
+
+
+def load(base_url, clients, duration, guild_ids, users, seed):
+    stats = {route: RouteStats() for route in ROUTE_WEIGHTS}
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for i in range(clients):
+            executor.submit(run_client, base_url, deadline, seed + i, guild_ids, users, stats)
+    return stats, time.perf_counter() - started
+
+
+def print_report(result):
+    print(f"\n{'маршрут':<10}{'запросов':>10}{'зап/с':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}"
+          f"{'обращ. ср':>11}{'обращ. макс':>13}")
+    for route, row in result['routes'].items():
+        print(f"{route:<10}{row['requests']:>10}{row['requests_per_s'] or 0:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+              f"{row['p99_ms']:>9}{row['db_round_trips_avg'] or 0:>11}{row['db_round_trips_max'] or 0:>13}")
+    totals = result['totals']
+    print(f"\nвсего: {totals['requests']} запросов, {totals['requests_per_s']} зап/с, "
+          f"{totals['db_round_trips_per_request']} обращений к базе на запрос")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест страниц веб-интерфейса")
+    parser.add_argument('--guilds', type=int, default=3)
+    parser.add_argument('--users', type=int, default=1000, help="пользователей на сервер")
+    parser.add_argument('--clients', type=int, default=8, help="параллельных клиентов")
+    parser.add_argument('--duration', type=float, default=15, help="длительность замера (с)")
+    parser.add_argument('--warmup', type=float, default=2, help="прогрев перед замером (с)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--no-page-cache', action='store_true', help="выключить кэш страниц")
+    parser.add_argument('--max-queries', type=int, help="допустимое число обращений к базе на запрос")
+    parser.add_argument('--guild-base', type=int, default=DEFAULT_GUILD_BASE)
+    parser.add_argument('--output', help="файл для JSON с результатами ('-' для stdout)")
+    parser.add_argument('--keep', action='store_true', help="не удалять тестовые данные")
+    args = parser.parse_args(argv)
+
+    if not models.DATABASE_URL:
+        parser.error("не задан DATABASE_URL")
+    if args.no_page_cache:
+        # Читается при импорте web_cache, поэтому выставляем до импорта main
+        os.environ['PAGE_CACHE_TTL'] = '0'
+
+    import main as web
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    models.get_db_connection = counting_db_connection
+    web.get_db_connection = counting_db_connection
+    guild_ids = guild_ids_for(args.guilds, args.guild_base)
+    web.bot = StubBot(guild_ids)
+
+    @web.app.before_request
+    def reset_round_trips():
+        round_trips.thread_reset()
+
+    @web.app.after_request
+    def report_round_trips(response):
+        response.headers['X-Bench-DB-Round-Trips'] = str(round_trips.thread_count())
+        return response
+
+    cleanup_guilds(guild_ids)
+    server = make_server('127.0.0.1', 0, web.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-web', daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    try:
+        seed_guilds(guild_ids, range(1, args.users + 1), random.Random(args.seed))
+        if args.warmup:
+            load(base_url, args.clients, args.warmup, guild_ids, args.users, args.seed + 10_000)
+        round_trips.reset()
+        stats, elapsed = load(base_url, args.clients, args.duration, guild_ids, args.users, args.seed)
+    finally:
+        server.shutdown()
+        if not args.keep:
+            cleanup_guilds(guild_ids)
+
+    routes = {route: route_stats.summary(elapsed) for route, route_stats in stats.items()}
+    total_requests = sum(row['requests'] for row in routes.values())
+    result = {
+        **result_header(args),
+        'totals': {
+            'requests': total_requests,
+            'elapsed_s': round(elapsed, 3),
+            'requests_per_s': round(total_requests / elapsed, 1) if elapsed else None,
+            'db_round_trips': round_trips.total(),
+            'db_round_trips_per_request': round(round_trips.total() / total_requests, 2) if total_requests else None,
+        },
+        'routes': routes,
+    }
+
+    print_report(result)
+    write_output(result, args.output)
+
+    if args.max_queries is not None:
+        over = [route for route, row in routes.items() if (row['db_round_trips_max'] or 0) > args.max_queries]
+        if over:
+            print(f"превышен лимит {args.max_queries} обращений к базе на запрос: {', '.join(over)}")
+            sys.exit(1)
+    return result
+
+
+if __name__ == "__main__":
+    main()
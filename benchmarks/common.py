@@ -0,0 +1,205 @@
+"""
+Общие части бенчмарков: подсчет обращений к базе, перцентили,
+заполнение и очистка тестовых серверов, сохранение результатов.
+"""
+
+import sys
+import json
+import platform
+import threading
+from datetime import datetime, timezone
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import models
+import storage
+
+# Тестовые серверы берут идентификаторы из этого диапазона
+DEFAULT_GUILD_BASE = 900_000_000_000_000_000
+
+
+class RoundTrips:
+    """Counters of database round-trips: process-wide totals and per-thread query counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connects = 0
+            self.queries = 0
+            self.commits = 0
+
+    def add(self, kind):
+        with self._lock:
+            setattr(self, kind, getattr(self, kind) + 1)
+        self._local.count = self.thread_count() + 1
+
+    def total(self):
+        return self.connects + self.queries + self.commits
+
+    def thread_count(self):
+        """Round-trips made by the current thread since its last thread_reset()."""
+        return getattr(self._local, 'count', 0)
+
+    def thread_reset(self):
+        self._local.count = 0
+
+
+round_trips = RoundTrips()
+
+
+class CountingCursorMixin:
+    def execute(self, query, vars=None):
+        round_trips.add('queries')
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        round_trips.add('queries')
+        return super().executemany(query, vars_list)
+
+
+_counting_cursor_classes = {}
+
+
+def _counting_cursor_class(cursor_factory):
+    """Counting subclass of any cursor class (plain, DictCursor, RealDictCursor...)."""
+    cls = _counting_cursor_classes.get(cursor_factory)
+    if cls is None:
+        cls = type(f"Counting{cursor_factory.__name__}", (CountingCursorMixin, cursor_factory), {})
+        _counting_cursor_classes[cursor_factory] = cls
+    return cls
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        round_trips.add('connects')
+        super().__init__(*args, **kwargs)
+
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _counting_cursor_class(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        round_trips.add('commits')
+        return super().commit()
+
+
+class CountingSQLiteConnection(storage.SQLiteConnection):
+    def cursor(self, name=None, cursor_factory=None, **kwargs):
+        return _counting_cursor_class(storage.SQLiteCursor)(self, cursor_factory)
+
+    def commit(self):
+        if self._transaction is not None:
+            round_trips.add('commits')
+        return super().commit()
+
+
+_counting_backend = None
+
+
+def counting_db_connection(autocommit=True, dedicated=False):
+    """Drop-in replacement for models.get_db_connection that counts round-trips.
+
+    Postgres connections come from a pool of the same size as the bot's, so
+    only real connects are counted, not checkouts.
+    """
+    global _counting_backend
+    backend = storage.get_backend(models.DATABASE_URL)
+    if isinstance(backend, storage.SQLiteBackend):
+        round_trips.add('connects')
+        return CountingSQLiteConnection(backend, autocommit)
+    if _counting_backend is None:
+        _counting_backend = storage.PostgresBackend(models.DATABASE_URL, connection_factory=CountingConnection)
+    return _counting_backend.connect(autocommit, dedicated)
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies):
+    """p50/p95/p99/max in milliseconds for a list of durations in seconds."""
+    latencies = sorted(latencies)
+    return {
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def guild_ids_for(count, base=DEFAULT_GUILD_BASE):
+    return [base + i * 10_000_000 for i in range(count)]
+
+
+def seed_guilds(guild_ids, user_ids, rng):
+    """Create guild settings and users with a long-tailed distribution of voice time."""
+    conn = models.get_db_connection(autocommit=False)
+    cursor = conn.cursor()
+    for guild_id in guild_ids:
+        rows = [(user_id, guild_id, int(rng.paretovariate(1.2) * 1800), 0) for user_id in user_ids]
+        if isinstance(conn, storage.SQLiteConnection):
+            cursor.executemany(
+                "INSERT INTO UserStats (user_id, guild_id, total_seconds, current_level) VALUES (%s, %s, %s, %s) "
+                "ON CONFLICT (user_id, guild_id) DO NOTHING",
+                rows
+            )
+        else:
+            psycopg2.extras.execute_values(
+                cursor,
+                "INSERT INTO UserStats (user_id, guild_id, total_seconds, current_level) VALUES %s "
+                "ON CONFLICT (user_id, guild_id) DO NOTHING",
+                rows, page_size=1000
+            )
+    conn.commit()
+    conn.close()
+
+    for guild_id in guild_ids:
+        models.create_default_guild_config(guild_id)
+        conn = models.get_db_connection(autocommit=False)
+        cursor = conn.cursor()
+        for user_id in user_ids:
+            models.update_user_level(cursor, user_id, guild_id)
+        models.rebuild_guild_totals(guild_id, cursor)
+        conn.commit()
+        conn.close()
+
+
+def cleanup_guilds(guild_ids):
+    """Delete everything the benchmark created."""
+    conn = models.get_db_connection()
+    with conn.cursor() as cursor:
+        for table in ('ActiveUsers', 'UserStats', 'GuildTotals', 'GuildSettings'):
+            cursor.execute(f"DELETE FROM {table} WHERE guild_id = ANY(%s)", (list(guild_ids),))
+    conn.close()
+    models.notify_config_changed(None)
+
+
+def result_header(args):
+    """Common metadata of a result file."""
+    return {
+        'started_at': datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+        'params': vars(args),
+        'environment': {'python': platform.python_version(), 'psycopg2': psycopg2.__version__,
+                        'storage': storage.get_backend(models.DATABASE_URL).name,
+                        'platform': platform.platform()},
+    }
+
+
+def write_output(result, output):
+    """Save the JSON result to a file ('-' means stdout)."""
+    if output == '-':
+        json.dump(result, sys.stdout, indent=2)
+        print()
+    elif output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"результаты сохранены в {output}")
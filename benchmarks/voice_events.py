@@ -0,0 +1,144 @@
+"""
+Генератор синтетического потока голосовых событий для бенчмарков.
+
+Поток похож на настоящий сервер: участники заходят волнами (начало
+ивента), часто переключают микрофон, а в конце волны канал разом пустеет.
+Генератор помнит, кто где сидит, поэтому события всегда согласованы:
+выход только после входа, смена состояния только в канале.
+
+Время в событиях — смещение в секундах от начала потока, чтобы повтор
+можно было прогонять с виртуальными часами.
+"""
+
+import random
+from collections import namedtuple
+
+JOIN = 'join'
+STATE = 'state'
+LEAVE = 'leave'
+
+VoiceEvent = namedtuple('VoiceEvent', ['kind', 'at', 'guild_id', 'user_id', 'channel_id',
+                                       'is_muted', 'is_deafened', 'is_server_muted', 'is_server_deafened'])
+
+# Доли сценариев среди шагов генератора
+SCENARIO_WEIGHTS = {
+    'join_burst': 0.15,
+    'mute_flapping': 0.35,
+    'mass_leave': 0.05,
+    'single_join': 0.25,
+    'single_leave': 0.20,
+}
+
+
+class VoiceEventGenerator:
+    """Consistent synthetic voice event stream over a fixed set of guilds and users."""
+
+    def __init__(self, guild_ids, users_per_guild, channels_per_guild=5, seed=1,
+                 burst_size=(10, 60), flap_count=(2, 8), mean_gap=2.0):
+        self.rng = random.Random(seed)
+        self.guild_ids = list(guild_ids)
+        self.users_per_guild = users_per_guild
+        self.channels_per_guild = channels_per_guild
+        self.burst_size = burst_size
+        self.flap_count = flap_count
+        self.mean_gap = mean_gap
+        self.now = 0.0
+        # guild_id -> {user_id: [channel_id, muted, deafened, server_muted, server_deafened]}
+        self.in_voice = {guild_id: {} for guild_id in self.guild_ids}
+
+    def user_ids(self, guild_id):
+        """User ids of a guild; the same users are members of every guild, as on real servers."""
+        return range(1, self.users_per_guild + 1)
+
+    def channel_ids(self, guild_id):
+        return [guild_id + 1000 + i for i in range(self.channels_per_guild)]
+
+    def _tick(self, scale=1.0):
+        self.now += self.rng.expovariate(1 / (self.mean_gap * scale))
+        return self.now
+
+    def _event(self, kind, guild_id, user_id):
+        channel_id, muted, deafened, server_muted, server_deafened = self.in_voice[guild_id][user_id]
+        return VoiceEvent(kind, self.now, guild_id, user_id, channel_id, muted, deafened, server_muted, server_deafened)
+
+    def _join(self, guild_id, user_id, channel_id=None):
+        channel_id = channel_id or self.rng.choice(self.channel_ids(guild_id))
+        muted = self.rng.random() < 0.2
+        self.in_voice[guild_id][user_id] = [channel_id, muted, muted and self.rng.random() < 0.3, False, False]
+        return self._event(JOIN, guild_id, user_id)
+
+    def _leave(self, guild_id, user_id):
+        event = self._event(LEAVE, guild_id, user_id)
+        del self.in_voice[guild_id][user_id]
+        return event
+
+    def _outside(self, guild_id):
+        inside = self.in_voice[guild_id]
+        return [user_id for user_id in self.user_ids(guild_id) if user_id not in inside]
+
+    def join_burst(self, guild_id):
+        """Many users join one channel within seconds."""
+        outside = self._outside(guild_id)
+        count = min(len(outside), self.rng.randint(*self.burst_size))
+        channel_id = self.rng.choice(self.channel_ids(guild_id))
+        for user_id in self.rng.sample(outside, count):
+            self._tick(0.05)
+            yield self._join(guild_id, user_id, channel_id)
+
+    def mute_flapping(self, guild_id):
+        """One user toggles the microphone several times in a row."""
+        inside = self.in_voice[guild_id]
+        if not inside:
+            return
+        user_id = self.rng.choice(list(inside))
+        for _ in range(self.rng.randint(*self.flap_count)):
+            self._tick(0.2)
+            state = inside[user_id]
+            state[1] = not state[1]
+            if self.rng.random() < 0.1:
+                state[3] = not state[3]
+            yield self._event(STATE, guild_id, user_id)
+
+    def mass_leave(self, guild_id):
+        """A whole channel empties at once (end of an event)."""
+        inside = self.in_voice[guild_id]
+        if not inside:
+            return
+        channel_id = self.rng.choice([state[0] for state in inside.values()])
+        self._tick(30)
+        for user_id in [user_id for user_id, state in inside.items() if state[0] == channel_id]:
+            self._tick(0.05)
+            yield self._leave(guild_id, user_id)
+
+    def single_join(self, guild_id):
+        outside = self._outside(guild_id)
+        if outside:
+            self._tick()
+            yield self._join(guild_id, self.rng.choice(outside))
+
+    def single_leave(self, guild_id):
+        inside = self.in_voice[guild_id]
+        if inside:
+            self._tick(10)
+            yield self._leave(guild_id, self.rng.choice(list(inside)))
+
+    def events(self, count):
+        """Yield `count` events."""
+        scenarios = list(SCENARIO_WEIGHTS)
+        weights = [SCENARIO_WEIGHTS[name] for name in scenarios]
+        produced = 0
+        while produced < count:
+            guild_id = self.rng.choice(self.guild_ids)
+            scenario = self.rng.choices(scenarios, weights)[0]
+            for event in getattr(self, scenario)(guild_id):
+                yield event
+                produced += 1
+                if produced >= count:
+                    return
+
+    def drain(self):
+        """Leave events for everyone still in voice, so a replay ends with empty channels."""
+        for guild_id, inside in self.in_voice.items():
+            for user_id in list(inside):
+                self._tick(0.05)
+                yield self._leave(guild_id, user_id)
@@ -6,6 +6,13 @@ from discord import app_commands
 import traceback
 import logging
 from models import init_db
+import metrics
+import loop_monitor
+import guild_jobs
+import archival
+import voice_ingest
+import member_cache
+import card_cache
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +28,21 @@ try:
 except:
     pass  # Если не удалось включить, продолжаем без него
 
+# Шарды: без SHARD_COUNT бот работает одним подключением, как раньше. С ним процесс
+# запускает шарды из SHARD_IDS (или все) через AutoShardedBot; см. shards.py
+SHARD_COUNT = int(os.environ['SHARD_COUNT']) if os.environ.get('SHARD_COUNT') else None
+SHARD_IDS = [int(shard_id) for shard_id in os.environ['SHARD_IDS'].split(',')] if os.environ.get('SHARD_IDS') else None
+# Глобальные команды синхронизирует один процесс (координатор назначает его в shards.py)
+SYNC_COMMANDS = os.environ.get('BOT_SYNC_COMMANDS', '1') != '0'
+
 # Создание экземпляра бота с поддержкой слеш-команд
 # Используем только префикс '!' для обычных команд, чтобы избежать конфликта со слеш-командами
-bot = commands.Bot(command_prefix='!', intents=intents, help_command=None)
+# Участники не загружаются при запуске, в кэше только голосовые; см. member_cache.py
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix='!', intents=intents, help_command=None,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **member_cache.client_options())
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents, help_command=None, **member_cache.client_options())
 
 # Инициализация базы данных
 init_db()
@@ -31,11 +50,28 @@ init_db()
 @bot.event
 async def on_ready():
     """Событие, срабатывающее когда бот готов и подключен к Discord."""
+    # Повторный вызов после переподключения ничего не делает
+    loop_monitor.start(asyncio.get_running_loop())
+    # Продолжить задачи сброса и удаления, прерванные перезапуском
+    guild_jobs.start()
+    archival.start(bot)
+    # Каталог кэша карточек обходим в потоке, а не при первой команде
+    asyncio.create_task(asyncio.to_thread(card_cache.load_index))
+    if not SHARD_COUNT:
+        # Шарды сверяют свои серверы в on_shard_ready
+        asyncio.create_task(voice_ingest.reconcile_shard(bot))
+
     if hasattr(bot, 'user') and bot.user:
         logger.info(f'Бот {bot.user.name} подключен к Discord!')
     else:
         logger.info('Бот запущен в режиме "только веб-интерфейс"')
 
+    if not SYNC_COMMANDS:
+        logger.info(f"Шарды {SHARD_IDS}: команды синхронизирует другой процесс, только загружаем модули")
+        await load_cogs()
+        await update_presence()
+        return
+
     try:
         # Проверяем зарегистрированные команды и всегда синхронизируем для обновления
         commands = bot.tree.get_commands()
@@ -167,6 +203,38 @@ async def on_ready():
     except Exception as e:
         logger.error(f"Ошибка при инициализации бота: {e}")
 
+    await update_presence()
+
+@bot.event
+async def on_shard_ready(shard_id):
+    """Шард подключен: его серверы сверяются с голосовыми каналами."""
+    logger.info(f"Шард {shard_id} готов, серверов: {sum(1 for guild in bot.guilds if guild.shard_id == shard_id)}")
+    await voice_ingest.reconcile_shard(bot, shard_id)
+
+@bot.event
+async def on_disconnect():
+    """Соединение с Discord потеряно (без шардов; у шардов — on_shard_disconnect)."""
+    if not SHARD_COUNT:
+        voice_ingest.mark_disconnected(0)
+
+@bot.event
+async def on_resumed():
+    """Сессия восстановлена без повторного on_ready."""
+    if not SHARD_COUNT:
+        voice_ingest.mark_resumed(0)
+
+@bot.event
+async def on_shard_disconnect(shard_id):
+    """Шард потерял соединение: кто выйдет до переподключения, получит время только до этого момента."""
+    voice_ingest.mark_disconnected(shard_id)
+
+@bot.event
+async def on_shard_resumed(shard_id):
+    """Сессия шарда восстановлена: Discord дошлет пропущенные события сам."""
+    voice_ingest.mark_resumed(shard_id)
+
+async def update_presence():
+    """Статус бота "смотрит голосовые каналы"."""
     await bot.change_presence(
         activity=discord.Activity(
             type=discord.ActivityType.watching,
@@ -176,7 +244,7 @@ async def on_ready():
 
 async def load_cogs():
     """Загрузка всех модулей из директории cogs."""
-    cog_modules = ["cogs.voice_tracking", "cogs.user_commands", "cogs.menu_commands", "cogs.admin_commands"]
+    cog_modules = ["cogs.voice_tracking", "cogs.user_commands", "cogs.menu_commands", "cogs.admin_commands", "cogs.bulk_commands", "cogs.card_commands"]
     try:
         for module in cog_modules:
             # Проверяем, загружен ли уже модуль
@@ -217,9 +285,21 @@ async def on_command_error(ctx, error):
         logger.error(f"Необработанная ошибка: {error}")
         await ctx.send(f"❌ Произошла ошибка: {str(error)}")
 
+def observe_command_latency(interaction, command_name, status):
+    """Время от создания взаимодействия в Discord до завершения команды."""
+    latency = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    metrics.COMMAND_LATENCY_SECONDS.observe(max(latency, 0), command=command_name, status=status)
+
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    """Замер времени выполнения успешной slash-команды."""
+    observe_command_latency(interaction, command.qualified_name, 'ok')
+
 @bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error):
     """Обработка ошибок slash-команд."""
+    if interaction.command is not None:
+        observe_command_latency(interaction, interaction.command.qualified_name, 'error')
     try:
         # Логируем информацию о команде для отладки
         command_name = "неизвестно"
@@ -318,6 +398,8 @@ async def on_app_command_error(interaction: discord.Interaction, error):
 
 @bot.event
 async def on_interaction(interaction: discord.Interaction):
+    # Автор команды скорее всего понадобится снова (карточка, поздравление)
+    member_cache.remember(interaction.user)
     if interaction.type == discord.InteractionType.application_command and interaction.command is None:
         try:
             command_name = interaction.data.get('name', 'неизвестная')
@@ -449,6 +531,16 @@ async def fix_unknown_integration(interaction):
     except Exception as e:
         logger.error(f"Критическая ошибка в процессе исправления 'Неизвестная интеграция': {e}")
 
+@bot.event
+async def on_raw_member_remove(payload):
+    """Участник ушел с сервера: убираем его из кэша участников."""
+    member_cache.forget(payload.guild_id, payload.user.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    """Бот покинул сервер: его участники больше не нужны в кэше."""
+    member_cache.forget_guild(guild.id)
+
 @bot.event
 async def on_guild_join(guild):
     """Событие, срабатывающее когда бот присоединяется к новому серверу."""
@@ -465,9 +557,10 @@ async def on_guild_join(guild):
         await load_cogs()
         
         # Синхронизируем глобальные команды сначала
-        await asyncio.sleep(1)
-        global_commands = await bot.tree.sync()
-        logger.info(f"Глобальные команды синхронизированы: {len(global_commands)}")
+        if SYNC_COMMANDS:
+            await asyncio.sleep(1)
+            global_commands = await bot.tree.sync()
+            logger.info(f"Глобальные команды синхронизированы: {len(global_commands)}")
         
         # Затем синхронизируем команды для сервера
         guild_commands = await bot.tree.sync(guild=guild)
@@ -512,6 +605,10 @@ async def on_guild_available(guild):
             logger.info(f"Создаем конфигурацию по умолчанию для сервера {guild.name} (ID: {guild.id})")
             create_default_guild_config(guild.id)
         
+        if not SYNC_COMMANDS:
+            # Глобальные команды уже синхронизированы координатором
+            return
+        
         # Синхронизируем команды для сервера
         try:
             guild_commands = bot.tree.get_commands(guild=guild)
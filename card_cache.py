@@ -0,0 +1,168 @@
+"""
+Кэш готовых карточек по ключу содержимого (см. future_card.card_cache_key).
+
+Два уровня:
+    * память — LRU закодированных байтов, ограниченный общим размером;
+    * диск — каталог CARD_CACHE_DIR, ограниченный CARD_CACHE_DISK_BYTES.
+
+Порядок LRU для диска хранится в памяти, поэтому вытеснение стоит O(1):
+никаких периодических обходов каталога. Каталог читается один раз
+(load_index при запуске бота или первое обращение к диску), чтобы
+подхватить карточки, отрисованные до перезапуска.
+
+Из event loop можно звать только peek: он смотрит в память и никогда не
+трогает диск. get_from_disk, get и put читают и пишут файлы.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CARD_CACHE_DIR = os.environ.get('CARD_CACHE_DIR', 'card_cache')
+CARD_CACHE_MEMORY_BYTES = int(os.environ.get('CARD_CACHE_MEMORY_BYTES', 64 * 1024 * 1024))
+CARD_CACHE_DISK_BYTES = int(os.environ.get('CARD_CACHE_DISK_BYTES', 512 * 1024 * 1024))
+
+_memory = OrderedDict()  # key -> bytes
+_memory_bytes = 0
+_disk = OrderedDict()  # key -> size
+_disk_bytes = 0
+_disk_loaded = False
+_lock = threading.Lock()
+_index_lock = threading.Lock()  # один обход каталога; _lock на время обхода не держим
+
+stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'renders': 0}
+metrics.register_cache('card', stats, hits=('memory_hits', 'disk_hits'))
+
+
+def _path(key):
+    return os.path.join(CARD_CACHE_DIR, f"{key}.bin")
+
+
+def load_index():
+    """Index the disk tier once, oldest files first. Blocking: call it from a thread."""
+    global _disk, _disk_loaded, _disk_bytes
+    if _disk_loaded:
+        return
+    with _index_lock:
+        if _disk_loaded:
+            return
+        os.makedirs(CARD_CACHE_DIR, exist_ok=True)
+
+        entries = []
+        with os.scandir(CARD_CACHE_DIR) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.bin'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+
+        with _lock:
+            # Файлы с прошлого запуска старше всего, что записано за время обхода
+            disk = OrderedDict((key, size) for _, key, size in sorted(entries) if key not in _disk)
+            _disk_bytes += sum(disk.values())
+            disk.update(_disk)
+            _disk = disk
+            _disk_loaded = True
+            _evict_disk()
+
+
+def _remember(key, data):
+    """Put bytes into the memory tier and evict least recently used entries."""
+    global _memory_bytes
+    if key in _memory:
+        _memory_bytes -= len(_memory.pop(key))
+    _memory[key] = data
+    _memory_bytes += len(data)
+    while _memory_bytes > CARD_CACHE_MEMORY_BYTES and len(_memory) > 1:
+        _, old = _memory.popitem(last=False)
+        _memory_bytes -= len(old)
+
+
+def _evict_disk():
+    global _disk_bytes
+    while _disk_bytes > CARD_CACHE_DISK_BYTES and _disk:
+        key, size = _disk.popitem(last=False)
+        _disk_bytes -= size
+        try:
+            os.remove(_path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Ошибка при удалении карточки {key} из кэша: {e}")
+
+
+def peek(key):
+    """Bytes from the memory tier, or None; never touches the disk."""
+    with _lock:
+        data = _memory.get(key)
+        if data is not None:
+            _memory.move_to_end(key)
+            stats['memory_hits'] += 1
+        return data
+
+
+def get_from_disk(key):
+    """Bytes from the disk tier (promoted to memory), or None. Blocking."""
+    global _disk_bytes
+    load_index()
+    with _lock:
+        if key not in _disk:
+            stats['misses'] += 1
+            return None
+        _disk.move_to_end(key)
+
+    try:
+        with open(_path(key), 'rb') as f:
+            data = f.read()
+    except OSError:
+        with _lock:
+            size = _disk.pop(key, None)
+            if size is not None:
+                _disk_bytes -= size
+            stats['misses'] += 1
+        return None
+
+    with _lock:
+        stats['disk_hits'] += 1
+        _remember(key, data)
+    return data
+
+
+def get(key):
+    """Cached bytes for a key, or None. Blocking."""
+    data = peek(key)
+    if data is None:
+        data = get_from_disk(key)
+    return data
+
+
+def put(key, data):
+    """Store bytes in both tiers."""
+    global _disk_bytes
+    load_index()
+    with _lock:
+        _remember(key, data)
+        on_disk = key in _disk
+
+    if on_disk:
+        return
+
+    # Пишем во временный файл и переименовываем, чтобы не читать недописанное
+    tmp_path = f"{_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, _path(key))
+    except OSError as e:
+        logger.error(f"Не удалось сохранить карточку {key} на диск: {e}")
+        return
+
+    with _lock:
+        if key not in _disk:
+            _disk[key] = len(data)
+            _disk_bytes += len(data)
+            _evict_disk()
+
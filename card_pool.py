@@ -0,0 +1,193 @@
+"""
+Отрисовка карточек в пуле процессов.
+
+Рисование и кодирование карточки занимает десятки и сотни миллисекунд CPU,
+поэтому ни цикл событий бота, ни поток Flask его не выполняют:
+
+    * работа уходит в ProcessPoolExecutor из CARD_RENDER_WORKERS процессов;
+    * одинаковые запросы одного пользователя, пока рендер идет, ждут один
+      и тот же результат;
+    * если в очереди уже CARD_RENDER_QUEUE_LIMIT карточек или рендер не
+      успел за CARD_RENDER_TIMEOUT секунд, возвращается простая карточка
+      без эффектов (она не кэшируется, полная дорисуется и попадет в кэш);
+    * если рабочий процесс погиб (OOM, сбой в Pillow), пул пересоздается,
+      а текущий запрос получает простую карточку.
+"""
+
+import os
+import atexit
+import asyncio
+import logging
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import card_cache
+import metrics
+import avatar_cache
+from future_card import card_cache_key, render_card, generate_simple_card, encode_card, warm_effect_layers
+
+logger = logging.getLogger(__name__)
+
+CARD_RENDER_WORKERS = int(os.environ.get('CARD_RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+CARD_RENDER_QUEUE_LIMIT = int(os.environ.get('CARD_RENDER_QUEUE_LIMIT', 32))
+CARD_RENDER_TIMEOUT = float(os.environ.get('CARD_RENDER_TIMEOUT', 10))
+
+# fork: при spawn каждый рабочий процесс заново выполнил бы верхний уровень
+# main.py (init_db, подписку на шину инвалидации и т.д.)
+CARD_RENDER_START_METHOD = os.environ.get(
+    'CARD_RENDER_START_METHOD',
+    'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+_executor = None
+_inflight = {}  # cache key -> concurrent.futures.Future
+_lock = threading.Lock()
+_executor_lock = threading.Lock()
+
+stats = {'submitted': 0, 'deduplicated': 0, 'rejected': 0, 'timeouts': 0, 'failures': 0, 'pool_restarts': 0}
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=CARD_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context(CARD_RENDER_START_METHOD)
+            )
+    return _executor
+
+
+def _drop_broken(executor):
+    """Forget a pool whose worker died (OOM kill, crash in Pillow); the next render starts a new one."""
+    global _executor
+    with _executor_lock:
+        if _executor is not executor:
+            return
+        _executor = None
+    stats['pool_restarts'] += 1
+    logger.error("Процесс отрисовки карточек завершился аварийно, пул будет создан заново")
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def start():
+    """Start all worker processes now (call before the bot and web threads start)."""
+    # Слои эффектов рисуются до fork, рабочие процессы получают их готовыми
+    if CARD_RENDER_START_METHOD == 'fork':
+        warm_effect_layers()
+    executor = _get_executor()
+    for future in [executor.submit(os.getpid) for _ in range(CARD_RENDER_WORKERS)]:
+        future.result()
+    logger.info(f"Пул отрисовки карточек запущен: {CARD_RENDER_WORKERS} процессов")
+
+
+def shutdown():
+    """Stop the worker processes."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+atexit.register(shutdown)
+
+
+def _finish(key, future, started, executor):
+    """Store a finished render in the cache and forget the in-flight entry."""
+    with _lock:
+        _inflight.pop(key, None)
+    if future.cancelled():
+        return
+    metrics.CARD_RENDER_SECONDS.observe(time.perf_counter() - started, kind='full')
+    error = future.exception()
+    if error is not None:
+        stats['failures'] += 1
+        if isinstance(error, BrokenProcessPool):
+            _drop_broken(executor)
+        logger.error(f"Ошибка отрисовки карточки {key}: {error}")
+        return
+    card_cache.put(key, future.result())
+    card_cache.stats['renders'] += 1
+
+
+def _submit(key, params, image_format, size):
+    """Future for a render of `key`, or None if the queue is full or the pool is broken."""
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None:
+            stats['deduplicated'] += 1
+            return future
+        if len(_inflight) >= CARD_RENDER_QUEUE_LIMIT:
+            stats['rejected'] += 1
+            return None
+        started = time.perf_counter()
+        executor = _get_executor()
+        try:
+            future = executor.submit(render_card, params, image_format, size)
+        except BrokenProcessPool:
+            # Эту карточку нарисует render_fallback, следующую — новый пул
+            _drop_broken(executor)
+            return None
+        _inflight[key] = future
+        stats['submitted'] += 1
+
+    future.add_done_callback(lambda f: _finish(key, f, started, executor))
+    return future
+
+
+def render_fallback(params, image_format='png', size='full'):
+    """Simple card rendered in the calling thread."""
+    with metrics.CARD_RENDER_SECONDS.time(kind='fallback'):
+        return encode_card(generate_simple_card(params), image_format, size)
+
+
+def render_card_result(params, image_format='png', size='full', timeout=CARD_RENDER_TIMEOUT):
+    """(bytes, is_fallback) for blocking callers (Flask): cache, then the pool, then the simple card."""
+    key = card_cache_key(params, image_format, size)
+    data = card_cache.get(key)
+    if data is not None:
+        return data, False
+
+    avatar_cache.attach_avatar(params)
+    future = _submit(key, params, image_format, size)
+    if future is not None:
+        try:
+            return future.result(timeout=timeout), False
+        except FutureTimeoutError:
+            stats['timeouts'] += 1
+            logger.warning(f"Карточка {key} не отрисована за {timeout} с, отдаем простую")
+        except Exception as e:
+            logger.error(f"Ошибка отрисовки карточки {key}: {e}")
+    return render_fallback(params, image_format, size), True
+
+
+def render_card_sync(params, image_format='png', size='full', timeout=CARD_RENDER_TIMEOUT):
+    """Card bytes for blocking callers."""
+    return render_card_result(params, image_format, size, timeout)[0]
+
+
+async def render_card_async(params, image_format='png', size='full', timeout=CARD_RENDER_TIMEOUT):
+    """Card bytes for coroutines (bot commands); never blocks the event loop on rendering."""
+    key = card_cache_key(params, image_format, size)
+    # В event loop смотрим только в память, файл читаем в потоке
+    data = card_cache.peek(key)
+    if data is None:
+        data = await asyncio.to_thread(card_cache.get_from_disk, key)
+    if data is not None:
+        return data
+
+    # Аватар скачивается только для карточек, которых нет в кэше
+    await asyncio.to_thread(avatar_cache.attach_avatar, params)
+    future = _submit(key, params, image_format, size)
+    if future is not None:
+        try:
+            # shield: таймаут одного ожидающего не отменяет общий рендер
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            stats['timeouts'] += 1
+            logger.warning(f"Карточка {key} не отрисована за {timeout} с, отдаем простую")
+        except Exception as e:
+            logger.error(f"Ошибка отрисовки карточки {key}: {e}")
+    return await asyncio.to_thread(render_fallback, params, image_format, size)
@@ -0,0 +1,185 @@
+import io
+import re
+import asyncio
+import logging
+import discord
+from discord import app_commands
+from discord.ext import commands
+import models
+import member_cache
+import guild_jobs
+import totals_import
+
+logger = logging.getLogger(__name__)
+
+# Сколько повысившихся пользователей перечислять в ответе
+LEVEL_UP_LIST_LIMIT = 20
+
+JOB_NAMES = {'reset': "Сброс статистики", 'purge': "Удаление данных"}
+JOB_STATUSES = {'pending': "в очереди", 'running': "выполняется", 'done': "завершено", 'failed': "ошибка"}
+
+_MEMBER_ID_RE = re.compile(r"<@!?(\d+)>|\b(\d{15,20})\b")
+
+def parse_member_ids(text):
+    """Идентификаторы из упоминаний и чисел в строке, без повторов и в исходном порядке."""
+    ids = [int(mention or raw) for mention, raw in _MEMBER_ID_RE.findall(text)]
+    return list(dict.fromkeys(ids))
+
+def format_level_ups(leveled_up):
+    """Текст о повышениях уровня для ответа команды."""
+    if not leveled_up:
+        return "Повышений уровня нет."
+    lines = [f"<@{user_id}> → уровень {level}" for user_id, level in list(leveled_up.items())[:LEVEL_UP_LIST_LIMIT]]
+    if len(leveled_up) > LEVEL_UP_LIST_LIMIT:
+        lines.append(f"...и еще {len(leveled_up) - LEVEL_UP_LIST_LIMIT}")
+    return f"Повысили уровень: {len(leveled_up)}\n" + "\n".join(lines)
+
+class BulkCommands(commands.Cog):
+    """Массовые административные операции: один набор запросов на всю роль или список."""
+
+    bulk = app_commands.Group(
+        name="массово",
+        description="Массовые операции со статистикой",
+        guild_only=True,
+        default_permissions=discord.Permissions(administrator=True),
+    )
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def role_members(self, role):
+        """Участники роли без ботов; список участников сервера подгружается при необходимости."""
+        return [member.id for member in await member_cache.role_members(role) if not member.bot]
+
+    @bulk.command(name="изменить_вклад_роли", description="Изменить вклад всех участников роли")
+    @app_commands.rename(role="роль", change="изменение")
+    @app_commands.describe(role="Роль, участникам которой изменить вклад", change="На сколько изменить вклад (может быть отрицательным)")
+    async def adjust_role(self, interaction: discord.Interaction, role: discord.Role, change: float):
+        """Изменение вклада всех участников роли одной транзакцией."""
+        await interaction.response.defer(ephemeral=True)
+        user_ids = await self.role_members(role)
+        if not user_ids:
+            await interaction.followup.send(f"У роли {role.mention} нет участников.", ephemeral=True)
+            return
+
+        leveled_up = await asyncio.to_thread(
+            models.bulk_adjust_user_contribution, interaction.guild.id, [(user_id, change) for user_id in user_ids]
+        )
+        logger.info(f"Вклад {len(user_ids)} участников роли {role.id} на сервере {interaction.guild.id} изменен на {change}")
+        await interaction.followup.send(
+            f"Вклад {len(user_ids)} участников роли {role.mention} изменен на {change:+g}.\n{format_level_ups(leveled_up)}",
+            ephemeral=True,
+        )
+
+    @bulk.command(name="изменить_вклад", description="Изменить вклад перечисленных участников")
+    @app_commands.rename(members="участники", change="изменение")
+    @app_commands.describe(members="Упоминания или ID участников через пробел", change="На сколько изменить вклад (может быть отрицательным)")
+    async def adjust_list(self, interaction: discord.Interaction, members: str, change: float):
+        """Изменение вклада списка участников одной транзакцией."""
+        user_ids = parse_member_ids(members)
+        if not user_ids:
+            await interaction.response.send_message("Не найдено ни одного участника.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        leveled_up = await asyncio.to_thread(
+            models.bulk_adjust_user_contribution, interaction.guild.id, [(user_id, change) for user_id in user_ids]
+        )
+        await interaction.followup.send(
+            f"Вклад {len(user_ids)} участников изменен на {change:+g}.\n{format_level_ups(leveled_up)}",
+            ephemeral=True,
+        )
+
+    @bulk.command(name="установить_уровень_роли", description="Установить уровень всем участникам роли")
+    @app_commands.rename(role="роль", level="уровень")
+    @app_commands.describe(role="Роль, участникам которой установить уровень", level="Новый уровень")
+    async def set_level_role(self, interaction: discord.Interaction, role: discord.Role, level: app_commands.Range[int, 0]):
+        """Установка уровня всем участникам роли одной транзакцией."""
+        await interaction.response.defer(ephemeral=True)
+        user_ids = await self.role_members(role)
+        if not user_ids:
+            await interaction.followup.send(f"У роли {role.mention} нет участников.", ephemeral=True)
+            return
+
+        leveled_up = await asyncio.to_thread(
+            models.bulk_set_user_level, interaction.guild.id, [(user_id, level) for user_id in user_ids]
+        )
+        logger.info(f"Уровень {level} установлен {len(user_ids)} участникам роли {role.id} на сервере {interaction.guild.id}")
+        await interaction.followup.send(
+            f"Уровень {level} установлен {len(user_ids)} участникам роли {role.mention}.\n{format_level_ups(leveled_up)}",
+            ephemeral=True,
+        )
+
+    @bulk.command(name="сбросить_роль", description="Сбросить статистику всех участников роли")
+    @app_commands.rename(role="роль")
+    @app_commands.describe(role="Роль, участникам которой сбросить статистику")
+    async def reset_role(self, interaction: discord.Interaction, role: discord.Role):
+        """Сброс времени и уровня всех участников роли одной транзакцией."""
+        await interaction.response.defer(ephemeral=True)
+        user_ids = await self.role_members(role)
+        if not user_ids:
+            await interaction.followup.send(f"У роли {role.mention} нет участников.", ephemeral=True)
+            return
+
+        reset = await asyncio.to_thread(models.bulk_reset_user_stats, interaction.guild.id, user_ids)
+        logger.info(f"Статистика {reset} участников роли {role.id} на сервере {interaction.guild.id} сброшена")
+        await interaction.followup.send(f"Статистика сброшена у {reset} участников роли {role.mention}.", ephemeral=True)
+
+    @bulk.command(name="импорт", description="Импортировать время участников из CSV или Parquet")
+    @app_commands.rename(file="файл", mode="режим")
+    @app_commands.describe(file="Файл с колонками user_id и total_seconds/seconds или contribution/hours",
+                           mode="Заменить время участников или добавить к нему")
+    @app_commands.choices(mode=[
+        app_commands.Choice(name="заменить", value="set"),
+        app_commands.Choice(name="добавить", value="add"),
+    ])
+    async def import_file(self, interaction: discord.Interaction, file: discord.Attachment, mode: str = "set"):
+        """Импорт итогов из других ботов: файл загружается в базу одним COPY."""
+        await interaction.response.defer(ephemeral=True)
+        data = await file.read()
+        try:
+            report = await asyncio.to_thread(
+                totals_import.import_totals, interaction.guild.id, io.BytesIO(data),
+                totals_import.format_from_name(file.filename), mode
+            )
+        except ValueError as e:
+            await interaction.followup.send(f"Импорт не выполнен: {e}", ephemeral=True)
+            return
+        except Exception as e:
+            logger.error(f"Ошибка импорта итогов на сервере {interaction.guild.id}: {e}")
+            await interaction.followup.send("Импорт не выполнен: ошибка базы данных, изменения отменены.", ephemeral=True)
+            return
+
+        message = f"Импортировано строк: {report['rows']}, пользователей: {report['users']}."
+        if report['skipped']:
+            message += f"\nПропущено строк: {report['skipped']}\n" + "\n".join(report['errors'])
+        await interaction.followup.send(f"{message}\n{format_level_ups(report['leveled_up'])}", ephemeral=True)
+
+    @bulk.command(name="сбросить_сервер", description="Сбросить статистику всего сервера в фоне")
+    async def reset_guild(self, interaction: discord.Interaction):
+        """Постановка фоновой задачи сброса: пользователи обрабатываются партиями."""
+        # Подсчет пользователей на большом сервере может не уложиться в 3 секунды
+        await interaction.response.defer(ephemeral=True)
+        job = await asyncio.to_thread(models.reset_guild_stats, interaction.guild.id)
+        guild_jobs.wake()
+        await interaction.followup.send(
+            f"Сброс статистики сервера запущен ({job['total']} пользователей). Прогресс: `/массово задачи`.",
+            ephemeral=True,
+        )
+
+    @bulk.command(name="задачи", description="Показать прогресс фоновых задач сервера")
+    async def jobs(self, interaction: discord.Interaction):
+        """Состояние задач сброса и удаления данных сервера."""
+        jobs = await asyncio.to_thread(models.get_guild_jobs, interaction.guild.id)
+        if not jobs:
+            await interaction.response.send_message("Фоновых задач нет.", ephemeral=True)
+            return
+        lines = [
+            f"{JOB_NAMES.get(job['kind'], job['kind'])}: {JOB_STATUSES.get(job['status'], job['status'])}, "
+            f"обработано {job['processed']} из {job['total']}" + (f" ({job['error']})" if job['error'] else "")
+            for job in jobs
+        ]
+        await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(BulkCommands(bot))
@@ -0,0 +1,42 @@
+import io
+import asyncio
+import logging
+import discord
+from discord import app_commands
+from discord.ext import commands
+import card_pool
+import avatar_cache
+import utils
+
+logger = logging.getLogger(__name__)
+
+class CardCommands(commands.Cog):
+    """Команда футуристической карточки уровня."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_user_update(self, before, after):
+        """Сброс кэша аватара при смене аватара пользователя."""
+        if before.display_avatar.key != after.display_avatar.key:
+            avatar_cache.invalidate_user(after.id)
+
+    @app_commands.command(name="карточка", description="Показать футуристическую карточку уровня")
+    @app_commands.rename(member="участник")
+    @app_commands.describe(member="Участник, чью карточку показать")
+    @app_commands.guild_only()
+    async def card(self, interaction: discord.Interaction, member: discord.Member = None):
+        """Отрисовка карточки в пуле процессов, не блокируя цикл событий."""
+        await interaction.response.defer()
+        member = member or interaction.user
+
+        # Запросы к базе синхронные, поэтому выполняем их в отдельном потоке
+        params = await asyncio.to_thread(utils.get_card_params, self.bot, member.id, interaction.guild.id)
+        # WebP заметно меньше PNG, поэтому загрузка в Discord быстрее
+        data = await card_pool.render_card_async(params, image_format='webp')
+
+        await interaction.followup.send(file=discord.File(io.BytesIO(data), filename=f"card_{member.id}.webp"))
+
+async def setup(bot):
+    await bot.add_cog(CardCommands(bot))
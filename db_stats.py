@@ -0,0 +1,274 @@
+"""
+Статистика запросов к базе: время, число обращений и строки по функциям.
+
+models.get_db_connection создает соединения через connect() из этого
+модуля. Курсоры таких соединений замеряют каждый execute и копят:
+
+    * по паре (функция, отпечаток SQL) — число вызовов, суммарное и
+      максимальное время, число строк;
+    * по операции (функция, открывшая соединение или взявшая его из пула,
+      например record_user_leave_voice) — вызовы, новые соединения,
+      запросы, коммиты и время, то есть сколько обращений к базе стоит
+      одна логическая операция.
+
+Отпечаток — текст запроса с литералами, замененными на "?", поэтому
+одинаковые запросы с разными параметрами складываются вместе.
+Запросы дольше QUERY_SLOW_MS пишутся в лог с параметрами, а при
+QUERY_EXPLAIN_SLOW=1 для них еще и план (EXPLAIN без ANALYZE, не чаще
+раза в QUERY_EXPLAIN_INTERVAL секунд на отпечаток).
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import threading
+import weakref
+from datetime import datetime, timezone
+import psycopg2
+import psycopg2.extensions
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUERY_STATS_ENABLED = os.environ.get('QUERY_STATS_ENABLED', '1') != '0'
+QUERY_SLOW_MS = float(os.environ.get('QUERY_SLOW_MS', 100))
+QUERY_EXPLAIN_SLOW = os.environ.get('QUERY_EXPLAIN_SLOW', '0') == '1'
+QUERY_EXPLAIN_INTERVAL = float(os.environ.get('QUERY_EXPLAIN_INTERVAL', 300))
+QUERY_STATS_MAX_FINGERPRINTS = int(os.environ.get('QUERY_STATS_MAX_FINGERPRINTS', 1000))
+
+# (function, fingerprint) -> {'calls', 'total', 'max', 'rows'}
+_queries = {}
+# operation -> {'calls', 'connections', 'queries', 'commits', 'total'}
+_operations = {}
+_explained = {}  # fingerprint -> monotonic time of the last EXPLAIN
+_connections = weakref.WeakSet()  # open instrumented connections
+_lock = threading.Lock()
+_since = datetime.now(timezone.utc)
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_VALUES_RE = re.compile(r"\bvalues\s*(?:\([^()]*\)\s*,?\s*)+", re.IGNORECASE)
+_SPACE_RE = re.compile(r"\s+")
+_EXPLAINABLE = ('select', 'update', 'delete', 'insert', 'with')
+
+# Обертки над соединением, которые не считаются "вызывающей функцией"
+_WRAPPERS = {'get_db_connection'}
+_WRAPPER_MODULES = {'storage'}
+
+
+def fingerprint(sql):
+    """Normalized statement text: literals replaced by '?', whitespace collapsed."""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _VALUES_RE.sub('VALUES (...) ', sql)
+    return _SPACE_RE.sub(' ', sql).strip()[:300]
+
+
+def _caller():
+    """Qualified name of the first function outside psycopg2, this module and connection wrappers."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if (not module.startswith('psycopg2') and module != __name__ and module not in _WRAPPER_MODULES
+                and frame.f_code.co_name not in _WRAPPERS):
+            return f"{module}.{frame.f_code.co_name}"
+        frame = frame.f_back
+    return '?'
+
+
+def _sql_text(cursor, query):
+    if isinstance(query, bytes):
+        return query.decode('utf-8', 'replace')
+    if isinstance(query, str):
+        return query
+    return query.as_string(cursor)
+
+
+def _operation_entry(operation):
+    """Counters of an operation (caller holds the lock)."""
+    op = _operations.get(operation)
+    if op is None:
+        op = _operations[operation] = {'calls': 0, 'connections': 0, 'queries': 0, 'commits': 0, 'total': 0.0}
+    return op
+
+
+def _record(cursor, query, params, elapsed):
+    function = _caller()
+    text = _sql_text(cursor, query)
+    fp = fingerprint(text)
+    rows = cursor.rowcount if cursor.rowcount > 0 else 0
+    operation = getattr(cursor.connection, 'operation', None)
+
+    with _lock:
+        key = (function, fp)
+        entry = _queries.get(key)
+        if entry is None:
+            if len(_queries) >= QUERY_STATS_MAX_FINGERPRINTS:
+                key = (function, '<other>')
+                entry = _queries.get(key)
+            if entry is None:
+                entry = _queries[key] = {'calls': 0, 'total': 0.0, 'max': 0.0, 'rows': 0}
+        entry['calls'] += 1
+        entry['total'] += elapsed
+        entry['max'] = max(entry['max'], elapsed)
+        entry['rows'] += rows
+
+        if operation is not None:
+            op = _operation_entry(operation)
+            op['queries'] += 1
+            op['total'] += elapsed
+
+    if elapsed * 1000 >= QUERY_SLOW_MS:
+        params_text = repr(params)
+        if len(params_text) > 200:
+            params_text = params_text[:200] + '...'
+        logger.warning(f"Медленный запрос {elapsed * 1000:.1f} мс в {function}: {fp} параметры={params_text}")
+        if QUERY_EXPLAIN_SLOW and fp.lower().startswith(_EXPLAINABLE):
+            _explain(cursor.connection, text, params, fp)
+
+
+def _explain(conn, text, params, fp):
+    now = time.monotonic()
+    with _lock:
+        last = _explained.get(fp)
+        if last is not None and now - last < QUERY_EXPLAIN_INTERVAL:
+            return
+        _explained[fp] = now
+    try:
+        # Обычный курсор, чтобы сам EXPLAIN не попадал в статистику
+        with psycopg2.extensions.connection.cursor(conn) as cursor:
+            cursor.execute("EXPLAIN " + text, params)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        logger.warning(f"План медленного запроса {fp}:\n{plan}")
+    except Exception as e:
+        logger.warning(f"Не удалось получить план запроса {fp}: {e}")
+
+
+class InstrumentedCursorMixin:
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record(self, query, vars, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record(self, query, None, time.perf_counter() - started)
+
+
+_cursor_classes = {}
+
+
+def _cursor_class(cursor_factory):
+    """Instrumented subclass of a cursor class (plain, DictCursor, RealDictCursor...)."""
+    cls = _cursor_classes.get(cursor_factory)
+    if cls is None:
+        cls = type(f"Instrumented{cursor_factory.__name__}", (InstrumentedCursorMixin, cursor_factory), {})
+        _cursor_classes[cursor_factory] = cls
+    return cls
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    operation = None
+
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = _cursor_class(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            if self.operation is not None:
+                with _lock:
+                    op = _operation_entry(self.operation)
+                    op['commits'] += 1
+                    op['total'] += time.perf_counter() - started
+
+
+def connect(dsn, connection_factory=InstrumentedConnection):
+    """Open an instrumented connection attributed to the calling operation."""
+    operation = _caller()
+    started = time.perf_counter()
+    conn = psycopg2.connect(dsn, connection_factory=connection_factory)
+    conn.operation = operation
+    with _lock:
+        op = _operation_entry(operation)
+        op['calls'] += 1
+        op['connections'] += 1
+        op['total'] += time.perf_counter() - started
+        _connections.add(conn)
+    metrics.DB_CONNECTIONS_OPENED.inc()
+    return conn
+
+
+def checkout(conn):
+    """Attribute a pooled connection to the operation that takes it from the pool."""
+    conn.operation = _caller()
+    with _lock:
+        _operation_entry(conn.operation)['calls'] += 1
+
+
+def connections_in_use():
+    """Instrumented connections that are not closed yet."""
+    with _lock:
+        return sum(1 for conn in list(_connections) if not conn.closed)
+
+
+metrics.DB_CONNECTIONS_IN_USE.set_function(connections_in_use)
+
+
+def snapshot():
+    """Current statistics, heaviest first."""
+    with _lock:
+        queries = [
+            {
+                'function': function,
+                'fingerprint': fp,
+                'calls': entry['calls'],
+                'total_ms': round(entry['total'] * 1000, 3),
+                'avg_ms': round(entry['total'] * 1000 / entry['calls'], 3),
+                'max_ms': round(entry['max'] * 1000, 3),
+                'rows': entry['rows'],
+            }
+            for (function, fp), entry in _queries.items()
+        ]
+        operations = [
+            {
+                'operation': operation,
+                'calls': op['calls'],
+                'connections': op['connections'],
+                'queries': op['queries'],
+                'commits': op['commits'],
+                'round_trips_per_call': round((op['connections'] + op['queries'] + op['commits'])
+                                              / max(op['calls'], 1), 2),
+                'total_ms': round(op['total'] * 1000, 3),
+                'avg_ms': round(op['total'] * 1000 / max(op['calls'], 1), 3),
+            }
+            for operation, op in _operations.items()
+        ]
+    return {
+        'enabled': QUERY_STATS_ENABLED,
+        'since': _since.isoformat(),
+        'slow_ms': QUERY_SLOW_MS,
+        'operations': sorted(operations, key=lambda row: row['total_ms'], reverse=True),
+        'queries': sorted(queries, key=lambda row: row['total_ms'], reverse=True),
+    }
+
+
+def reset():
+    """Forget collected statistics."""
+    global _since
+    with _lock:
+        _queries.clear()
+        _operations.clear()
+        _explained.clear()
+        _since = datetime.now(timezone.utc)
@@ -0,0 +1,362 @@
+"""
+Футуристические карточки уровня "Music & Wave: Future Edition".
+
+Модуль только рисует: он не ходит в базу и в Discord, все данные
+передаются параметрами. Эффекты зависят от уровня (см. README):
+
+    1-5   простое неоновое свечение
+    6-10  пульсирующее голографическое свечение
+    11-15 электрические разряды
+    16-20 звуковые волны
+    21-25 киберпанк частицы
+    26-30 голографическая матрица
+    31+   полный набор эффектов
+
+Все, что не зависит от пользователя (фон, эффекты уровня, рамка, свечение
+кольца аватара и дорожка прогресса), рисуется один раз на ступень и тему и
+хранится в памяти процесса (_effect_layer). Карточка пользователя — это копия
+такого слоя, на которую накладываются аватар, тексты и полоса прогресса.
+Случайные элементы эффектов детерминированы (seed из ступени и темы),
+поэтому одинаковые параметры всегда дают одинаковую картинку и ее можно
+кэшировать по ключу.
+"""
+
+import io
+import os
+import math
+import random
+import hashlib
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+CARD_WIDTH = 934
+CARD_HEIGHT = 282
+AVATAR_SIZE = 180
+
+# Число шагов прогресса: карточка перерисовывается только при смене шага
+PROGRESS_BUCKETS = 50
+
+# Форматы и размеры готовых карточек: формат -> (формат Pillow, MIME, параметры сохранения)
+CARD_FORMATS = {
+    'png': ('PNG', 'image/png', {'optimize': True}),
+    'webp': ('WEBP', 'image/webp', {'quality': 90, 'method': 4}),
+}
+CARD_SIZES = {
+    'full': (CARD_WIDTH, CARD_HEIGHT),
+    'thumb': (CARD_WIDTH // 3, CARD_HEIGHT // 3),
+}
+
+# Путь к TTF-шрифту с кириллицей (по умолчанию DejaVuSans, если установлен)
+CARD_FONT_PATH = os.environ.get('CARD_FONT_PATH', 'DejaVuSans.ttf')
+
+# Раскладка карточки
+AVATAR_X, AVATAR_Y = 40, (CARD_HEIGHT - AVATAR_SIZE) // 2
+TEXT_X = AVATAR_X + AVATAR_SIZE + 40
+BAR_BOX = (TEXT_X, 190, CARD_WIDTH - 40, 222)
+
+THEMES = {
+    'default': {'background': (10, 12, 28), 'accent': (0, 229, 255), 'secondary': (255, 0, 170), 'text': (235, 245, 255)},
+    'sunset': {'background': (28, 10, 24), 'accent': (255, 140, 0), 'secondary': (255, 0, 90), 'text': (255, 240, 230)},
+    'matrix': {'background': (4, 16, 8), 'accent': (0, 255, 120), 'secondary': (0, 160, 255), 'text': (220, 255, 230)},
+}
+
+LEVEL_EFFECTS = [
+    (1, 5, {'tier': 1, 'icon': '✨', 'name': 'Простое неоновое свечение'}),
+    (6, 10, {'tier': 2, 'icon': '🌈', 'name': 'Пульсирующее голографическое свечение'}),
+    (11, 15, {'tier': 3, 'icon': '⚡', 'name': 'Электрические разряды'}),
+    (16, 20, {'tier': 4, 'icon': '🎵', 'name': 'Звуковые волны'}),
+    (21, 25, {'tier': 5, 'icon': '💠', 'name': 'Киберпанк частицы'}),
+    (26, 30, {'tier': 6, 'icon': '🧊', 'name': 'Голографическая матрица'}),
+    (31, None, {'tier': 7, 'icon': '👑', 'name': 'Полный набор эффектов'}),
+]
+
+
+def get_level_effect(level):
+    """Get the effect description for a level."""
+    for low, high, effect in LEVEL_EFFECTS:
+        if high is None or level <= high:
+            return dict(effect)
+
+
+def progress_bucket(progress_percent):
+    """Round progress to the bucket that is actually drawn on the card."""
+    progress_percent = min(100, max(0, progress_percent))
+    return int(progress_percent * PROGRESS_BUCKETS / 100)
+
+
+def card_cache_key(params, image_format='png', size='full'):
+    """Content address of an encoded card: user, level, progress bucket, avatar hash,
+    theme, format and size.
+
+    The remaining drawn strings (name, rank, contribution) are folded into a
+    short digest so a renamed user never gets a stale card.
+    """
+    text = (params['user_name'], params.get('rank'), params['contribution_text'])
+    text_digest = hashlib.sha1('\x1f'.join(str(part) for part in text).encode()).hexdigest()[:12]
+    return (
+        f"{params['user_id']}-{params['level']}-{progress_bucket(params['progress_percent'])}-"
+        f"{params.get('avatar_hash') or 'none'}-{params.get('theme', 'default')}-{text_digest}-"
+        f"{size}.{image_format}"
+    )
+
+
+@lru_cache(maxsize=None)
+def _font(size):
+    try:
+        return ImageFont.truetype(CARD_FONT_PATH, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _glow(size, draw_fn, radius):
+    """Draw shapes on a transparent layer and blur them into a glow."""
+    layer = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw_fn(ImageDraw.Draw(layer))
+    return layer.filter(ImageFilter.GaussianBlur(radius))
+
+
+def _draw_neon_frame(card, colors):
+    frame = lambda draw: draw.rounded_rectangle(
+        (8, 8, CARD_WIDTH - 9, CARD_HEIGHT - 9), radius=24, outline=colors['accent'] + (255,), width=4
+    )
+    card.alpha_composite(_glow(card.size, frame, 8))
+    frame(ImageDraw.Draw(card))
+
+
+def _draw_holographic(card, colors):
+    overlay = Image.new('RGBA', card.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for x in range(0, CARD_WIDTH, 4):
+        phase = x / CARD_WIDTH
+        r = int(colors['accent'][0] * (1 - phase) + colors['secondary'][0] * phase)
+        g = int(colors['accent'][1] * (1 - phase) + colors['secondary'][1] * phase)
+        b = int(colors['accent'][2] * (1 - phase) + colors['secondary'][2] * phase)
+        alpha = int(40 + 30 * math.sin(phase * math.pi * 6))
+        draw.line((x, 0, x, CARD_HEIGHT), fill=(r, g, b, alpha), width=4)
+    card.alpha_composite(overlay)
+
+
+def _draw_electric(card, colors, rng):
+    def bolts(draw):
+        for _ in range(6):
+            x, y = rng.randint(0, CARD_WIDTH), rng.choice((0, CARD_HEIGHT))
+            points = [(x, y)]
+            for _ in range(8):
+                x += rng.randint(-40, 40)
+                y += rng.randint(10, 30) * (1 if y < CARD_HEIGHT / 2 else -1)
+                points.append((x, y))
+            draw.line(points, fill=colors['accent'] + (220,), width=2)
+    card.alpha_composite(_glow(card.size, bolts, 3))
+
+
+def _draw_sound_waves(card, colors):
+    def waves(draw):
+        for i in range(4):
+            amplitude = 18 + i * 8
+            points = [
+                (x, CARD_HEIGHT - 40 + amplitude * math.sin(x / (30 + i * 10) + i))
+                for x in range(0, CARD_WIDTH, 6)
+            ]
+            draw.line(points, fill=colors['secondary'] + (160 - i * 30,), width=2)
+    card.alpha_composite(_glow(card.size, waves, 2))
+
+
+def _draw_particles(card, colors, rng):
+    def particles(draw):
+        for _ in range(120):
+            x, y = rng.randint(0, CARD_WIDTH), rng.randint(0, CARD_HEIGHT)
+            r = rng.randint(1, 3)
+            color = colors['accent'] if rng.random() < 0.5 else colors['secondary']
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=color + (rng.randint(90, 220),))
+    card.alpha_composite(_glow(card.size, particles, 1))
+
+
+def _draw_matrix(card, colors, rng):
+    overlay = Image.new('RGBA', card.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    font = _font(12)
+    for x in range(0, CARD_WIDTH, 18):
+        length = rng.randint(3, 12)
+        start = rng.randint(-4, CARD_HEIGHT // 14)
+        for row in range(length):
+            alpha = int(200 * (row + 1) / length)
+            draw.text((x, (start + row) * 14), rng.choice('0123456789ABCDEF'), font=font,
+                      fill=colors['accent'] + (alpha // 2,))
+    card.alpha_composite(overlay)
+
+
+@lru_cache(maxsize=1)
+def _avatar_mask():
+    mask = Image.new('L', (AVATAR_SIZE, AVATAR_SIZE), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, AVATAR_SIZE - 1, AVATAR_SIZE - 1), fill=255)
+    return mask
+
+
+def _circle_avatar(avatar, colors, initial):
+    """Circular avatar; a placeholder with the user's initial when there is no image."""
+    if avatar is None:
+        avatar = Image.new('RGBA', (AVATAR_SIZE, AVATAR_SIZE), colors['secondary'] + (255,))
+        draw = ImageDraw.Draw(avatar)
+        font = _font(90)
+        draw.text((AVATAR_SIZE / 2, AVATAR_SIZE / 2), initial, font=font, fill=colors['text'], anchor='mm')
+    else:
+        avatar = avatar.convert('RGBA')
+        if avatar.size != (AVATAR_SIZE, AVATAR_SIZE):
+            avatar = avatar.resize((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+
+    result = Image.new('RGBA', (AVATAR_SIZE, AVATAR_SIZE), (0, 0, 0, 0))
+    result.paste(avatar, (0, 0), _avatar_mask())
+    return result
+
+
+def _theme_name(theme):
+    return theme if theme in THEMES else 'default'
+
+
+@lru_cache(maxsize=None)
+def _effect_layer(tier, theme):
+    """Static part of a card for an effect tier and theme, drawn once per process.
+
+    Callers must not draw on the returned image; copy it first.
+    """
+    colors = THEMES[theme]
+    rng = random.Random(f"{tier}:{theme}")
+
+    card = Image.new('RGBA', (CARD_WIDTH, CARD_HEIGHT), colors['background'] + (255,))
+
+    if tier in (2, 7):
+        _draw_holographic(card, colors)
+    if tier in (6, 7):
+        _draw_matrix(card, colors, rng)
+    if tier in (5, 7):
+        _draw_particles(card, colors, rng)
+    if tier in (4, 7):
+        _draw_sound_waves(card, colors)
+    if tier in (3, 7):
+        _draw_electric(card, colors, rng)
+    _draw_neon_frame(card, colors)
+
+    # Светящееся кольцо аватара
+    ring = lambda draw: draw.ellipse(
+        (AVATAR_X - 6, AVATAR_Y - 6, AVATAR_X + AVATAR_SIZE + 6, AVATAR_Y + AVATAR_SIZE + 6),
+        outline=colors['accent'] + (255,), width=5
+    )
+    card.alpha_composite(_glow(card.size, ring, 6))
+    ring(ImageDraw.Draw(card))
+
+    # Дорожка полосы прогресса
+    track = Image.new('RGBA', card.size, (0, 0, 0, 0))
+    ImageDraw.Draw(track).rounded_rectangle(BAR_BOX, radius=16, fill=(255, 255, 255, 40))
+    card.alpha_composite(track)
+    return card
+
+
+@lru_cache(maxsize=None)
+def _progress_layer(bucket, theme):
+    """Glowing progress bar for a progress bucket, cropped to the bar area.
+
+    Returns (image, (x, y)) or None for an empty bar.
+    """
+    if bucket <= 0:
+        return None
+    colors = THEMES[theme]
+    bar_left, bar_top, bar_right, bar_bottom = BAR_BOX
+    fill_right = bar_left + max(32, int((bar_right - bar_left) * bucket / PROGRESS_BUCKETS))
+
+    # Запас под размытие свечения вокруг полосы
+    pad = 18
+    origin = (bar_left - pad, bar_top - pad)
+    size = (fill_right - bar_left + 2 * pad, bar_bottom - bar_top + 2 * pad)
+    box = (pad, pad, pad + fill_right - bar_left, pad + bar_bottom - bar_top)
+    bar = lambda d: d.rounded_rectangle(box, radius=16, fill=colors['accent'] + (255,))
+    layer = _glow(size, bar, 6)
+    bar(ImageDraw.Draw(layer))
+    return layer, origin
+
+
+def warm_effect_layers():
+    """Draw every tier, theme and progress layer ahead of time.
+
+    Called in the parent process before the render pool forks, so the
+    workers inherit the layers instead of drawing them on their first card.
+    """
+    for theme in THEMES:
+        for _, _, effect in LEVEL_EFFECTS:
+            _effect_layer(effect['tier'], theme)
+        for bucket in range(1, PROGRESS_BUCKETS + 1):
+            _progress_layer(bucket, theme)
+
+
+def generate_future_rank_card(user_id, user_name, level, progress_percent, contribution_text,
+                              rank=None, avatar=None, theme='default'):
+    """Draw a rank card and return it as an RGBA image."""
+    theme = _theme_name(theme)
+    colors = THEMES[theme]
+    card = _effect_layer(get_level_effect(level)['tier'], theme).copy()
+
+    card.alpha_composite(_circle_avatar(avatar, colors, (user_name or '?')[:1].upper()), (AVATAR_X, AVATAR_Y))
+
+    # Тексты
+    draw = ImageDraw.Draw(card)
+    draw.text((TEXT_X, 50), user_name, font=_font(40), fill=colors['text'])
+    draw.text((CARD_WIDTH - 40, 50), f"УРОВЕНЬ {level}", font=_font(36), fill=colors['accent'], anchor='ra')
+    if rank is not None:
+        draw.text((CARD_WIDTH - 40, 100), f"#{rank}", font=_font(28), fill=colors['secondary'], anchor='ra')
+    draw.text((TEXT_X, 140), contribution_text, font=_font(24), fill=colors['text'])
+
+    # Полоса прогресса (рисуется по шагам PROGRESS_BUCKETS)
+    progress = _progress_layer(progress_bucket(progress_percent), theme)
+    if progress is not None:
+        layer, origin = progress
+        card.alpha_composite(layer, origin)
+
+    return card
+
+
+def generate_simple_card(params):
+    """Cheap card without effects and blur, used when full rendering is overloaded or too slow."""
+    colors = THEMES.get(params.get('theme', 'default'), THEMES['default'])
+    card = Image.new('RGBA', (CARD_WIDTH, CARD_HEIGHT), colors['background'] + (255,))
+    draw = ImageDraw.Draw(card)
+    draw.rounded_rectangle((8, 8, CARD_WIDTH - 9, CARD_HEIGHT - 9), radius=24, outline=colors['accent'], width=4)
+
+    text_x = 60
+    draw.text((text_x, 50), params['user_name'], font=_font(40), fill=colors['text'])
+    draw.text((CARD_WIDTH - 40, 50), f"УРОВЕНЬ {params['level']}", font=_font(36), fill=colors['accent'], anchor='ra')
+    if params.get('rank') is not None:
+        draw.text((CARD_WIDTH - 40, 100), f"#{params['rank']}", font=_font(28), fill=colors['secondary'], anchor='ra')
+    draw.text((text_x, 140), params['contribution_text'], font=_font(24), fill=colors['text'])
+
+    bar_left, bar_top, bar_right, bar_bottom = text_x, 190, CARD_WIDTH - 40, 222
+    draw.rounded_rectangle((bar_left, bar_top, bar_right, bar_bottom), radius=16, outline=colors['accent'], width=2)
+    filled = progress_bucket(params['progress_percent']) / PROGRESS_BUCKETS
+    if filled > 0:
+        fill_right = bar_left + max(32, int((bar_right - bar_left) * filled))
+        draw.rounded_rectangle((bar_left, bar_top, fill_right, bar_bottom), radius=16, fill=colors['accent'])
+
+    return card
+
+
+def encode_card(card, image_format='png', size='full'):
+    """Encode a card image to bytes in one of CARD_FORMATS and CARD_SIZES."""
+    pil_format, _, options = CARD_FORMATS[image_format]
+    if card.size != CARD_SIZES[size]:
+        card = card.resize(CARD_SIZES[size], Image.LANCZOS)
+    buffer = io.BytesIO()
+    card.save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+
+def render_card(params, image_format='png', size='full'):
+    """Render card parameters (see utils.get_card_params) to encoded bytes."""
+    card = generate_future_rank_card(
+        params['user_id'],
+        params['user_name'],
+        params['level'],
+        params['progress_percent'],
+        params['contribution_text'],
+        rank=params.get('rank'),
+        avatar=params.get('avatar'),
+        theme=params.get('theme', 'default'),
+    )
+    return encode_card(card, image_format, size)
@@ -0,0 +1,120 @@
+"""
+Фоновые задачи сброса и удаления данных сервера.
+
+models.reset_guild_stats и models.purge_guild_data только ставят задачу в
+таблицу GuildJobs. Поток-исполнитель берет задачу и обрабатывает
+пользователей сервера партиями по GUILD_JOB_BATCH_SIZE строк: каждая
+партия — короткая транзакция, которая заодно сдвигает курсор задачи
+(последний обработанный user_id). Между партиями исполнитель спит
+GUILD_JOB_PAUSE секунд, чтобы запись голосовых событий других серверов не
+ждала блокировок.
+
+Задача принадлежит процессу, пока он раз в партию обновляет heartbeat_at.
+Если процесс остановился, через GUILD_JOB_LEASE секунд задачу подхватывает
+любой исполнитель и продолжает с сохраненного курсора.
+
+Запуск вне бота: python guild_jobs.py [guild_id reset|purge]
+"""
+
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+
+import models
+from invalidation_bus import publish, GUILD_CONFIG, GUILD_STATS
+
+logger = logging.getLogger(__name__)
+
+GUILD_JOB_BATCH_SIZE = int(os.environ.get('GUILD_JOB_BATCH_SIZE', 1000))
+GUILD_JOB_PAUSE = float(os.environ.get('GUILD_JOB_PAUSE', 0.05))
+GUILD_JOB_POLL_INTERVAL = float(os.environ.get('GUILD_JOB_POLL_INTERVAL', 5))
+GUILD_JOB_LEASE = float(os.environ.get('GUILD_JOB_LEASE', 60))
+
+_thread = None
+_wake = threading.Event()
+_start_lock = threading.Lock()
+
+
+def owner_name():
+    """Identifies this process as the owner of the jobs it runs."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_job(guild_id, kind):
+    """Claim a job and run it to the end; returns the final job state or None if it was not claimed."""
+    owner = owner_name()
+    if not models.claim_guild_job(guild_id, kind, owner, GUILD_JOB_LEASE):
+        return None
+
+    job = models.get_guild_job(guild_id, kind)
+    logger.info(f"Задача {kind} для сервера {guild_id}: начало с user_id > {job['last_user_id']}, "
+                f"обработано {job['processed']} из {job['total']}")
+    try:
+        while job is not None and job['status'] == 'running':
+            job = models.run_guild_job_batch(guild_id, kind, owner, GUILD_JOB_BATCH_SIZE)
+            if job is not None and job['status'] == 'running':
+                time.sleep(GUILD_JOB_PAUSE)
+    except Exception as e:
+        logger.error(f"Ошибка задачи {kind} для сервера {guild_id}: {e}")
+        models.fail_guild_job(guild_id, kind, e)
+        return models.get_guild_job(guild_id, kind)
+
+    if job is None:
+        logger.warning(f"Задача {kind} для сервера {guild_id} перешла другому исполнителю")
+    else:
+        logger.info(f"Задача {kind} для сервера {guild_id} завершена: обработано {job['processed']} пользователей")
+    return job
+
+
+def run_pending():
+    """Run every unfinished job this process can claim; returns the jobs that were run."""
+    ran = []
+    for job in models.get_guild_jobs(unfinished=True):
+        result = run_job(job['guild_id'], job['kind'])
+        if result is not None:
+            ran.append(result)
+    return ran
+
+
+def _run():
+    while True:
+        try:
+            run_pending()
+        except Exception as e:
+            logger.error(f"Ошибка исполнителя фоновых задач: {e}")
+        _wake.wait(GUILD_JOB_POLL_INTERVAL)
+        _wake.clear()
+
+
+def start():
+    """Start the background runner thread (idempotent); it also resumes jobs left by a stopped process."""
+    global _thread
+    with _start_lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_run, name='guild-jobs', daemon=True)
+        _thread.start()
+    logger.info(f"Исполнитель фоновых задач запущен (партия {GUILD_JOB_BATCH_SIZE} строк)")
+
+
+def wake():
+    """Pick up a just enqueued job without waiting for the next poll."""
+    _wake.set()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    if len(sys.argv) == 3:
+        models.enqueue_guild_job(int(sys.argv[1]), sys.argv[2])
+    # Кэши бота и веб-интерфейса живут в других процессах
+    for job in run_pending():
+        publish(GUILD_STATS, job['guild_id'])
+        if job['kind'] == 'purge':
+            publish(GUILD_CONFIG, job['guild_id'])
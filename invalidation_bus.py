@@ -0,0 +1,160 @@
+"""
+Межпроцессная шина инвалидации кэшей на Postgres LISTEN/NOTIFY.
+
+Каждый процесс (бот, воркеры gunicorn, скрипты) публикует события об
+изменении настроек и статистики через pg_notify и слушает тот же канал.
+Полученное событие другого процесса повторяется локально через
+models.notify_config_changed / models.notify_stats_changed, поэтому все
+локальные кэши (настройки, страницы, живая лента) сбрасываются так же,
+как если бы изменение произошло в этом процессе.
+"""
+
+import os
+import json
+import uuid
+import select
+import socket
+import logging
+import threading
+import time
+from collections import namedtuple
+import models
+import storage
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'lvolos_invalidate'
+
+# Типы событий
+GUILD_CONFIG = 'guild_config'
+GUILD_STATS = 'guild_stats'
+USER_STATS = 'user_stats'
+
+InvalidationEvent = namedtuple('InvalidationEvent', ['type', 'guild_id', 'user_id', 'origin'])
+
+# Уникальный идентификатор процесса, чтобы не применять свои же события дважды
+ORIGIN = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_publish_conn = None
+_publish_lock = threading.Lock()
+_listener = None
+
+
+def _encode(event_type, guild_id, user_id=None):
+    return json.dumps({
+        'type': event_type,
+        'guild_id': str(guild_id) if guild_id is not None else None,
+        'user_id': str(user_id) if user_id is not None else None,
+        'origin': ORIGIN,
+    })
+
+
+def _decode(payload):
+    data = json.loads(payload)
+    return InvalidationEvent(
+        type=data['type'],
+        guild_id=int(data['guild_id']) if data.get('guild_id') is not None else None,
+        user_id=int(data['user_id']) if data.get('user_id') is not None else None,
+        origin=data.get('origin'),
+    )
+
+
+def publish(event_type, guild_id=None, user_id=None):
+    """Send an invalidation event to every process (guild_id=None means all guilds)."""
+    global _publish_conn
+    if not storage.get_backend(models.DATABASE_URL).supports_notify:
+        return False
+    payload = _encode(event_type, guild_id, user_id)
+
+    with _publish_lock:
+        for attempt in range(2):
+            try:
+                if _publish_conn is None or _publish_conn.closed:
+                    _publish_conn = models.get_db_connection(dedicated=True)
+                with _publish_conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+                return True
+            except Exception as e:
+                logger.warning(f"Не удалось опубликовать событие инвалидации ({attempt + 1}): {e}")
+                _publish_conn = None
+    return False
+
+
+def _on_local_stats_changed(guild_id, user_id=None):
+    # События, пришедшие из других процессов, не публикуем повторно
+    if threading.current_thread() is _listener:
+        return
+    publish(USER_STATS if user_id is not None else GUILD_STATS, guild_id, user_id)
+
+
+def _on_local_config_changed(guild_id=None):
+    if threading.current_thread() is _listener:
+        return
+    publish(GUILD_CONFIG, guild_id)
+
+
+def _apply(event):
+    """Replay a remote event through the local notification hooks."""
+    if event.origin == ORIGIN:
+        return
+    if event.type == GUILD_CONFIG:
+        models.notify_config_changed(event.guild_id)
+    elif event.type in (GUILD_STATS, USER_STATS):
+        models.notify_stats_changed(event.guild_id, event.user_id)
+    else:
+        logger.warning(f"Неизвестный тип события инвалидации: {event.type}")
+
+
+def _listen_forever(poll_timeout=30):
+    """Listener thread: LISTEN on the channel and replay events; reconnects on errors."""
+    delay = 1
+    while True:
+        conn = None
+        try:
+            conn = models.get_db_connection(dedicated=True)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            logger.info(f"Подписка на канал инвалидации {CHANNEL} активна")
+
+            # За время переподключения события могли потеряться: сбрасываем все кэши
+            if delay > 1:
+                models.notify_config_changed(None)
+                models.notify_stats_changed(None)
+            delay = 1
+
+            while True:
+                if select.select([conn], [], [], poll_timeout) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        _apply(_decode(notify.payload))
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки события инвалидации {notify.payload!r}: {e}")
+        except Exception as e:
+            logger.error(f"Слушатель инвалидации отключился: {e}, переподключение через {delay} с")
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(delay)
+        delay = min(delay * 2, 60)
+
+
+def start():
+    """Hook into the local notifications and start the listener thread (idempotent)."""
+    global _listener
+    if not storage.get_backend(models.DATABASE_URL).supports_notify:
+        # Встроенная база обслуживает один процесс, рассылать события некому
+        logger.info("База без LISTEN/NOTIFY, шина инвалидации не запускается")
+        return
+    if _listener is not None and _listener.is_alive():
+        return
+    if _listener is None:
+        models.add_stats_listener(_on_local_stats_changed)
+        models.add_config_listener(_on_local_config_changed)
+    _listener = threading.Thread(target=_listen_forever, name='invalidation-bus', daemon=True)
+    _listener.start()
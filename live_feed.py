@@ -0,0 +1,196 @@
+"""
+Живая лента сервера: топ и заполненность голосовых каналов через Server-Sent Events.
+
+Все зрители одного сервера получают события из одного общего источника:
+снимок считается один раз за тик фонового потока и раздается в очереди
+подписчиков, поэтому тысяча открытых страниц стоит одного вычисления.
+Новый подписчик сразу получает текущий снимок, дальше только изменения.
+"""
+
+import os
+import json
+import queue
+import logging
+import threading
+from models import get_leaderboard
+
+logger = logging.getLogger(__name__)
+
+# Интервал пересчета (в секундах), размер топа и очереди одного подписчика
+LIVE_FEED_INTERVAL = float(os.environ.get('LIVE_FEED_INTERVAL', 2))
+LIVE_FEED_TOP = int(os.environ.get('LIVE_FEED_TOP', 25))
+LIVE_FEED_QUEUE_SIZE = 100
+LIVE_FEED_KEEPALIVE = 15
+
+# guild_id -> {'subscribers': set, 'leaderboard': dict, 'voice': dict, 'dirty': bool}
+_feeds = {}
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker = None
+
+# Функция guild_id -> {channel_id: {'name': ..., 'members': [...]}} из кэша бота
+_voice_provider = None
+
+
+def set_voice_provider(provider):
+    """Set the callable that returns current voice channel occupancy of a guild."""
+    global _voice_provider
+    _voice_provider = provider
+
+
+def _format_event(event, data):
+    """Encode one SSE message."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _load_leaderboard(guild_id):
+    """Top of the guild keyed by user id (as string, safe for JavaScript)."""
+    rows = get_leaderboard(guild_id, limit=LIVE_FEED_TOP)
+    return {
+        str(row['user_id']): {'rank': rank, 'contribution': row['contribution'], 'level': row['level']}
+        for rank, row in enumerate(rows, start=1)
+    }
+
+
+def _load_voice(guild_id):
+    """Current voice occupancy from the bot cache (empty if the bot is not available)."""
+    if _voice_provider is None:
+        return {}
+    try:
+        return {str(channel_id): data for channel_id, data in _voice_provider(guild_id).items()}
+    except Exception as e:
+        logger.error(f"Ошибка при получении голосовых каналов сервера {guild_id}: {e}")
+        return {}
+
+
+def _diff(old, new):
+    """Changed and removed keys between two snapshots."""
+    changed = {key: value for key, value in new.items() if old.get(key) != value}
+    removed = [key for key in old if key not in new]
+    return changed, removed
+
+
+def _snapshot_event(feed):
+    return _format_event('snapshot', {'leaderboard': feed['leaderboard'], 'voice': feed['voice']})
+
+
+def _publish(feed, message):
+    """Put a message into every subscriber queue; slow subscribers are resynced with a snapshot."""
+    for subscriber in list(feed['subscribers']):
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            while not subscriber.empty():
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    break
+            subscriber.put_nowait(_snapshot_event(feed))
+
+
+def _refresh(guild_id, feed):
+    """Recompute one guild and publish the deltas; queries run outside the lock."""
+    with _lock:
+        reload_leaderboard = feed['dirty']
+        feed['dirty'] = False
+
+    leaderboard = _load_leaderboard(guild_id) if reload_leaderboard else None
+    voice = _load_voice(guild_id)
+
+    with _lock:
+        if leaderboard is not None:
+            changed, removed = _diff(feed['leaderboard'], leaderboard)
+            feed['leaderboard'] = leaderboard
+            if changed or removed:
+                _publish(feed, _format_event('leaderboard', {'changed': changed, 'removed': removed}))
+
+        changed, removed = _diff(feed['voice'], voice)
+        feed['voice'] = voice
+        if changed or removed:
+            _publish(feed, _format_event('voice', {'changed': changed, 'removed': removed}))
+
+
+def _run():
+    """Background loop: refresh every guild that has at least one subscriber."""
+    while True:
+        _wakeup.wait(LIVE_FEED_INTERVAL)
+        _wakeup.clear()
+
+        with _lock:
+            active = [(guild_id, feed) for guild_id, feed in _feeds.items() if feed['subscribers']]
+
+        for guild_id, feed in active:
+            try:
+                _refresh(guild_id, feed)
+            except Exception as e:
+                logger.error(f"Ошибка обновления живой ленты сервера {guild_id}: {e}")
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is None or not _worker.is_alive():
+        _worker = threading.Thread(target=_run, name='live-feed', daemon=True)
+        _worker.start()
+
+
+def subscribe(guild_id):
+    """Register a subscriber and return its queue, pre-filled with the current snapshot."""
+    subscriber = queue.Queue(maxsize=LIVE_FEED_QUEUE_SIZE)
+
+    with _lock:
+        feed = _feeds.get(guild_id)
+        watched = feed is not None and feed['subscribers']
+
+    if not watched:
+        # Никто не смотрел сервер: считаем свежий снимок для первого зрителя
+        leaderboard = _load_leaderboard(guild_id)
+        voice = _load_voice(guild_id)
+
+    with _lock:
+        feed = _feeds.setdefault(guild_id, {'subscribers': set(), 'leaderboard': {}, 'voice': {}, 'dirty': False})
+        if not feed['subscribers'] and not watched:
+            feed['leaderboard'] = leaderboard
+            feed['voice'] = voice
+        feed['subscribers'].add(subscriber)
+        subscriber.put_nowait(_snapshot_event(feed))
+
+    _ensure_worker()
+    return subscriber
+
+
+def unsubscribe(guild_id, subscriber):
+    """Remove a subscriber; the guild is no longer refreshed once nobody watches it."""
+    with _lock:
+        feed = _feeds.get(guild_id)
+        if feed is not None:
+            feed['subscribers'].discard(subscriber)
+            if not feed['subscribers']:
+                del _feeds[guild_id]
+
+
+def stream(guild_id):
+    """Generator of SSE messages for one client."""
+    subscriber = subscribe(guild_id)
+    try:
+        while True:
+            try:
+                yield subscriber.get(timeout=LIVE_FEED_KEEPALIVE)
+            except queue.Empty:
+                # Комментарий держит соединение открытым и выявляет отключившихся
+                yield ": keepalive\n\n"
+    finally:
+        unsubscribe(guild_id, subscriber)
+
+
+def mark_guild_changed(guild_id, user_id=None):
+    """Stats listener: recompute the guild leaderboard (None = every guild) on the next tick."""
+    with _lock:
+        if guild_id is None:
+            feeds = list(_feeds.values())
+        else:
+            feeds = [_feeds[guild_id]] if guild_id in _feeds else []
+        if not feeds:
+            return
+        for feed in feeds:
+            feed['dirty'] = True
+    _wakeup.set()
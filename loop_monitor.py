@@ -0,0 +1,176 @@
+"""
+Наблюдение за циклом событий бота: задержка планирования и блокирующие вызовы.
+
+Корутина-пульс засыпает на LOOP_MONITOR_INTERVAL и меряет, насколько позже
+она проснулась: это и есть задержка цикла (lag). Отдельный поток-сторож
+смотрит на время последнего пульса. Если цикл не отвечает дольше
+LOOP_BLOCK_THRESHOLD секунд, сторож снимает стек потока цикла
+(sys._current_frames) и текущую задачу (asyncio.current_task) и
+приписывает блокировку обработчику: событию discord.py, slash-команде или
+функции из кода бота, которая сейчас выполняется.
+
+Результаты попадают в метрики (lvolos_loop_lag_seconds,
+lvolos_loop_stalls_total) и в status() для /health.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_INTERVAL = float(os.environ.get('LOOP_MONITOR_INTERVAL', 0.25))
+LOOP_BLOCK_THRESHOLD = float(os.environ.get('LOOP_BLOCK_THRESHOLD', 0.5))
+LOOP_STALL_HISTORY = int(os.environ.get('LOOP_STALL_HISTORY', 20))
+
+# Модули бота: по первому такому кадру стека определяем виновника
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_loop = None
+_loop_thread_id = None
+_last_tick = None
+_last_lag = 0.0
+_max_lag = 0.0
+_stalls = deque(maxlen=LOOP_STALL_HISTORY)
+_current_stall = None
+_lock = threading.Lock()
+
+
+def _project_frame(frames):
+    """Innermost frame that belongs to the bot's own code (not asyncio or discord.py)."""
+    for frame in reversed(frames):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_PROJECT_DIR) and frame.filename != __file__:
+            return frame
+    return None
+
+
+def _handler_name(task, frames):
+    """Describe what is blocking: task name or coroutine, plus the bot function in the stack."""
+    parts = []
+    if task is not None:
+        coro = task.get_coro()
+        name = task.get_name()
+        # discord.py называет задачи событий "discord.py: on_voice_state_update"
+        if name.startswith('discord.py: '):
+            parts.append(name[len('discord.py: '):])
+        else:
+            parts.append(getattr(coro, '__qualname__', name))
+
+    frame = _project_frame(frames)
+    if frame is not None:
+        module = os.path.splitext(os.path.relpath(frame.filename, _PROJECT_DIR))[0].replace(os.sep, '.')
+        parts.append(f"{module}.{frame.name}")
+    return ' > '.join(parts) or 'unknown'
+
+
+def _capture():
+    """Stack and current task of the loop thread while it is blocked."""
+    frame = sys._current_frames().get(_loop_thread_id)
+    frames = traceback.extract_stack(frame) if frame is not None else []
+    try:
+        task = asyncio.current_task(_loop)
+    except RuntimeError:
+        task = None
+    return task, frames
+
+
+async def _pulse():
+    """Measure how late the loop wakes us up."""
+    global _last_tick, _last_lag, _max_lag
+    while True:
+        expected = time.monotonic() + LOOP_MONITOR_INTERVAL
+        await asyncio.sleep(LOOP_MONITOR_INTERVAL)
+        now = time.monotonic()
+        lag = max(0.0, now - expected)
+        metrics.LOOP_LAG_SECONDS.observe(lag)
+        with _lock:
+            _last_tick = now
+            _last_lag = lag
+            _max_lag = max(_max_lag, lag)
+
+
+def _finish_stall(now):
+    global _current_stall
+    stall = _current_stall
+    _current_stall = None
+    stall['duration'] = round(now - stall['started'], 3)
+    metrics.LOOP_STALL_SECONDS.inc(stall['duration'], handler=stall['handler'])
+    logger.warning(f"Цикл событий был заблокирован {stall['duration']:.2f} с обработчиком {stall['handler']}")
+
+
+def _watch():
+    """Watchdog thread: capture the blocking stack once per stall."""
+    global _current_stall
+    while True:
+        time.sleep(LOOP_MONITOR_INTERVAL / 2)
+        now = time.monotonic()
+        with _lock:
+            last_tick = _last_tick
+        if last_tick is None:
+            continue
+
+        blocked_for = now - last_tick - LOOP_MONITOR_INTERVAL
+        if blocked_for < LOOP_BLOCK_THRESHOLD:
+            if _current_stall is not None:
+                with _lock:
+                    _finish_stall(now)
+            continue
+        if _current_stall is not None:
+            continue
+
+        task, frames = _capture()
+        handler = _handler_name(task, frames)
+        stall = {
+            'handler': handler,
+            'started': last_tick + LOOP_MONITOR_INTERVAL,
+            'detected_at': time.time(),
+            'duration': None,
+            'stack': ''.join(traceback.format_list(frames[-15:])),
+        }
+        with _lock:
+            _current_stall = stall
+            _stalls.append(stall)
+        metrics.LOOP_STALLS.inc(handler=handler)
+        logger.warning(f"Цикл событий не отвечает {blocked_for:.2f} с, блокирует {handler}:\n{stall['stack']}")
+
+
+def start(loop):
+    """Start monitoring a running loop (idempotent); call from inside the loop."""
+    global _loop, _loop_thread_id, _last_tick
+    if _loop is loop:
+        return
+    _loop = loop
+    _loop_thread_id = threading.get_ident()
+    _last_tick = time.monotonic()
+    loop.create_task(_pulse(), name='loop-monitor')
+    threading.Thread(target=_watch, name='loop-watchdog', daemon=True).start()
+    logger.info(f"Мониторинг цикла событий запущен (порог блокировки {LOOP_BLOCK_THRESHOLD} с)")
+
+
+def status():
+    """Loop health for /health."""
+    with _lock:
+        if _loop is None:
+            return {'running': False}
+        last_tick_age = time.monotonic() - _last_tick
+        stalls = [
+            {key: value for key, value in stall.items() if key != 'started'}
+            for stall in list(_stalls)
+        ]
+        return {
+            'running': not _loop.is_closed(),
+            'responsive': last_tick_age < LOOP_MONITOR_INTERVAL + LOOP_BLOCK_THRESHOLD,
+            'last_tick_age_s': round(last_tick_age, 3),
+            'last_lag_ms': round(_last_lag * 1000, 1),
+            'max_lag_ms': round(_max_lag * 1000, 1),
+            'blocked_now': _current_stall['handler'] if _current_stall else None,
+            'recent_stalls': stalls,
+        }
@@ -1,15 +1,31 @@
 import os
 import sys
+import hmac
+import json
+import base64
 import logging
 import threading
 import time
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Response, g, render_template, request, redirect, url_for, jsonify, stream_with_context
 import psycopg2
 import psycopg2.extras
 from werkzeug.middleware.proxy_fix import ProxyFix
 from bot import bot
-from models import get_db_connection, get_guild_config, get_leaderboard, get_user_stats
+from models import (get_db_connection, get_read_connection, get_guild_config, get_leaderboard, get_user_stats, get_guild_totals,
+                    add_stats_listener, add_config_listener, get_leaderboard_page, get_user_rank,
+                    iter_guild_user_stats, get_guild_jobs)
+from web_cache import cached_page, invalidate_guild
+import live_feed
+import card_pool
+from future_card import CARD_FORMATS, CARD_SIZES, card_cache_key
+import invalidation_bus
+import db_stats
+import loop_monitor
+import metrics
+import replica
+import storage
+import totals_import
 import utils
 
 # Настройка уровня логирования
@@ -26,20 +42,99 @@ app = Flask(__name__, static_folder='static', static_url_path='/static')
 app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
+# Сбрасываем кэш страниц при изменении статистики или настроек сервера
+add_stats_listener(invalidate_guild)
+add_config_listener(invalidate_guild)
+add_stats_listener(live_feed.mark_guild_changed)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request_time(response):
+    """Время обработки запроса по шаблону маршрута (а не по конкретному URL)"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        metrics.WEB_REQUEST_SECONDS.observe(time.perf_counter() - started, route=route,
+                                            status=response.status_code)
+    return response
+
+# Токен служебных маршрутов (импорт итогов, /debug/queries): заголовок Authorization: Bearer <токен>.
+# Без него маршруты недоступны. Адрес клиента не проверяем: за прокси он всегда локальный
+ADMIN_API_TOKEN = os.environ.get('ADMIN_API_TOKEN')
+
+def admin_authorized():
+    """Whether the request carries ADMIN_API_TOKEN (always False when no token is configured)."""
+    if not ADMIN_API_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {ADMIN_API_TOKEN}")
+
+# Сколько секунд браузер может показывать карточку без перепроверки ETag
+CARD_HTTP_MAX_AGE = int(os.environ.get('CARD_HTTP_MAX_AGE', 60))
+
+# Изменения из других процессов (бот, другие воркеры) приходят через LISTEN/NOTIFY
+invalidation_bus.start()
+
+def voice_occupancy(guild_id):
+    """Кто сейчас сидит в голосовых каналах сервера (по кэшу бота)"""
+    server = bot.get_guild(guild_id)
+    if not server:
+        return {}
+    
+    occupancy = {}
+    for channel in server.voice_channels + server.stage_channels:
+        if not channel.voice_states:
+            continue
+        members = []
+        for user_id in channel.voice_states:
+            member = server.get_member(user_id)
+            members.append({
+                'user_id': str(user_id),
+                'name': member.display_name if member else f"Пользователь {user_id}"
+            })
+        occupancy[channel.id] = {'name': channel.name, 'members': members}
+    return occupancy
+
+live_feed.set_voice_provider(voice_occupancy)
+
+def error_page(message, back_url="/", back_text="Вернуться на главную"):
+    """HTML-страница с ошибкой (не попадает в кэш страниц)"""
+    g.skip_page_cache = True
+    return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Ошибка</title>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
+                h1 {{ color: #e74c3c; }}
+                .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
+            </style>
+        </head>
+        <body>
+            <h1>Произошла ошибка</h1>
+            <div class="error">{message}</div>
+            <p><a href="{back_url}">{back_text}</a></p>
+        </body>
+        </html>
+        """
+
 # Маршруты для веб-интерфейса
 @app.route('/')
+@cached_page()
 def index():
     """Домашняя страница со списком серверов"""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            # Получаем список всех серверов с учетом структуры таблицы
+            # Получаем список всех серверов с заранее подсчитанными итогами
             cursor.execute("""
-                SELECT gs.guild_id, COUNT(DISTINCT us.user_id) AS user_count,
-                       SUM(us.total_seconds)/3600.0 AS total_contribution
+                SELECT gs.guild_id, COALESCE(gt.user_count, 0) AS user_count,
+                       gt.total_seconds/3600.0 AS total_contribution
                 FROM GuildSettings gs
-                LEFT JOIN UserStats us ON gs.guild_id = us.guild_id
-                GROUP BY gs.guild_id
+                LEFT JOIN GuildTotals gt ON gs.guild_id = gt.guild_id
                 ORDER BY user_count DESC
             """)
             guilds = cursor.fetchall()
@@ -70,31 +165,14 @@ def index():
         return render_template('index.html', guilds=guild_list)
     except Exception as e:
         logger.error(f"Ошибка на главной странице: {e}")
-        html_error = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Ошибка</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                h1 {{ color: #e74c3c; }}
-                .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
-            </style>
-        </head>
-        <body>
-            <h1>Произошла ошибка</h1>
-            <div class="error">{str(e)}</div>
-            <p><a href="/">Вернуться на главную</a></p>
-        </body>
-        </html>
-        """
-        return html_error
+        return error_page(str(e))
 
 @app.route('/guild/<int:guild_id>')
+@cached_page()
 def guild_stats(guild_id):
     """Страница статистики сервера"""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection(guild_id)
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
             # Получаем информацию о сервере из GuildSettings
             cursor.execute("""
@@ -103,25 +181,7 @@ def guild_stats(guild_id):
             guild_record = cursor.fetchone()
             
             if not guild_record:
-                html_error = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Ошибка</title>
-                    <style>
-                        body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                        h1 {{ color: #e74c3c; }}
-                        .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
-                    </style>
-                </head>
-                <body>
-                    <h1>Произошла ошибка</h1>
-                    <div class="error">Сервер не найден</div>
-                    <p><a href="/">Вернуться на главную</a></p>
-                </body>
-                </html>
-                """
-                return html_error
+                return error_page("Сервер не найден")
             
             # Получаем данные о сервере из бота если возможно
             server = bot.get_guild(guild_id)
@@ -139,16 +199,8 @@ def guild_stats(guild_id):
             # Получаем лидеров сервера
             leaderboard = get_leaderboard(guild_id, limit=100)
             
-            # Получаем общую статистику
-            cursor.execute("""
-                SELECT COUNT(DISTINCT user_id) as user_count,
-                       SUM(total_seconds)/3600.0 as total_contribution,
-                       SUM(total_seconds) as total_time,
-                       MAX(current_level) as max_level
-                FROM UserStats
-                WHERE guild_id = %s
-            """, (guild_id,))
-            stats = cursor.fetchone()
+            # Получаем общую статистику из GuildTotals
+            stats = get_guild_totals(guild_id)
         
         conn.close()
         return render_template('guild.html', 
@@ -160,31 +212,14 @@ def guild_stats(guild_id):
                               stats=stats)
     except Exception as e:
         logger.error(f"Ошибка на странице сервера: {e}")
-        html_error = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Ошибка</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                h1 {{ color: #e74c3c; }}
-                .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
-            </style>
-        </head>
-        <body>
-            <h1>Произошла ошибка</h1>
-            <div class="error">{str(e)}</div>
-            <p><a href="/">Вернуться на главную</a></p>
-        </body>
-        </html>
-        """
-        return html_error
+        return error_page(str(e))
 
 @app.route('/guild/<int:guild_id>/user/<int:user_id>')
+@cached_page()
 def user_stats(guild_id, user_id):
     """Страница статистики пользователя на сервере"""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection(guild_id)
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
             # Проверяем существование сервера
             cursor.execute("""
@@ -193,25 +228,7 @@ def user_stats(guild_id, user_id):
             guild_record = cursor.fetchone()
             
             if not guild_record:
-                html_error = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Ошибка</title>
-                    <style>
-                        body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                        h1 {{ color: #e74c3c; }}
-                        .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
-                    </style>
-                </head>
-                <body>
-                    <h1>Произошла ошибка</h1>
-                    <div class="error">Сервер не найден</div>
-                    <p><a href="/">Вернуться на главную</a></p>
-                </body>
-                </html>
-                """
-                return html_error
+                return error_page("Сервер не найден")
             
             # Получаем данные о сервере из бота если возможно
             server = bot.get_guild(guild_id)
@@ -227,38 +244,14 @@ def user_stats(guild_id, user_id):
             stats = get_user_stats(user_id, guild_id)
             
             if not stats:
-                html_error = f"""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>Ошибка</title>
-                    <style>
-                        body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                        h1 {{ color: #e74c3c; }}
-                        .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
-                    </style>
-                </head>
-                <body>
-                    <h1>Произошла ошибка</h1>
-                    <div class="error">Пользователь не найден</div>
-                    <p><a href="/guild/{guild_id}">Вернуться к статистике сервера</a></p>
-                </body>
-                </html>
-                """
-                return html_error
+                return error_page("Пользователь не найден", back_url=f"/guild/{guild_id}", back_text="Вернуться к статистике сервера")
             
             # Получаем конфигурацию сервера
             config = get_guild_config(guild_id)
             
-            # Получаем ранг пользователя
-            cursor.execute("""
-                SELECT COUNT(*) + 1 as rank
-                FROM UserStats
-                WHERE guild_id = %s AND total_seconds > 
-                    (SELECT total_seconds FROM UserStats WHERE guild_id = %s AND user_id = %s)
-            """, (guild_id, guild_id, user_id))
-            rank_result = cursor.fetchone()
-            rank = rank_result['rank'] if rank_result else 1
+            
+            # Ранг пользователя (так же, как в API)
+            rank = get_user_rank(user_id, guild_id)
             
         conn.close()
         return render_template('user.html', 
@@ -268,25 +261,44 @@ def user_stats(guild_id, user_id):
                               rank=rank)
     except Exception as e:
         logger.error(f"Ошибка на странице пользователя: {e}")
-        html_error = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Ошибка</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                h1 {{ color: #e74c3c; }}
-                .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
-            </style>
-        </head>
-        <body>
-            <h1>Произошла ошибка</h1>
-            <div class="error">{str(e)}</div>
-            <p><a href="/">Вернуться на главную</a></p>
-        </body>
-        </html>
-        """
-        return html_error
+        return error_page(str(e))
+
+@app.route('/guild/<int:guild_id>/user/<int:user_id>/card')
+def user_card(guild_id, user_id):
+    """Карточка уровня пользователя из кэша карточек.
+
+    Формат выбирается параметром ?format=png|webp или заголовком Accept,
+    размер — параметром ?size=full|thumb.
+    """
+    image_format = request.args.get('format')
+    size = request.args.get('size', 'full')
+    if image_format is None:
+        image_format = 'webp' if request.accept_mimetypes.best_match(['image/png', 'image/webp']) == 'image/webp' else 'png'
+    if image_format not in CARD_FORMATS or size not in CARD_SIZES:
+        return error_page("Неизвестный формат или размер карточки")
+
+    try:
+        params = utils.get_card_params(bot, user_id, guild_id)
+
+        # Ключ кэша — адрес содержимого, поэтому годится как ETag без отрисовки
+        etag = card_cache_key(params, image_format, size)
+        if etag in request.if_none_match:
+            response = Response(status=304)
+        else:
+            data, is_fallback = card_pool.render_card_result(params, image_format, size)
+            response = Response(data, mimetype=CARD_FORMATS[image_format][1])
+            if is_fallback:
+                # Простую карточку не кэшируем: полная скоро будет готова
+                response.headers['Cache-Control'] = 'no-store'
+                return response
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f"public, max-age={CARD_HTTP_MAX_AGE}"
+        response.vary.add('Accept')
+        return response
+    except Exception as e:
+        logger.error(f"Ошибка при генерации карточки: {e}")
+        return error_page(str(e))
 
 @app.route('/card_images')
 def list_card_images():
@@ -294,10 +306,11 @@ def list_card_images():
     return redirect(url_for('index'))
 
 @app.route('/levels')
+@cached_page()
 def levels():
     """Страница с информацией о порогах уровней"""
     try:
-        conn = get_db_connection()
+        conn = get_read_connection()
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
             # Получаем информацию о всех серверах с учетом изменений в схеме
             cursor.execute("""
@@ -331,25 +344,208 @@ def levels():
         return render_template('levels.html', guilds=guild_list)
     except Exception as e:
         logger.error(f"Ошибка на странице уровней: {e}")
-        html_error = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Ошибка</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 40px; line-height: 1.6; }}
-                h1 {{ color: #e74c3c; }}
-                .error {{ background: #f8d7da; border-left: 5px solid #e74c3c; padding: 15px; margin: 20px 0; }}
-            </style>
-        </head>
-        <body>
-            <h1>Произошла ошибка</h1>
-            <div class="error">{str(e)}</div>
-            <p><a href="/">Вернуться на главную</a></p>
-        </body>
-        </html>
-        """
-        return html_error
+        return error_page(str(e))
+
+@app.route('/guild/<int:guild_id>/live')
+def guild_live(guild_id):
+    """Живая лента сервера (Server-Sent Events): снимок, затем изменения топа и голосовых каналов"""
+    return Response(
+        stream_with_context(live_feed.stream(guild_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# JSON API только для чтения
+API_PAGE_LIMIT_DEFAULT = 50
+API_PAGE_LIMIT_MAX = 500
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики бота и веб-интерфейса в текстовом формате Prometheus"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/debug/queries', methods=['GET', 'POST'])
+def debug_queries():
+    """Статистика запросов к базе (нужен ADMIN_API_TOKEN); POST отдает ее и обнуляет"""
+    if not admin_authorized():
+        return api_error("Недоступно", 404)
+    data = db_stats.snapshot()
+    data['statements'] = storage.statement_stats()
+    if request.method == 'POST':
+        db_stats.reset()
+    return jsonify(data)
+
+@app.route('/health')
+def health():
+    """Живость и готовность: бот подключен, цикл событий отвечает, база доступна (503, если нет)"""
+    checks = {'bot_ready': bot.is_ready(), 'loop': loop_monitor.status()}
+    # Реплика не влияет на готовность: без нее чтение идет на основную базу
+    if replica.enabled():
+        checks['replica'] = replica.status()
+    try:
+        conn = get_db_connection()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.close()
+        checks['database'] = True
+    except Exception as e:
+        logger.error(f"Проверка базы для /health не прошла: {e}")
+        checks['database'] = False
+
+    healthy = checks['bot_ready'] and checks['database'] and checks['loop'].get('responsive', False)
+    checks['status'] = 'ok' if healthy else 'unavailable'
+    return jsonify(checks), 200 if healthy else 503
+
+def api_error(message, status):
+    """JSON-ответ с ошибкой"""
+    return jsonify({'error': message}), status
+
+def guild_exists(guild_id):
+    """Проверка наличия сервера в GuildSettings"""
+    conn = get_read_connection(guild_id)
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM GuildSettings WHERE guild_id = %s", (guild_id,))
+    exists = cursor.fetchone() is not None
+    conn.close()
+    return exists
+
+def encode_leaderboard_cursor(row, rank):
+    """Курсор следующей страницы: позиция последней строки в сортировке и ее ранг"""
+    raw = f"{row['total_seconds']}:{row['user_id']}:{rank}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_leaderboard_cursor(cursor):
+    """Разбор курсора, ValueError если курсор поврежден"""
+    try:
+        total_seconds, user_id, rank = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return (int(total_seconds), int(user_id)), int(rank)
+    except Exception:
+        raise ValueError("Некорректный курсор")
+
+@app.route('/api/guild/<int:guild_id>')
+@cached_page()
+def api_guild_overview(guild_id):
+    """Общая статистика сервера"""
+    if not guild_exists(guild_id):
+        return api_error("Сервер не найден", 404)
+    
+    server = bot.get_guild(guild_id)
+    config = get_guild_config(guild_id)
+    totals = get_guild_totals(guild_id)
+    
+    return jsonify({
+        'guild_id': str(guild_id),
+        'guild_name': server.name if server else f"Сервер {guild_id}",
+        'unit_name': config.get('contribution_unit_name', 'часов'),
+        'user_count': totals['user_count'],
+        'total_seconds': totals['total_time'],
+        'total_contribution': totals['total_contribution'],
+        'max_level': totals['max_level']
+    })
+
+@app.route('/api/guild/<int:guild_id>/jobs')
+def api_guild_jobs(guild_id):
+    """Фоновые задачи сброса и удаления данных сервера и их прогресс (нужен ADMIN_API_TOKEN)"""
+    if not admin_authorized():
+        return api_error("Недоступно", 404)
+    jobs = get_guild_jobs(guild_id)
+    for job in jobs:
+        job['guild_id'] = str(job['guild_id'])
+        job['last_user_id'] = str(job['last_user_id'])
+    return jsonify({'guild_id': str(guild_id), 'jobs': jobs})
+
+@app.route('/api/guild/<int:guild_id>/import', methods=['POST'])
+def api_guild_import(guild_id):
+    """Импорт итогов из CSV/Parquet в теле запроса (нужен ADMIN_API_TOKEN); ?mode=set|add&format=csv|parquet"""
+    if not admin_authorized():
+        return api_error("Недоступно", 404)
+    try:
+        report = totals_import.import_totals(
+            guild_id, request.stream, request.args.get('format', 'csv'), request.args.get('mode', 'set')
+        )
+    except ValueError as e:
+        return api_error(str(e), 400)
+    except Exception as e:
+        logger.error(f"Ошибка импорта итогов на сервере {guild_id}: {e}")
+        return api_error("Ошибка базы данных, изменения отменены", 500)
+    report['leveled_up'] = {str(user_id): level for user_id, level in report['leveled_up'].items()}
+    return jsonify(report)
+
+@app.route('/api/guild/<int:guild_id>/leaderboard')
+@cached_page()
+def api_guild_leaderboard(guild_id):
+    """Страница топа сервера с пагинацией по курсору (?limit=&cursor=)"""
+    if not guild_exists(guild_id):
+        return api_error("Сервер не найден", 404)
+    
+    limit = request.args.get('limit', API_PAGE_LIMIT_DEFAULT, type=int)
+    limit = max(1, min(limit, API_PAGE_LIMIT_MAX))
+    
+    after, rank = None, 0
+    if request.args.get('cursor'):
+        try:
+            after, rank = decode_leaderboard_cursor(request.args['cursor'])
+        except ValueError as e:
+            return api_error(str(e), 400)
+    
+    rows = get_leaderboard_page(guild_id, limit=limit, after=after)
+    
+    items = []
+    for row in rows:
+        rank += 1
+        items.append({
+            'rank': rank,
+            'user_id': str(row['user_id']),
+            'total_seconds': row['total_seconds'],
+            'contribution': row['contribution'],
+            'level': row['level']
+        })
+    
+    next_cursor = encode_leaderboard_cursor(rows[-1], rank) if len(rows) == limit else None
+    
+    return jsonify({'guild_id': str(guild_id), 'items': items, 'next_cursor': next_cursor})
+
+@app.route('/api/guild/<int:guild_id>/user/<int:user_id>')
+@cached_page()
+def api_user_stats(guild_id, user_id):
+    """Статистика пользователя на сервере"""
+    if not guild_exists(guild_id):
+        return api_error("Сервер не найден", 404)
+    
+    stats = get_user_stats(user_id, guild_id)
+    next_level = utils.get_next_level_info(stats, guild_id)
+    
+    return jsonify({
+        'guild_id': str(guild_id),
+        'user_id': str(user_id),
+        'total_seconds': stats['total_seconds'],
+        'contribution': stats['contribution'],
+        'level': stats['current_level'],
+        'rank': get_user_rank(user_id, guild_id),
+        'next_level': next_level['next_level'],
+        'next_threshold': next_level['next_threshold'],
+        'progress_percentage': next_level['progress_percentage']
+    })
+
+@app.route('/api/guild/<int:guild_id>/export.ndjson')
+def api_guild_export(guild_id):
+    """Полная выгрузка статистики сервера в NDJSON (одна строка на пользователя)"""
+    if not guild_exists(guild_id):
+        return api_error("Сервер не найден", 404)
+    
+    def generate():
+        rank = 0
+        for row in iter_guild_user_stats(guild_id):
+            rank += 1
+            row['rank'] = rank
+            row['user_id'] = str(row['user_id'])
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename=guild_{guild_id}.ndjson'}
+    )
 
 def run_flask():
     """Запуск веб-сервера Flask"""
@@ -368,6 +564,9 @@ def run_bot():
         logger.error(f"Ошибка при запуске бота: {e}")
 
 if __name__ == '__main__':
+    # Процессы отрисовки карточек создаем до запуска потоков
+    card_pool.start()
+    
     # Запуск Flask в отдельном потоке
     flask_thread = threading.Thread(target=run_flask, daemon=True)
     flask_thread.start()
@@ -0,0 +1,152 @@
+"""
+Ленивая загрузка участников серверов и ограниченный кэш участников.
+
+По умолчанию discord.py при запуске загружает (chunk) и держит в памяти
+всех участников всех серверов. На больших серверах это гигабайты памяти
+и минуты до on_ready, хотя боту нужны только те, кто в голосовых каналах,
+и изредка адресат поздравления или команды.
+
+С MEMBER_CACHE_LAZY=1 (по умолчанию) бот не загружает участников при
+запуске, а discord.py хранит только участников в голосовых каналах
+(MemberCacheFlags.voice). Остальные участники, к которым обращался бот,
+лежат в LRU этого модуля (не больше MEMBER_CACHE_SIZE записей, каждая не
+дольше MEMBER_CACHE_TTL секунд). Тех, кого нет ни там, ни там,
+get_members запрашивает у Discord через query_members по 100
+идентификаторов за запрос, без записи в кэш сервера.
+
+Список участников роли (role_members) при ленивом режиме загружается
+целиком для одного сервера и тоже не попадает в кэш.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import discord
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MEMBER_CACHE_LAZY = os.environ.get('MEMBER_CACHE_LAZY', '1') != '0'
+MEMBER_CACHE_SIZE = int(os.environ.get('MEMBER_CACHE_SIZE', 5000))
+MEMBER_CACHE_TTL = float(os.environ.get('MEMBER_CACHE_TTL', 600))
+
+# Столько идентификаторов Discord принимает в одном запросе участников
+_QUERY_MEMBERS_LIMIT = 100
+
+_members = OrderedDict()  # (guild_id, user_id) -> (Member, stored at monotonic time)
+_lock = threading.Lock()
+
+stats = {'hits': 0, 'misses': 0, 'fetched': 0, 'not_found': 0, 'evictions': 0}
+metrics.register_cache('member', stats)
+
+
+def client_options():
+    """Keyword arguments for the Bot constructor: no startup chunking, only voice members in discord.py's cache."""
+    if not MEMBER_CACHE_LAZY:
+        return {}
+    return {
+        'chunk_guilds_at_startup': False,
+        'member_cache_flags': discord.MemberCacheFlags(voice=True, joined=False),
+    }
+
+
+def remember(member):
+    """Keep a member the bot has just referenced in the LRU."""
+    if not isinstance(member, discord.Member) or MEMBER_CACHE_SIZE <= 0:
+        return
+    key = (member.guild.id, member.id)
+    with _lock:
+        _members[key] = (member, time.monotonic())
+        _members.move_to_end(key)
+        while len(_members) > MEMBER_CACHE_SIZE:
+            _members.popitem(last=False)
+            stats['evictions'] += 1
+
+
+def forget(guild_id, user_id):
+    """Drop a member from the LRU (left the guild, was updated)."""
+    with _lock:
+        _members.pop((guild_id, user_id), None)
+
+
+def forget_guild(guild_id):
+    """Drop every cached member of a guild (the bot left it)."""
+    with _lock:
+        for key in [key for key in _members if key[0] == guild_id]:
+            del _members[key]
+
+
+def peek(guild, user_id):
+    """A member from discord.py's cache or the LRU, without asking Discord; None if not cached."""
+    member = guild.get_member(user_id)
+    if member is not None:
+        return member
+    key = (guild.id, user_id)
+    with _lock:
+        entry = _members.get(key)
+        if entry is None:
+            return None
+        member, stored_at = entry
+        if time.monotonic() - stored_at > MEMBER_CACHE_TTL:
+            del _members[key]
+            return None
+        _members.move_to_end(key)
+        return member
+
+
+def size():
+    """Number of members in the LRU."""
+    with _lock:
+        return len(_members)
+
+
+async def get_members(guild, user_ids):
+    """{user_id: Member} for the user_ids that are members of guild; uncached ones are fetched in batches."""
+    found = {}
+    missing = []
+    for user_id in dict.fromkeys(user_ids):
+        member = peek(guild, user_id)
+        if member is not None:
+            found[user_id] = member
+        else:
+            missing.append(user_id)
+    stats['hits'] += len(found)
+    # Сервер загружен целиком: кого нет в кэше, тот не участник
+    if not missing or guild.chunked:
+        stats['not_found'] += len(missing)
+        return found
+
+    stats['misses'] += len(missing)
+    for start in range(0, len(missing), _QUERY_MEMBERS_LIMIT):
+        chunk = missing[start:start + _QUERY_MEMBERS_LIMIT]
+        members = await guild.query_members(user_ids=chunk, limit=len(chunk), cache=False)
+        stats['fetched'] += len(members)
+        for member in members:
+            remember(member)
+            found[member.id] = member
+    stats['not_found'] += sum(1 for user_id in missing if user_id not in found)
+    return found
+
+
+async def get_member(guild, user_id):
+    """A member of guild by id, fetched from Discord if it is not cached; None if the user is not a member."""
+    return (await get_members(guild, [user_id])).get(user_id)
+
+
+async def role_members(role):
+    """Members of a role; in lazy mode the guild's member list is loaded once without caching it."""
+    guild = role.guild
+    if guild.chunked or not MEMBER_CACHE_LAZY:
+        if not guild.chunked:
+            await guild.chunk()
+        return role.members
+    members = await guild.chunk(cache=False)
+    logger.info(f"Сервер {guild.id}: загружено {len(members)} участников для роли {role.id}")
+    return [member for member in members if member.get_role(role.id) is not None]
+
+
+metrics.MEMBER_CACHE_ENTRIES.set_function(size)
@@ -0,0 +1,238 @@
+"""
+Локальный реестр метрик в текстовом формате Prometheus.
+
+Счетчики, шкалы и гистограммы живут в памяти процесса и отдаются
+маршрутом /metrics. Внешние библиотеки и сервисы не нужны: Prometheus
+(или curl) просто читает страницу. Значения, которые дешевле посчитать в
+момент чтения (размеры кэшей, активные сессии), задаются функциями через
+set_function и вычисляются при каждом запросе /metrics.
+
+Все метрики бота и веб-интерфейса объявлены внизу модуля, чтобы их
+названия и подписи были в одном месте.
+"""
+
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы гистограмм задержек по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def set_function(self, function):
+        """Compute the value at scrape time: function() returns a number, or a dict
+        {label values tuple: number} for labelled metrics."""
+        self._function = function
+
+    def _samples(self):
+        if self._function is None:
+            with self._lock:
+                return list(self._values.items())
+        try:
+            value = self._function()
+        except Exception as e:
+            logger.error(f"Ошибка вычисления метрики {self.name}: {e}")
+            return []
+        if isinstance(value, dict):
+            return [(tuple(str(part) for part in key), val) for key, val in value.items()]
+        return [((), value)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._samples()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down."""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['counts'][i] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, {'counts': list(state['counts']), 'sum': state['sum'], 'count': state['count']})
+                           for key, state in self._values.items())
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# Голосовые события и уровни
+VOICE_EVENTS = Counter('lvolos_voice_events_total', "Обработанные голосовые события", ['type'])
+SESSION_SETTLEMENT_SECONDS = Histogram('lvolos_session_settlement_seconds',
+                                       "Время начисления времени сессии при выходе из канала")
+LEVEL_UPS = Counter('lvolos_level_ups_total', "Повышения уровня")
+ACTIVE_SESSIONS = Gauge('lvolos_active_sessions', "Пользователи в голосовых каналах", ['guild_id'])
+VOICE_INGEST_PENDING = Gauge('lvolos_voice_ingest_pending', "Голосовые события в очереди на применение", ['shard'])
+USERS_ARCHIVED = Counter('lvolos_users_archived_total', "Пользователи, перенесенные в архив после ухода с сервера")
+USERS_RESTORED = Counter('lvolos_users_restored_total', "Пользователи, восстановленные из архива при возвращении")
+MEMBER_CACHE_ENTRIES = Gauge('lvolos_member_cache_entries', "Участники в LRU-кэше member_cache (вне кэша discord.py)")
+
+# Команды бота
+COMMAND_LATENCY_SECONDS = Histogram('lvolos_command_latency_seconds',
+                                    "Время от создания взаимодействия до завершения команды", ['command', 'status'])
+
+# База данных
+DB_CONNECTIONS_OPENED = Counter('lvolos_db_connections_opened_total', "Открытые соединения с базой")
+DB_CONNECTIONS_IN_USE = Gauge('lvolos_db_connections_in_use', "Соединения с базой, используемые сейчас")
+DB_POOL_IDLE = Gauge('lvolos_db_pool_idle', "Свободные соединения в пуле")
+DB_POOL_WAIT_SECONDS = Histogram('lvolos_db_pool_wait_seconds', "Ожидание соединения из пула")
+DB_READS = Counter('lvolos_db_reads_total', "Чтения через get_read_connection: куда направлены и почему",
+                   ['target', 'reason'])
+DB_REPLICA_LAG_SECONDS = Gauge('lvolos_db_replica_lag_seconds', "Отставание реплики по последней проверке")
+DB_STATEMENT_EXECUTIONS = Counter('lvolos_db_statement_executions_total',
+                                  "Выполнения запросов из реестра: prepared (EXECUTE) или text", ['statement', 'mode'])
+DB_STATEMENT_PREPARES = Counter('lvolos_db_statement_prepares_total',
+                                "PREPARE запросов из реестра на соединениях пула", ['statement'])
+GUILD_JOB_ROWS = Counter('lvolos_guild_job_rows_total', "Строки, обработанные фоновыми задачами сброса и удаления",
+                         ['kind'])
+
+# Кэши: попадания и промахи по имени кэша
+CACHE_HITS = Counter('lvolos_cache_hits_total', "Попадания в кэш", ['cache'])
+CACHE_MISSES = Counter('lvolos_cache_misses_total', "Промахи кэша", ['cache'])
+
+_caches = {}  # name -> (stats dict, hit keys, miss keys)
+
+
+def register_cache(name, stats, hits=('hits',), misses=('misses',)):
+    """Export hit and miss counters that a cache module keeps in its stats dict."""
+    _caches[name] = (stats, hits, misses)
+
+
+CACHE_HITS.set_function(lambda: {
+    (name,): sum(stats[key] for key in hits) for name, (stats, hits, _) in list(_caches.items())
+})
+CACHE_MISSES.set_function(lambda: {
+    (name,): sum(stats[key] for key in misses) for name, (stats, _, misses) in list(_caches.items())
+})
+
+# Цикл событий бота
+LOOP_LAG_SECONDS = Histogram('lvolos_loop_lag_seconds', "Задержка планирования цикла событий бота",
+                             buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+LOOP_STALLS = Counter('lvolos_loop_stalls_total', "Блокировки цикла событий по обработчикам", ['handler'])
+LOOP_STALL_SECONDS = Counter('lvolos_loop_stall_seconds_total',
+                             "Суммарное время блокировок цикла по обработчикам", ['handler'])
+
+# Карточки
+CARD_RENDER_SECONDS = Histogram('lvolos_card_render_seconds', "Время отрисовки карточки", ['kind'])
+
+# Веб-интерфейс
+WEB_REQUEST_SECONDS = Histogram('lvolos_web_request_seconds', "Время обработки веб-запроса", ['route', 'status'])
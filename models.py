@@ -1,25 +1,228 @@
 import os
-import psycopg2
-import psycopg2.extras
+import copy
+import time
 import json
 import logging
+import threading
 from datetime import datetime
+import metrics
+import replica
+import storage
 
 logger = logging.getLogger(__name__)
 
-# Получаем данные подключения к PostgreSQL из переменных окружения
+# Адрес базы: postgresql://... или sqlite:///путь/к/файлу.db (см. storage.py)
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Слушатели изменений статистики и настроек (кэши страниц и т.п.)
+_stats_listeners = []
+
+def add_stats_listener(listener):
+    """Register a callable(guild_id, user_id) invoked after guild or user stats change."""
+    _stats_listeners.append(listener)
+
+def notify_stats_changed(guild_id, user_id=None):
+    """Tell registered listeners that stats of a guild (or one of its users) changed."""
+    replica.mark_written(guild_id)
+    for listener in _stats_listeners:
+        try:
+            listener(guild_id, user_id)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике изменения статистики: {e}")
+
+# Кэш настроек серверов: guild_id -> (expires_at, config)
+CONFIG_CACHE_TTL = int(os.environ.get('CONFIG_CACHE_TTL', 300))
+_config_cache = {}
+_config_cache_stats = {'hits': 0, 'misses': 0}
+metrics.register_cache('guild_config', _config_cache_stats)
+_config_cache_lock = threading.Lock()
+_config_generation = 0
+_config_listeners = []
+
+def add_config_listener(listener):
+    """Register a callable(guild_id) invoked after guild settings change (None = all guilds)."""
+    _config_listeners.append(listener)
+
+def notify_config_changed(guild_id=None):
+    """Drop cached settings of a guild (or of all guilds) and tell registered listeners."""
+    global _config_generation
+    replica.mark_written(guild_id)
+    with _config_cache_lock:
+        _config_generation += 1
+        if guild_id is None:
+            _config_cache.clear()
+        else:
+            _config_cache.pop(guild_id, None)
+    
+    for listener in _config_listeners:
+        try:
+            listener(guild_id)
+        except Exception as e:
+            logger.error(f"Ошибка в обработчике изменения настроек: {e}")
+
 # Функция для получения соединения с базой данных
-def get_db_connection():
+def get_db_connection(autocommit=True, dedicated=False):
+    """Connection from the pool; close() returns it. dedicated=True opens a separate one (LISTEN)."""
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        conn.autocommit = True
-        return conn
+        return storage.get_backend(DATABASE_URL).connect(autocommit, dedicated)
     except Exception as e:
         logger.error(f"Ошибка подключения к базе данных: {e}")
         raise
 
+# Частые запросы голосовых событий, уровней и топа: на соединениях пула
+# Postgres они готовятся (PREPARE) один раз и дальше выполняются через EXECUTE
+ACTIVE_USER_EXISTS = storage.statement(
+    'active_user_exists',
+    "SELECT user_id FROM ActiveUsers WHERE user_id = %s AND guild_id = %s"
+)
+ACTIVE_USER_INSERT = storage.statement(
+    'active_user_insert',
+    """
+    INSERT INTO ActiveUsers 
+    (user_id, guild_id, channel_id, join_time, is_muted, is_deafened, is_server_muted, is_server_deafened)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """
+)
+ACTIVE_USER_REJOIN = storage.statement(
+    'active_user_rejoin',
+    """
+    UPDATE ActiveUsers 
+    SET channel_id = %s, join_time = %s, is_muted = %s, is_deafened = %s, is_server_muted = %s, is_server_deafened = %s
+    WHERE user_id = %s AND guild_id = %s
+    """
+)
+ACTIVE_USER_STATE = storage.statement(
+    'active_user_state',
+    """
+    UPDATE ActiveUsers 
+    SET is_muted = %s, is_deafened = %s, is_server_muted = %s, is_server_deafened = %s
+    WHERE user_id = %s AND guild_id = %s
+    """
+)
+ACTIVE_SESSION = storage.statement(
+    'active_session',
+    """
+    SELECT channel_id, join_time, is_muted, is_deafened, is_server_muted, is_server_deafened 
+    FROM ActiveUsers 
+    WHERE user_id = %s AND guild_id = %s
+    """
+)
+ACTIVE_USER_DELETE = storage.statement(
+    'active_user_delete',
+    "DELETE FROM ActiveUsers WHERE user_id = %s AND guild_id = %s"
+)
+USER_STATS_EXISTS = storage.statement(
+    'user_stats_exists',
+    "SELECT user_id FROM UserStats WHERE user_id = %s AND guild_id = %s"
+)
+USER_STATS_JOIN = storage.statement(
+    'user_stats_join',
+    """
+    UPDATE UserStats 
+    SET last_voice_join = %s, last_channel_id = %s, last_active_at = %s
+    WHERE user_id = %s AND guild_id = %s
+    """
+)
+USER_STATS_CREDIT = storage.statement(
+    'user_stats_credit',
+    """
+    UPDATE UserStats 
+    SET total_seconds = total_seconds + %s, last_voice_join = NULL, last_channel_id = NULL, last_active_at = %s
+    WHERE user_id = %s AND guild_id = %s
+    """
+)
+USER_STATS_LEAVE = storage.statement(
+    'user_stats_leave',
+    """
+    UPDATE UserStats 
+    SET last_voice_join = NULL, last_channel_id = NULL, last_active_at = %s
+    WHERE user_id = %s AND guild_id = %s
+    """
+)
+USER_EVENT_SEQ = storage.statement(
+    'user_event_seq',
+    "SELECT last_event_seq FROM UserStats WHERE user_id = %s AND guild_id = %s FOR UPDATE"
+)
+USER_EVENT_SEQ_UPDATE = storage.statement(
+    'user_event_seq_update',
+    "UPDATE UserStats SET last_event_seq = %s WHERE user_id = %s AND guild_id = %s"
+)
+USER_LEVEL_STATS = storage.statement(
+    'user_level_stats',
+    "SELECT total_seconds, current_level FROM UserStats WHERE user_id = %s AND guild_id = %s"
+)
+USER_LEVEL_UPDATE = storage.statement(
+    'user_level_update',
+    "UPDATE UserStats SET current_level = %s WHERE user_id = %s AND guild_id = %s"
+)
+GUILD_TOTALS_DELTA = storage.statement(
+    'guild_totals_delta',
+    """
+    INSERT INTO GuildTotals (guild_id, user_count, total_seconds, max_level, updated_at)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (guild_id) DO UPDATE
+    SET user_count = GuildTotals.user_count + EXCLUDED.user_count,
+        total_seconds = GuildTotals.total_seconds + EXCLUDED.total_seconds,
+        max_level = GREATEST(GuildTotals.max_level, EXCLUDED.max_level),
+        updated_at = EXCLUDED.updated_at
+    """
+)
+LEADERBOARD = storage.statement(
+    'leaderboard',
+    """
+    SELECT user_id, total_seconds, current_level 
+    FROM UserStats 
+    WHERE guild_id = %s 
+    ORDER BY total_seconds DESC
+    LIMIT %s OFFSET %s
+    """
+)
+LEADERBOARD_FIRST_PAGE = storage.statement(
+    'leaderboard_first_page',
+    """
+    SELECT user_id, total_seconds, current_level 
+    FROM UserStats 
+    WHERE guild_id = %s 
+    ORDER BY total_seconds DESC, user_id
+    LIMIT %s
+    """
+)
+LEADERBOARD_NEXT_PAGE = storage.statement(
+    'leaderboard_next_page',
+    """
+    SELECT user_id, total_seconds, current_level 
+    FROM UserStats 
+    WHERE guild_id = %s 
+      AND (total_seconds < %s OR (total_seconds = %s AND user_id > %s))
+    ORDER BY total_seconds DESC, user_id
+    LIMIT %s
+    """
+)
+USER_RANK = storage.statement(
+    'user_rank',
+    """
+    SELECT CASE WHEN own.total_seconds IS NULL THEN NULL ELSE
+        (SELECT COUNT(*) + 1 FROM UserStats WHERE guild_id = %s AND total_seconds > own.total_seconds)
+    END
+    FROM (SELECT COALESCE(
+        (SELECT total_seconds FROM UserStats WHERE guild_id = %s AND user_id = %s),
+        (SELECT total_seconds FROM UserStatsArchive WHERE guild_id = %s AND user_id = %s)
+    ) AS total_seconds) own
+    """
+)
+
+def get_read_connection(guild_id=None):
+    """Connection for read-only queries: the replica when it is safe to use, else the primary.
+
+    guild_id is the guild the read is about; guilds written to moments ago
+    are read from the primary (see replica.py).
+    """
+    target, reason, conn = replica.choose(guild_id, lambda: storage.get_backend(replica.DATABASE_REPLICA_URL).connect())
+    metrics.DB_READS.inc(target=target, reason=reason)
+    if target == 'replica':
+        return conn
+    return get_db_connection()
+
 def update_all_level_thresholds(cursor=None):
     """Обновить пороги уровней для всех серверов до нового формата."""
     close_conn = False
@@ -57,6 +260,8 @@ def update_all_level_thresholds(cursor=None):
     
     if close_conn:
         conn.close()
+    
+    notify_config_changed()
         
     return True
 
@@ -99,6 +304,31 @@ def init_db():
     )
     ''')
     
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_userstats_guild_level ON UserStats (guild_id, current_level)"
+    )
+    
+    # Index for leaderboard keyset pagination and rank lookups
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_userstats_guild_seconds ON UserStats (guild_id, total_seconds DESC, user_id)"
+    )
+    
+    # Create GuildTotals table with pre-aggregated per-guild numbers
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS GuildTotals (
+        guild_id BIGINT PRIMARY KEY,
+        user_count INTEGER DEFAULT 0,
+        total_seconds BIGINT DEFAULT 0,
+        max_level INTEGER DEFAULT 0,
+        updated_at TEXT DEFAULT NULL
+    )
+    ''')
+    
+    # Fill GuildTotals once for databases created before the table existed
+    cursor.execute("SELECT 1 FROM GuildTotals LIMIT 1")
+    if cursor.fetchone() is None:
+        rebuild_guild_totals(cursor=cursor)
+    
     # Create ActiveUsers table to track currently active users
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS ActiveUsers (
@@ -114,9 +344,152 @@ def init_db():
     )
     ''')
     
+    # Last voice activity, used to archive users who left long ago
+    if add_column(cursor, 'UserStats', 'last_active_at', 'TEXT DEFAULT NULL'):
+        # Existing users get a full ARCHIVE_INACTIVE_DAYS from now before they can be archived
+        cursor.execute(
+            "UPDATE UserStats SET last_active_at = %s WHERE last_active_at IS NULL",
+            (datetime.now().isoformat(),)
+        )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_userstats_guild_active ON UserStats (guild_id, last_active_at)"
+    )
+    
+    # Sequence number of the last voice event applied to the user (see voice_ingest.py)
+    add_column(cursor, 'UserStats', 'last_event_seq', 'BIGINT DEFAULT 0')
+    
+    # Create UserStatsArchive table: users moved out of UserStats after leaving the guild
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS UserStatsArchive (
+        user_id BIGINT,
+        guild_id BIGINT,
+        total_seconds BIGINT DEFAULT 0,
+        current_level INTEGER DEFAULT 0,
+        last_active_at TEXT DEFAULT NULL,
+        archived_at TEXT,
+        PRIMARY KEY (user_id, guild_id)
+    )
+    ''')
+    
+    # Index for batched per-guild jobs that walk a guild's users by user_id
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_userstats_guild_user ON UserStats (guild_id, user_id)"
+    )
+    
+    # Create GuildJobs table: progress of background reset/purge jobs
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS GuildJobs (
+        guild_id BIGINT,
+        kind TEXT,
+        status TEXT DEFAULT 'pending',
+        last_user_id BIGINT DEFAULT -1,
+        processed INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        owner TEXT DEFAULT NULL,
+        heartbeat_at TEXT DEFAULT NULL,
+        created_at TEXT,
+        updated_at TEXT,
+        finished_at TEXT DEFAULT NULL,
+        error TEXT DEFAULT NULL,
+        PRIMARY KEY (guild_id, kind)
+    )
+    ''')
+    
     conn.close()
     logger.info("Database initialized successfully.")
 
+def add_column(cursor, table, column, definition):
+    """Add a column to an existing table unless it is already there; True if it was added."""
+    cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+    if column.lower() in (description[0].lower() for description in cursor.description):
+        return False
+    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    logger.info(f"В таблицу {table} добавлена колонка {column}")
+    return True
+
+def rebuild_guild_totals(guild_id=None, cursor=None):
+    """Recompute GuildTotals from UserStats for one guild or for all guilds."""
+    close_conn = False
+    if cursor is None:
+        conn = get_db_connection(autocommit=False)
+        cursor = conn.cursor()
+        close_conn = True
+
+    current_time = datetime.now().isoformat()
+
+    if guild_id is None:
+        cursor.execute("DELETE FROM GuildTotals")
+        cursor.execute(
+            """
+            INSERT INTO GuildTotals (guild_id, user_count, total_seconds, max_level, updated_at)
+            SELECT guild_id, COUNT(*), COALESCE(SUM(total_seconds), 0), COALESCE(MAX(current_level), 0), %s
+            FROM UserStats
+            GROUP BY guild_id
+            """,
+            (current_time,)
+        )
+    else:
+        cursor.execute("DELETE FROM GuildTotals WHERE guild_id = %s", (guild_id,))
+        cursor.execute(
+            """
+            INSERT INTO GuildTotals (guild_id, user_count, total_seconds, max_level, updated_at)
+            SELECT %s, COUNT(*), COALESCE(SUM(total_seconds), 0), COALESCE(MAX(current_level), 0), %s
+            FROM UserStats
+            WHERE guild_id = %s
+            """,
+            (guild_id, current_time, guild_id)
+        )
+
+    rebuilt = cursor.rowcount
+    logger.info(f"Пересчитаны итоги для {rebuilt} серверов")
+
+    if close_conn:
+        conn.commit()
+        conn.close()
+
+    return rebuilt
+
+def apply_guild_totals_delta(cursor, guild_id, user_count=0, total_seconds=0, level=0):
+    """Add deltas to a guild's GuildTotals row inside the caller's transaction."""
+    GUILD_TOTALS_DELTA.execute(cursor, (guild_id, user_count, total_seconds, level, datetime.now().isoformat()))
+
+def refresh_guild_max_level(cursor, guild_id):
+    """Recompute max_level after a level went down (uses the guild/level index)."""
+    cursor.execute(
+        """
+        UPDATE GuildTotals
+        SET max_level = COALESCE((SELECT MAX(current_level) FROM UserStats WHERE guild_id = %s), 0),
+            updated_at = %s
+        WHERE guild_id = %s
+        """,
+        (guild_id, datetime.now().isoformat(), guild_id)
+    )
+
+def get_guild_totals(guild_id):
+    """Get pre-aggregated totals for a guild."""
+    conn = get_read_connection(guild_id)
+    cursor = conn.cursor()
+
+    cursor.execute(
+        "SELECT user_count, total_seconds, max_level FROM GuildTotals WHERE guild_id = %s",
+        (guild_id,)
+    )
+
+    result = cursor.fetchone()
+    conn.close()
+
+    if result is None:
+        user_count, total_seconds, max_level = 0, 0, 0
+    else:
+        user_count, total_seconds, max_level = result
+
+    return {
+        'user_count': user_count,
+        'total_time': total_seconds,
+        'total_contribution': total_seconds / 3600,
+        'max_level': max_level
+    }
+
 def create_default_guild_config(guild_id):
     """Create default configuration for a new guild."""
     conn = get_db_connection()
@@ -130,11 +503,32 @@ def create_default_guild_config(guild_id):
             (guild_id,)
         )
         logger.info(f"Created default configuration for guild {guild_id}")
+        notify_stats_changed(guild_id)
     
     conn.close()
 
 def get_guild_config(guild_id):
-    """Get configuration for a specific guild."""
+    """Get configuration for a specific guild (cached for CONFIG_CACHE_TTL seconds)."""
+    with _config_cache_lock:
+        cached = _config_cache.get(guild_id)
+        generation = _config_generation
+    
+    if cached is not None and cached[0] > time.monotonic():
+        _config_cache_stats['hits'] += 1
+        return copy.deepcopy(cached[1])
+    
+    _config_cache_stats['misses'] += 1
+    config = load_guild_config(guild_id)
+    
+    with _config_cache_lock:
+        # Не сохраняем, если настройки успели измениться во время загрузки
+        if generation == _config_generation:
+            _config_cache[guild_id] = (time.monotonic() + CONFIG_CACHE_TTL, config)
+    
+    return copy.deepcopy(config)
+
+def load_guild_config(guild_id):
+    """Read configuration for a specific guild from the database."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -194,15 +588,11 @@ def update_guild_config(guild_id, setting, value):
         )
     
     conn.close()
+    notify_config_changed(guild_id)
     return True
 
-def record_user_join_voice(user_id, guild_id, channel_id, is_muted, is_deafened, is_server_muted, is_server_deafened):
-    """Record when a user joins a voice channel."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    current_time = datetime.now().isoformat()
-    
+def _open_session(cursor, user_id, guild_id, channel_id, is_muted, is_deafened, is_server_muted, is_server_deafened, started_at):
+    """Start (or restart) a voice session inside the caller's transaction; True if the user is new to the guild."""
     # Convert boolean values to integers (0/1) for PostgreSQL
     is_muted_int = 1 if is_muted else 0
     is_deafened_int = 1 if is_deafened else 0
@@ -210,84 +600,55 @@ def record_user_join_voice(user_id, guild_id, channel_id, is_muted, is_deafened,
     is_server_deafened_int = 1 if is_server_deafened else 0
     
     # Check if user is already in ActiveUsers
-    cursor.execute(
-        "SELECT user_id FROM ActiveUsers WHERE user_id = %s AND guild_id = %s",
-        (user_id, guild_id)
-    )
+    ACTIVE_USER_EXISTS.execute(cursor, (user_id, guild_id))
     
     if cursor.fetchone() is None:
         # Insert new record
-        cursor.execute(
-            """
-            INSERT INTO ActiveUsers 
-            (user_id, guild_id, channel_id, join_time, is_muted, is_deafened, is_server_muted, is_server_deafened)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (user_id, guild_id, channel_id, current_time, is_muted_int, is_deafened_int, is_server_muted_int, is_server_deafened_int)
+        ACTIVE_USER_INSERT.execute(
+            cursor,
+            (user_id, guild_id, channel_id, started_at, is_muted_int, is_deafened_int, is_server_muted_int, is_server_deafened_int)
         )
     else:
         # Update existing record
-        cursor.execute(
-            """
-            UPDATE ActiveUsers 
-            SET channel_id = %s, join_time = %s, is_muted = %s, is_deafened = %s, is_server_muted = %s, is_server_deafened = %s
-            WHERE user_id = %s AND guild_id = %s
-            """,
-            (channel_id, current_time, is_muted_int, is_deafened_int, is_server_muted_int, is_server_deafened_int, user_id, guild_id)
+        ACTIVE_USER_REJOIN.execute(
+            cursor,
+            (channel_id, started_at, is_muted_int, is_deafened_int, is_server_muted_int, is_server_deafened_int, user_id, guild_id)
         )
     
     # Also update the UserStats table
-    cursor.execute(
-        "SELECT user_id FROM UserStats WHERE user_id = %s AND guild_id = %s",
-        (user_id, guild_id)
-    )
+    USER_STATS_EXISTS.execute(cursor, (user_id, guild_id))
     
     if cursor.fetchone() is None:
-        # User doesn't have stats yet, create them
+        # User doesn't have stats yet: bring them back from the archive or create them
+        total_seconds, current_level = restore_archived_user(cursor, user_id, guild_id) or (0, 0)
         cursor.execute(
             """
             INSERT INTO UserStats 
-            (user_id, guild_id, total_seconds, current_level, last_voice_join, last_channel_id)
-            VALUES (%s, %s, 0, 0, %s, %s)
-            """,
-            (user_id, guild_id, current_time, channel_id)
-        )
-    else:
-        # Update last join time
-        cursor.execute(
-            """
-            UPDATE UserStats 
-            SET last_voice_join = %s, last_channel_id = %s
-            WHERE user_id = %s AND guild_id = %s
+            (user_id, guild_id, total_seconds, current_level, last_voice_join, last_channel_id, last_active_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
             """,
-            (current_time, channel_id, user_id, guild_id)
+            (user_id, guild_id, total_seconds, current_level, started_at, channel_id, started_at)
         )
+        apply_guild_totals_delta(cursor, guild_id, user_count=1, total_seconds=total_seconds, level=current_level)
+        return True
     
-    conn.close()
+    # Update last join time
+    USER_STATS_JOIN.execute(cursor, (started_at, channel_id, started_at, user_id, guild_id))
+    return False
 
-def record_user_leave_voice(user_id, guild_id):
-    """Record when a user leaves a voice channel and calculate time spent."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get the guild config to check settings
-    config = get_guild_config(guild_id)
-    
+def _close_session(cursor, config, user_id, guild_id, ended_at):
+    """Credit and end a user's voice session inside the caller's transaction.
+
+    ended_at=None closes the session without credit (the leave time is unknown).
+    Returns (had_session, new_level): new_level is set when the user leveled up.
+    """
     # Get active user record
-    cursor.execute(
-        """
-        SELECT channel_id, join_time, is_muted, is_deafened, is_server_muted, is_server_deafened 
-        FROM ActiveUsers 
-        WHERE user_id = %s AND guild_id = %s
-        """,
-        (user_id, guild_id)
-    )
+    ACTIVE_SESSION.execute(cursor, (user_id, guild_id))
     
     active_record = cursor.fetchone()
     if not active_record:
         # User wasn't in active records
-        conn.close()
-        return
+        return False, None
     
     channel_id, join_time, is_muted, is_deafened, is_server_muted, is_server_deafened = active_record
     
@@ -313,43 +674,159 @@ def record_user_leave_voice(user_id, guild_id):
     if is_server_deafened and not config['count_server_deafened']:
         should_count = False
     
-    if should_count:
-        # Calculate time spent in voice
-        join_dt = datetime.fromisoformat(join_time)
-        leave_dt = datetime.now()
-        time_spent = (leave_dt - join_dt).total_seconds()
-        
-        if time_spent > 0:
-            # Add time to user's total
-            cursor.execute(
-                """
-                UPDATE UserStats 
-                SET total_seconds = total_seconds + %s, last_voice_join = NULL, last_channel_id = NULL
-                WHERE user_id = %s AND guild_id = %s
-                """,
-                (time_spent, user_id, guild_id)
-            )
+    join_dt = datetime.fromisoformat(join_time)
+    if ended_at is None:
+        # Unknown leave time: the user was last seen when the session started
+        should_count = False
+        ended_at = join_dt
+    
+    # Calculate time spent in voice
+    time_spent = round((ended_at - join_dt).total_seconds()) if should_count else 0
+    
+    if time_spent > 0:
+        # Add time to user's total
+        USER_STATS_CREDIT.execute(cursor, (time_spent, ended_at.isoformat(), user_id, guild_id))
+        apply_guild_totals_delta(cursor, guild_id, total_seconds=time_spent)
     else:
         # Just clear the last_voice_join without adding time
-        cursor.execute(
-            """
-            UPDATE UserStats 
-            SET last_voice_join = NULL, last_channel_id = NULL
-            WHERE user_id = %s AND guild_id = %s
-            """,
-            (user_id, guild_id)
-        )
+        USER_STATS_LEAVE.execute(cursor, (ended_at.isoformat(), user_id, guild_id))
     
     # Remove user from active users
-    cursor.execute(
-        "DELETE FROM ActiveUsers WHERE user_id = %s AND guild_id = %s",
-        (user_id, guild_id)
-    )
+    ACTIVE_USER_DELETE.execute(cursor, (user_id, guild_id))
     
     # Update user's level
-    update_user_level(cursor, user_id, guild_id, config)
+    return True, update_user_level(cursor, user_id, guild_id, config)
+
+def record_user_join_voice(user_id, guild_id, channel_id, is_muted, is_deafened, is_server_muted, is_server_deafened):
+    """Record when a user joins a voice channel."""
+    conn = get_db_connection(autocommit=False)
+    cursor = conn.cursor()
+    
+    new_user = _open_session(
+        cursor, user_id, guild_id, channel_id, is_muted, is_deafened, is_server_muted, is_server_deafened,
+        datetime.now().isoformat()
+    )
+    
+    conn.commit()
+    conn.close()
+    metrics.VOICE_EVENTS.inc(type='join')
+    
+    if new_user:
+        notify_stats_changed(guild_id, user_id)
+
+def record_user_leave_voice(user_id, guild_id):
+    """Record when a user leaves a voice channel and calculate time spent."""
+    started = time.perf_counter()
+    conn = get_db_connection(autocommit=False)
+    cursor = conn.cursor()
+    
+    # Get the guild config to check settings
+    config = get_guild_config(guild_id)
+    
+    had_session, _ = _close_session(cursor, config, user_id, guild_id, datetime.now())
+    if not had_session:
+        conn.close()
+        metrics.VOICE_EVENTS.inc(type='leave_without_session')
+        return
+    
+    conn.commit()
+    conn.close()
+    metrics.VOICE_EVENTS.inc(type='leave')
+    metrics.SESSION_SETTLEMENT_SECONDS.observe(time.perf_counter() - started)
+    
+    notify_stats_changed(guild_id, user_id)
+
+def _apply_voice_event(cursor, guild_id, user_id, seq, occurred_at, channel_id,
+                       is_muted=False, is_deafened=False, is_server_muted=False, is_server_deafened=False):
+    """Apply one sequenced voice event inside the caller's transaction; returns (result, stats_changed)."""
+    config = get_guild_config(guild_id)
+    
+    # Строка пользователя блокируется: события одного пользователя из разных процессов применяются по очереди
+    USER_EVENT_SEQ.execute(cursor, (user_id, guild_id))
+    result = cursor.fetchone()
+    if result is not None and result[0] is not None and seq <= result[0]:
+        return {'action': 'stale', 'level_up': None}, False
+    
+    ACTIVE_SESSION.execute(cursor, (user_id, guild_id))
+    session = cursor.fetchone()
+    flags = (is_muted, is_deafened, is_server_muted, is_server_deafened)
+    level_up = None
+    new_user = False
+    
+    if channel_id is None:
+        action = 'noop'
+        if session is not None:
+            _, level_up = _close_session(cursor, config, user_id, guild_id, occurred_at)
+            action = 'leave'
+    elif session is None or session[0] != channel_id:
+        action = 'join'
+        if session is not None:
+            # Переход в другой канал: старая сессия засчитывается, новая начинается с того же момента
+            _, level_up = _close_session(cursor, config, user_id, guild_id, occurred_at)
+            action = 'move'
+        new_user = _open_session(cursor, user_id, guild_id, channel_id, *flags, occurred_at.isoformat())
+    elif tuple(bool(flag) for flag in session[2:]) != tuple(bool(flag) for flag in flags):
+        action = 'state'
+        ACTIVE_USER_STATE.execute(cursor, tuple(1 if flag else 0 for flag in flags) + (user_id, guild_id))
+    else:
+        action = 'noop'
     
+    USER_EVENT_SEQ_UPDATE.execute(cursor, (seq, user_id, guild_id))
+    return {'action': action, 'level_up': level_up}, action in ('leave', 'move') or new_user
+
+def apply_voice_events(events):
+    """Apply a batch of sequenced voice events (see apply_voice_event) in one transaction.
+
+    Events are tuples in apply_voice_event's argument order and are applied
+    in the given order; returns one result per event.
+    """
+    started = time.perf_counter()
+    conn = get_db_connection(autocommit=False)
+    try:
+        cursor = conn.cursor()
+        results = []
+        changed = []
+        for event in events:
+            result, stats_changed = _apply_voice_event(cursor, *event)
+            results.append(result)
+            if stats_changed:
+                changed.append((event[0], event[1]))
+        conn.commit()
+    finally:
+        conn.close()
+    
+    for result in results:
+        metrics.VOICE_EVENTS.inc(type=result['action'])
+    if any(result['action'] in ('leave', 'move') for result in results):
+        metrics.SESSION_SETTLEMENT_SECONDS.observe(time.perf_counter() - started)
+    for guild_id, user_id in dict.fromkeys(changed):
+        notify_stats_changed(guild_id, user_id)
+    return results
+
+def apply_voice_event(guild_id, user_id, seq, occurred_at, channel_id,
+                      is_muted=False, is_deafened=False, is_server_muted=False, is_server_deafened=False):
+    """Bring a user's session to the state reported by a sequenced voice event.
+
+    The event says "as of occurred_at the user is in channel_id (None: not
+    in voice) with these flags". Applying it is idempotent: an event whose
+    seq is not above the user's last_event_seq is a duplicate or arrived
+    out of order and is dropped, and an event that matches the current
+    session changes nothing. Time is credited up to occurred_at, not to
+    the moment the event is applied; a leave event (channel_id=None) with
+    occurred_at=None closes the session without credit.
+    Returns {'action': join|leave|move|state|noop|stale, 'level_up': new level or None}.
+    """
+    return apply_voice_events([(guild_id, user_id, seq, occurred_at, channel_id,
+                                is_muted, is_deafened, is_server_muted, is_server_deafened)])[0]
+
+def get_active_user_ids(guild_id):
+    """Users the database considers in voice on a guild."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id FROM ActiveUsers WHERE guild_id = %s", (guild_id,))
+    user_ids = [row[0] for row in cursor.fetchall()]
     conn.close()
+    return user_ids
 
 def update_user_voice_state(user_id, guild_id, is_muted, is_deafened, is_server_muted, is_server_deafened):
     """Update a user's voice state in the ActiveUsers table."""
@@ -362,28 +839,39 @@ def update_user_voice_state(user_id, guild_id, is_muted, is_deafened, is_server_
     is_server_muted_int = 1 if is_server_muted else 0
     is_server_deafened_int = 1 if is_server_deafened else 0
     
-    cursor.execute(
-        """
-        UPDATE ActiveUsers 
-        SET is_muted = %s, is_deafened = %s, is_server_muted = %s, is_server_deafened = %s
-        WHERE user_id = %s AND guild_id = %s
-        """,
-        (is_muted_int, is_deafened_int, is_server_muted_int, is_server_deafened_int, user_id, guild_id)
+    ACTIVE_USER_STATE.execute(
+        cursor, (is_muted_int, is_deafened_int, is_server_muted_int, is_server_deafened_int, user_id, guild_id)
     )
     
     conn.close()
+    metrics.VOICE_EVENTS.inc(type='state')
+
+def count_active_sessions():
+    """Number of users currently in voice, per guild."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT guild_id, COUNT(*) FROM ActiveUsers GROUP BY guild_id")
+    counts = {(guild_id,): count for guild_id, count in cursor.fetchall()}
+    conn.close()
+    return counts
+
+metrics.ACTIVE_SESSIONS.set_function(count_active_sessions)
 
 def get_user_stats(user_id, guild_id):
     """Get stats for a specific user on a specific guild."""
-    conn = get_db_connection()
+    conn = get_read_connection(guild_id)
     cursor = conn.cursor()
     
-    cursor.execute(
-        "SELECT total_seconds, current_level FROM UserStats WHERE user_id = %s AND guild_id = %s",
-        (user_id, guild_id)
-    )
+    USER_LEVEL_STATS.execute(cursor, (user_id, guild_id))
     
     result = cursor.fetchone()
+    if result is None:
+        # Archived users keep their stats until they come back
+        cursor.execute(
+            "SELECT total_seconds, current_level FROM UserStatsArchive WHERE user_id = %s AND guild_id = %s",
+            (user_id, guild_id)
+        )
+        result = cursor.fetchone()
     
     if result is None:
         # User doesn't have stats yet
@@ -412,19 +900,10 @@ def get_user_stats(user_id, guild_id):
 
 def get_leaderboard(guild_id, limit=10, offset=0):
     """Get the top users by contribution."""
-    conn = get_db_connection()
+    conn = get_read_connection(guild_id)
     cursor = conn.cursor()
     
-    cursor.execute(
-        """
-        SELECT user_id, total_seconds, current_level 
-        FROM UserStats 
-        WHERE guild_id = %s 
-        ORDER BY total_seconds DESC
-        LIMIT %s OFFSET %s
-        """,
-        (guild_id, limit, offset)
-    )
+    LEADERBOARD.execute(cursor, (guild_id, limit, offset))
     
     results = cursor.fetchall()
     
@@ -440,60 +919,162 @@ def get_leaderboard(guild_id, limit=10, offset=0):
     conn.close()
     return leaderboard
 
-def update_user_level(cursor, user_id, guild_id, config=None):
-    """Update a user's level based on their contribution."""
-    if config is None:
-        # Get guild config if not provided
-        config = get_guild_config(guild_id)
+def get_leaderboard_page(guild_id, limit=50, after=None):
+    """Get a leaderboard page using keyset pagination.
+
+    `after` is the (total_seconds, user_id) of the last row of the previous
+    page; rows are ordered by total_seconds DESC, user_id ASC.
+    """
+    conn = get_read_connection(guild_id)
+    cursor = conn.cursor()
     
-    # Get user's current stats
-    cursor.execute(
-        "SELECT total_seconds, current_level FROM UserStats WHERE user_id = %s AND guild_id = %s",
-        (user_id, guild_id)
-    )
+    if after is None:
+        LEADERBOARD_FIRST_PAGE.execute(cursor, (guild_id, limit))
+    else:
+        after_seconds, after_user_id = after
+        LEADERBOARD_NEXT_PAGE.execute(cursor, (guild_id, after_seconds, after_seconds, after_user_id, limit))
     
-    result = cursor.fetchone()
-    if result is None:
-        return None
+    results = cursor.fetchall()
+    conn.close()
     
-    total_seconds, current_level = result
-    contribution = total_seconds / 3600  # Convert seconds to hours/contribution
+    return [
+        {
+            'user_id': user_id,
+            'total_seconds': total_seconds,
+            'contribution': total_seconds / 3600,
+            'level': current_level
+        }
+        for user_id, total_seconds, current_level in results
+    ]
+
+def get_user_rank(user_id, guild_id):
+    """Get a user's position on the guild leaderboard (1 = top).
+
+    An archived user is ranked by their archived total_seconds; a user with
+    no stats at all has no rank (None).
+    """
+    conn = get_read_connection(guild_id)
+    cursor = conn.cursor()
     
-    # Get level thresholds
-    thresholds = config['level_thresholds']
+    USER_RANK.execute(cursor, (guild_id, guild_id, user_id, guild_id, user_id))
     
-    # Find the highest level the user should have
-    new_level = 0
-    for level, required_contribution in thresholds.items():
-        level_num = int(level)
-        if contribution >= required_contribution and level_num > new_level:
+    result = cursor.fetchone()
+    conn.close()
+    
+    return result[0] if result else None
+
+def iter_guild_user_stats(guild_id, batch_size=1000):
+    """Yield every user's stats of a guild through a server-side cursor.
+
+    Rows are fetched `batch_size` at a time, so memory use does not depend
+    on the guild size. The connection is closed when the generator finishes
+    or is closed by the caller.
+    """
+    conn = get_read_connection(guild_id)
+    conn.autocommit = False
+    try:
+        cursor = conn.cursor(name=f"guild_export_{guild_id}")
+        cursor.itersize = batch_size
+        cursor.execute(
+            """
+            SELECT user_id, total_seconds, current_level 
+            FROM UserStats 
+            WHERE guild_id = %s 
+            ORDER BY total_seconds DESC, user_id
+            """,
+            (guild_id,)
+        )
+        
+        for user_id, total_seconds, current_level in cursor:
+            yield {
+                'user_id': user_id,
+                'total_seconds': total_seconds,
+                'contribution': total_seconds / 3600,
+                'level': current_level
+            }
+    finally:
+        conn.close()
+
+def level_for_seconds(thresholds, total_seconds):
+    """Highest level whose threshold (in contribution = hours) is reached."""
+    contribution = total_seconds / 3600  # Convert seconds to hours/contribution
+    new_level = 0
+    for level, required_contribution in thresholds.items():
+        level_num = int(level)
+        if contribution >= required_contribution and level_num > new_level:
             new_level = level_num
+    return new_level
+
+def update_user_level(cursor, user_id, guild_id, config=None):
+    """Update a user's level based on their contribution."""
+    if config is None:
+        # Get guild config if not provided
+        config = get_guild_config(guild_id)
+    
+    # Get user's current stats
+    USER_LEVEL_STATS.execute(cursor, (user_id, guild_id))
+    
+    result = cursor.fetchone()
+    if result is None:
+        return None
+    
+    total_seconds, current_level = result
+    new_level = level_for_seconds(config['level_thresholds'], total_seconds)
     
     # Check if level increased
     level_increased = new_level > current_level
     
     if level_increased:
         # Update user's level
-        cursor.execute(
-            "UPDATE UserStats SET current_level = %s WHERE user_id = %s AND guild_id = %s",
-            (new_level, user_id, guild_id)
-        )
+        USER_LEVEL_UPDATE.execute(cursor, (new_level, user_id, guild_id))
+        apply_guild_totals_delta(cursor, guild_id, level=new_level)
+        metrics.LEVEL_UPS.inc()
         
         return new_level
     
     return None
 
+def _create_user_stats(cursor, user_id, guild_id):
+    """Insert a missing UserStats row inside the caller's transaction; returns (total_seconds, current_level).
+
+    A user coming back from the archive gets their archived stats, anyone else starts from zero.
+    """
+    result = restore_archived_user(cursor, user_id, guild_id) or (0, 0)
+    # Активность отсчитывается от создания строки: иначе архивация забрала бы пользователя сразу
+    cursor.execute(
+        """
+        INSERT INTO UserStats 
+        (user_id, guild_id, total_seconds, current_level, last_active_at)
+        VALUES (%s, %s, %s, %s, %s)
+        """,
+        (user_id, guild_id, result[0], result[1], datetime.now().isoformat())
+    )
+    apply_guild_totals_delta(cursor, guild_id, user_count=1, total_seconds=result[0], level=result[1])
+    return result
+
 def set_user_contribution(user_id, guild_id, contribution):
     """Manually set a user's contribution amount."""
-    conn = get_db_connection()
+    conn = get_db_connection(autocommit=False)
     cursor = conn.cursor()
     
     # Convert contribution to seconds
-    total_seconds = contribution * 3600
+    total_seconds = round(contribution * 3600)
     
     # Get guild config
     config = get_guild_config(guild_id)
     
+    # Lock the current row so the totals delta matches what we overwrite
+    cursor.execute(
+        "SELECT total_seconds, current_level FROM UserStats WHERE user_id = %s AND guild_id = %s FOR UPDATE",
+        (user_id, guild_id)
+    )
+    
+    result = cursor.fetchone()
+    
+    if result is None:
+        # User doesn't have stats yet, create them
+        result = _create_user_stats(cursor, user_id, guild_id)
+    
     # Update user's total seconds
     cursor.execute(
         """
@@ -503,38 +1084,29 @@ def set_user_contribution(user_id, guild_id, contribution):
         """,
         (total_seconds, user_id, guild_id)
     )
-    
-    affected = cursor.rowcount
-    
-    if affected == 0:
-        # User doesn't have stats yet, create them
-        cursor.execute(
-            """
-            INSERT INTO UserStats 
-            (user_id, guild_id, total_seconds, current_level)
-            VALUES (%s, %s, %s, 0)
-            """,
-            (user_id, guild_id, total_seconds)
-        )
+    apply_guild_totals_delta(cursor, guild_id, total_seconds=total_seconds - result[0])
     
     # Update user's level
     new_level = update_user_level(cursor, user_id, guild_id, config)
     
+    conn.commit()
     conn.close()
     
+    notify_stats_changed(guild_id, user_id)
+    
     return new_level
 
 def adjust_user_contribution(user_id, guild_id, adjustment):
     """Adjust a user's contribution by the given amount."""
-    conn = get_db_connection()
+    conn = get_db_connection(autocommit=False)
     cursor = conn.cursor()
     
     # Convert adjustment to seconds
-    seconds_adjustment = adjustment * 3600
+    seconds_adjustment = round(adjustment * 3600)
     
     # Get current stats
     cursor.execute(
-        "SELECT total_seconds FROM UserStats WHERE user_id = %s AND guild_id = %s",
+        "SELECT total_seconds, current_level FROM UserStats WHERE user_id = %s AND guild_id = %s FOR UPDATE",
         (user_id, guild_id)
     )
     
@@ -542,27 +1114,20 @@ def adjust_user_contribution(user_id, guild_id, adjustment):
     
     if result is None:
         # User doesn't have stats yet, create them
-        total_seconds = max(0, seconds_adjustment)  # Don't allow negative
-        cursor.execute(
-            """
-            INSERT INTO UserStats 
-            (user_id, guild_id, total_seconds, current_level)
-            VALUES (%s, %s, %s, 0)
-            """,
-            (user_id, guild_id, total_seconds)
-        )
-    else:
-        total_seconds = result[0]
-        new_total = max(0, total_seconds + seconds_adjustment)  # Don't allow negative
-        
-        cursor.execute(
-            """
-            UPDATE UserStats 
-            SET total_seconds = %s
-            WHERE user_id = %s AND guild_id = %s
-            """,
-            (new_total, user_id, guild_id)
-        )
+        result = _create_user_stats(cursor, user_id, guild_id)
+    
+    total_seconds = result[0]
+    new_total = max(0, total_seconds + seconds_adjustment)  # Don't allow negative
+    
+    cursor.execute(
+        """
+        UPDATE UserStats 
+        SET total_seconds = %s
+        WHERE user_id = %s AND guild_id = %s
+        """,
+        (new_total, user_id, guild_id)
+    )
+    apply_guild_totals_delta(cursor, guild_id, total_seconds=new_total - total_seconds)
     
     # Get guild config
     config = get_guild_config(guild_id)
@@ -570,15 +1135,29 @@ def adjust_user_contribution(user_id, guild_id, adjustment):
     # Update user's level
     new_level = update_user_level(cursor, user_id, guild_id, config)
     
+    conn.commit()
     conn.close()
     
+    notify_stats_changed(guild_id, user_id)
+    
     return new_level
 
 def set_user_level(user_id, guild_id, level):
     """Manually set a user's level."""
-    conn = get_db_connection()
+    conn = get_db_connection(autocommit=False)
     cursor = conn.cursor()
     
+    cursor.execute(
+        "SELECT total_seconds, current_level FROM UserStats WHERE user_id = %s AND guild_id = %s FOR UPDATE",
+        (user_id, guild_id)
+    )
+    
+    result = cursor.fetchone()
+    
+    if result is None:
+        # User doesn't have stats yet, create them
+        result = _create_user_stats(cursor, user_id, guild_id)
+    
     # Update user's level
     cursor.execute(
         """
@@ -588,58 +1167,692 @@ def set_user_level(user_id, guild_id, level):
         """,
         (level, user_id, guild_id)
     )
+    if level < result[1]:
+        refresh_guild_max_level(cursor, guild_id)
+    else:
+        apply_guild_totals_delta(cursor, guild_id, level=level)
     
-    if cursor.rowcount == 0:
-        # User doesn't have stats yet, create them
+    conn.commit()
+    conn.close()
+    
+    notify_stats_changed(guild_id, user_id)
+    
+    return level
+
+def reset_user_stats(user_id, guild_id):
+    """Reset a user's stats to zero."""
+    conn = get_db_connection(autocommit=False)
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "SELECT total_seconds FROM UserStats WHERE user_id = %s AND guild_id = %s FOR UPDATE",
+        (user_id, guild_id)
+    )
+    
+    result = cursor.fetchone()
+    
+    if result is not None:
         cursor.execute(
             """
-            INSERT INTO UserStats 
-            (user_id, guild_id, total_seconds, current_level)
-            VALUES (%s, %s, 0, %s)
+            UPDATE UserStats 
+            SET total_seconds = 0, current_level = 0
+            WHERE user_id = %s AND guild_id = %s
             """,
-            (user_id, guild_id, level)
+            (user_id, guild_id)
         )
+        apply_guild_totals_delta(cursor, guild_id, total_seconds=-result[0])
+        refresh_guild_max_level(cursor, guild_id)
     
+    # Иначе при возвращении пользователя restore_archived_user вернул бы старую статистику
+    cursor.execute("DELETE FROM UserStatsArchive WHERE user_id = %s AND guild_id = %s", (user_id, guild_id))
+    
+    conn.commit()
     conn.close()
     
-    return level
+    notify_stats_changed(guild_id, user_id)
 
-def reset_user_stats(user_id, guild_id):
-    """Reset a user's stats to zero."""
+def reset_guild_stats(guild_id):
+    """Reset all users' stats in a guild as a background job (see guild_jobs.py); returns the job."""
+    return enqueue_guild_job(guild_id, 'reset')
+
+def purge_guild_data(guild_id):
+    """Delete all stats and settings of a guild as a background job (see guild_jobs.py); returns the job."""
+    return enqueue_guild_job(guild_id, 'purge')
+
+# Фоновые задачи сервера: сброс и удаление данных короткими транзакциями по GUILD_JOB_BATCH_SIZE строк
+
+GUILD_JOB_KINDS = ('reset', 'purge')
+
+_GUILD_JOB_COLUMNS = ('guild_id', 'kind', 'status', 'last_user_id', 'processed', 'total',
+                      'owner', 'heartbeat_at', 'created_at', 'updated_at', 'finished_at', 'error')
+
+def _guild_job_dict(row):
+    return dict(zip(_GUILD_JOB_COLUMNS, row)) if row else None
+
+def get_guild_job(guild_id, kind):
+    """Current state of a guild job, or None if it never ran."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(_GUILD_JOB_COLUMNS)} FROM GuildJobs WHERE guild_id = %s AND kind = %s",
+        (guild_id, kind)
+    )
+    job = _guild_job_dict(cursor.fetchone())
+    conn.close()
+    return job
+
+def get_guild_jobs(guild_id=None, unfinished=False):
+    """Jobs of a guild (or of all guilds), oldest first; unfinished=True keeps pending and running ones."""
+    conditions = []
+    params = []
+    if guild_id is not None:
+        conditions.append("guild_id = %s")
+        params.append(guild_id)
+    if unfinished:
+        conditions.append("status IN ('pending', 'running')")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        f"SELECT {', '.join(_GUILD_JOB_COLUMNS)} FROM GuildJobs {where} ORDER BY created_at",
+        params
+    )
+    jobs = [_guild_job_dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return jobs
+
+def enqueue_guild_job(guild_id, kind):
+    """Schedule a reset or purge of a guild.
+
+    A pending or running job is returned as is; a failed one is resumed from
+    where it stopped; a finished one starts over.
+    """
+    if kind not in GUILD_JOB_KINDS:
+        raise ValueError(f"Неизвестный тип задачи: {kind}")
+    conn = get_db_connection(autocommit=False)
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    
+    cursor.execute(
+        "SELECT status FROM GuildJobs WHERE guild_id = %s AND kind = %s FOR UPDATE",
+        (guild_id, kind)
+    )
+    result = cursor.fetchone()
+    cursor.execute("SELECT COUNT(*) FROM UserStats WHERE guild_id = %s", (guild_id,))
+    remaining = cursor.fetchone()[0]
+    
+    if result is None:
+        cursor.execute(
+            """
+            INSERT INTO GuildJobs (guild_id, kind, status, total, created_at, updated_at)
+            VALUES (%s, %s, 'pending', %s, %s, %s)
+            """,
+            (guild_id, kind, remaining, now, now)
+        )
+    elif result[0] == 'failed':
+        cursor.execute(
+            "UPDATE GuildJobs SET status = 'pending', error = NULL, updated_at = %s WHERE guild_id = %s AND kind = %s",
+            (now, guild_id, kind)
+        )
+    elif result[0] == 'done':
+        cursor.execute(
+            """
+            UPDATE GuildJobs
+            SET status = 'pending', last_user_id = -1, processed = 0, total = %s, owner = NULL,
+                heartbeat_at = NULL, created_at = %s, updated_at = %s, finished_at = NULL, error = NULL
+            WHERE guild_id = %s AND kind = %s
+            """,
+            (remaining, now, now, guild_id, kind)
+        )
+    
+    conn.commit()
+    conn.close()
+    
+    job = get_guild_job(guild_id, kind)
+    if result is None or result[0] != job['status']:
+        logger.info(f"Задача {kind} для сервера {guild_id} поставлена в очередь ({remaining} пользователей)")
+    return job
+
+def claim_guild_job(guild_id, kind, owner, lease_seconds):
+    """Take a pending job, or a running one whose owner stopped renewing it; True if claimed."""
+    now = datetime.now()
+    stale = datetime.fromtimestamp(now.timestamp() - lease_seconds).isoformat()
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.execute(
+        """
+        UPDATE GuildJobs
+        SET status = 'running', owner = %s, heartbeat_at = %s, updated_at = %s
+        WHERE guild_id = %s AND kind = %s AND status IN ('pending', 'running')
+          AND (owner IS NULL OR owner = %s OR heartbeat_at IS NULL OR heartbeat_at < %s)
+        """,
+        (owner, now.isoformat(), now.isoformat(), guild_id, kind, owner, stale)
+    )
+    claimed = cursor.rowcount == 1
+    conn.close()
+    return claimed
+
+def run_guild_job_batch(guild_id, kind, owner, batch_size):
+    """Process the next batch_size users of a claimed job in one short transaction.
+
+    The job's user_id cursor advances in the same transaction, so a job
+    interrupted at any point resumes after the last committed batch.
+    Returns the job state, or None if the job is no longer ours.
+    """
+    conn = get_db_connection(autocommit=False)
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    
+    cursor.execute(
+        "SELECT last_user_id, owner, status FROM GuildJobs WHERE guild_id = %s AND kind = %s FOR UPDATE",
+        (guild_id, kind)
+    )
+    result = cursor.fetchone()
+    if result is None or result[1] != owner or result[2] != 'running':
+        conn.rollback()
+        conn.close()
+        return None
+    last_user_id = result[0]
     
     cursor.execute(
         """
-        UPDATE UserStats 
-        SET total_seconds = 0, current_level = 0
-        WHERE user_id = %s AND guild_id = %s
+        SELECT user_id, total_seconds FROM UserStats
+        WHERE guild_id = %s AND user_id > %s
+        ORDER BY user_id
+        LIMIT %s
+        FOR UPDATE
         """,
-        (user_id, guild_id)
+        (guild_id, last_user_id, batch_size)
     )
+    rows = cursor.fetchall()
     
+    if rows:
+        user_ids = [row[0] for row in rows]
+        seconds = sum(row[1] for row in rows)
+        if kind == 'reset':
+            cursor.execute(
+                "UPDATE UserStats SET total_seconds = 0, current_level = 0 WHERE guild_id = %s AND user_id = ANY(%s)",
+                (guild_id, user_ids)
+            )
+            apply_guild_totals_delta(cursor, guild_id, total_seconds=-seconds)
+        else:
+            cursor.execute(
+                "DELETE FROM UserStats WHERE guild_id = %s AND user_id = ANY(%s)",
+                (guild_id, user_ids)
+            )
+            apply_guild_totals_delta(cursor, guild_id, user_count=-len(rows), total_seconds=-seconds)
+        cursor.execute(
+            """
+            UPDATE GuildJobs
+            SET last_user_id = %s, processed = processed + %s, heartbeat_at = %s, updated_at = %s
+            WHERE guild_id = %s AND kind = %s
+            """,
+            (user_ids[-1], len(rows), now, now, guild_id, kind)
+        )
+        metrics.GUILD_JOB_ROWS.inc(len(rows), kind=kind)
+    
+    finished = len(rows) < batch_size
+    if finished:
+        cursor.execute("DELETE FROM ActiveUsers WHERE guild_id = %s", (guild_id,))
+        cursor.execute("DELETE FROM UserStatsArchive WHERE guild_id = %s", (guild_id,))
+        if kind == 'reset':
+            refresh_guild_max_level(cursor, guild_id)
+        else:
+            cursor.execute("DELETE FROM GuildTotals WHERE guild_id = %s", (guild_id,))
+            cursor.execute("DELETE FROM GuildSettings WHERE guild_id = %s", (guild_id,))
+        cursor.execute(
+            """
+            UPDATE GuildJobs
+            SET status = 'done', owner = NULL, finished_at = %s, updated_at = %s
+            WHERE guild_id = %s AND kind = %s
+            """,
+            (now, now, guild_id, kind)
+        )
+    
+    conn.commit()
     conn.close()
+    
+    if rows or finished:
+        notify_stats_changed(guild_id)
+    if finished and kind == 'purge':
+        notify_config_changed(guild_id)
+    return get_guild_job(guild_id, kind)
 
-def reset_guild_stats(guild_id):
-    """Reset all users' stats in a guild."""
+def fail_guild_job(guild_id, kind, error):
+    """Mark a job failed; enqueue_guild_job resumes it from its cursor."""
     conn = get_db_connection()
     cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE GuildJobs SET status = 'failed', owner = NULL, error = %s, updated_at = %s WHERE guild_id = %s AND kind = %s",
+        (str(error), datetime.now().isoformat(), guild_id, kind)
+    )
+    conn.close()
+
+# Массовые операции: несколько запросов на весь список вместо нескольких на каждого пользователя
+
+def _lock_user_stats(cursor, guild_id, user_ids):
+    """Lock existing UserStats rows of the given users; returns {user_id: (total_seconds, current_level)}."""
+    user_ids = list(user_ids)
+    stats = {}
+    # Списки по 1000: у SQLite есть предел числа параметров в запросе
+    for start in range(0, len(user_ids), 1000):
+        cursor.execute(
+            """
+            SELECT user_id, total_seconds, current_level FROM UserStats
+            WHERE guild_id = %s AND user_id = ANY(%s)
+            FOR UPDATE
+            """,
+            (guild_id, user_ids[start:start + 1000])
+        )
+        stats.update((user_id, (total_seconds, level)) for user_id, total_seconds, level in cursor.fetchall())
+    return stats
+
+def _apply_bulk_totals_delta(cursor, guild_id, before, after, new_users=0):
+    """Update GuildTotals from {user_id: (total_seconds, level)} of the same users before and after a bulk change.
+
+    This is the only place a bulk operation looks beyond its own rows: when
+    some level went down, max_level is recomputed (refresh_guild_max_level,
+    a lookup on the guild/level index).
+    """
+    if not after:
+        return
+    seconds = sum(after[user_id][0] - before.get(user_id, (0, 0))[0] for user_id in after)
+    max_level = max(level for _, level in after.values())
+    apply_guild_totals_delta(cursor, guild_id, user_count=new_users, total_seconds=seconds, level=max_level)
+    if any(level < before.get(user_id, (0, 0))[1] for user_id, (_, level) in after.items()):
+        refresh_guild_max_level(cursor, guild_id)
+
+def _bulk_update_users(guild_id, rows, set_clause, recompute_levels=True):
+    """Create missing UserStats rows for (user_id, value) pairs (archived users are restored), then apply set_clause in one UPDATE.
+
+    set_clause refers to the new value as input.value. With recompute_levels
+    the levels of the affected users are raised to match their time and
+    {user_id: new_level} of those who leveled up is returned. Without it the
+    values are levels set by hand, and {user_id: level} is returned for users
+    whose level went up compared to their locked level before the update.
+    GuildTotals gets the difference between the locked and the updated rows.
+    """
+    rows = list(rows)
+    if not rows:
+        return {}
+    config = get_guild_config(guild_id)
+    conn = get_db_connection(autocommit=False)
+    try:
+        cursor = conn.cursor()
+        
+        user_ids = [user_id for user_id, _ in rows]
+        now = datetime.now().isoformat()
+        for start in range(0, len(user_ids), 1000):
+            restore_archived_users(cursor, guild_id, "user_id = ANY(%s)", (user_ids[start:start + 1000],))
+        # Значения до изменения читаются под блокировкой в той же транзакции,
+        # чтобы параллельное начисление времени не исказило итоги и список повышений
+        before = _lock_user_stats(cursor, guild_id, user_ids)
+        missing = [user_id for user_id in user_ids if user_id not in before]
+        inserted = []
+        if missing:
+            inserted = storage.execute_values(
+                cursor,
+                """
+                INSERT INTO UserStats (user_id, guild_id, total_seconds, current_level, last_active_at)
+                VALUES %s
+                ON CONFLICT (user_id, guild_id) DO NOTHING
+                RETURNING user_id
+                """,
+                [(user_id, guild_id, 0, 0, now) for user_id in missing],
+                fetch=True
+            )
+            before.update((row[0], (0, 0)) for row in inserted)
+            # Строки, которые успела создать другая транзакция
+            raced = [user_id for user_id in missing if user_id not in before]
+            if raced:
+                before.update(_lock_user_stats(cursor, guild_id, raced))
+        
+        updated = storage.execute_values(
+            cursor,
+            f"""
+            WITH input (user_id, guild_id, value) AS (VALUES %s)
+            UPDATE UserStats
+            SET {set_clause}
+            FROM input
+            WHERE UserStats.user_id = input.user_id AND UserStats.guild_id = input.guild_id
+            RETURNING UserStats.user_id, UserStats.total_seconds, UserStats.current_level
+            """,
+            [(user_id, guild_id, value) for user_id, value in rows],
+            fetch=True
+        )
+        
+        if recompute_levels:
+            leveled_up = _raise_levels(cursor, guild_id, updated, config)
+        else:
+            leveled_up = {user_id: level for user_id, _, level in updated if level > before[user_id][1]}
+        after = {user_id: (total_seconds, leveled_up.get(user_id, level)) for user_id, total_seconds, level in updated}
+        _apply_bulk_totals_delta(cursor, guild_id, before, after, new_users=len(inserted))
+        
+        conn.commit()
+    finally:
+        conn.close()
+    
+    notify_stats_changed(guild_id)
+    return leveled_up
+
+def _raise_levels(cursor, guild_id, rows, config):
+    """Apply level-ups for (user_id, total_seconds, current_level) rows; returns {user_id: new_level}."""
+    thresholds = config['level_thresholds']
+    leveled_up = {}
+    for user_id, total_seconds, current_level in rows:
+        new_level = level_for_seconds(thresholds, total_seconds)
+        if new_level > current_level:
+            leveled_up[user_id] = new_level
+    
+    if leveled_up:
+        storage.execute_values(
+            cursor,
+            """
+            WITH input (user_id, guild_id, level) AS (VALUES %s)
+            UPDATE UserStats
+            SET current_level = input.level
+            FROM input
+            WHERE UserStats.user_id = input.user_id AND UserStats.guild_id = input.guild_id
+            """,
+            [(user_id, guild_id, level) for user_id, level in leveled_up.items()]
+        )
+        metrics.LEVEL_UPS.inc(len(leveled_up))
+    return leveled_up
+
+def bulk_set_user_contribution(guild_id, contributions):
+    """Set contribution for many users: contributions is an iterable of (user_id, contribution).
+
+    Returns {user_id: new_level} for users who leveled up.
+    """
+    seconds = {user_id: round(contribution * 3600) for user_id, contribution in contributions}
+    return _bulk_update_users(guild_id, seconds.items(), "total_seconds = input.value")
+
+def bulk_adjust_user_contribution(guild_id, adjustments):
+    """Add (or subtract) contribution for many users: adjustments is an iterable of (user_id, adjustment).
+
+    Totals never go below zero. Returns {user_id: new_level} for users who leveled up.
+    """
+    seconds = {}
+    for user_id, adjustment in adjustments:
+        seconds[user_id] = seconds.get(user_id, 0) + round(adjustment * 3600)
+    return _bulk_update_users(guild_id, seconds.items(), "total_seconds = GREATEST(UserStats.total_seconds + input.value, 0)")
+
+def bulk_set_user_level(guild_id, levels):
+    """Set the level of many users: levels is an iterable of (user_id, level).
+
+    Returns {user_id: level} for users whose level went up.
+    """
+    # Как и set_user_level, ручной уровень не пересчитывается по времени
+    return _bulk_update_users(guild_id, dict(levels).items(), "current_level = input.value", recompute_levels=False)
+
+def bulk_reset_user_stats(guild_id, user_ids):
+    """Reset time and level of many users to zero; returns the number of users reset (archived ones included)."""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return 0
+    conn = get_db_connection(autocommit=False)
+    cursor = conn.cursor()
     
+    before = _lock_user_stats(cursor, guild_id, user_ids)
+    locked = list(before)
+    for start in range(0, len(locked), 1000):
+        cursor.execute(
+            "UPDATE UserStats SET total_seconds = 0, current_level = 0 WHERE guild_id = %s AND user_id = ANY(%s)",
+            (guild_id, locked[start:start + 1000])
+        )
+    _apply_bulk_totals_delta(cursor, guild_id, before, {user_id: (0, 0) for user_id in locked})
+    # Архивная статистика тоже сбрасывается, иначе она вернулась бы при возвращении пользователя
+    archived = set()
+    for start in range(0, len(user_ids), 1000):
+        cursor.execute(
+            "DELETE FROM UserStatsArchive WHERE guild_id = %s AND user_id = ANY(%s) RETURNING user_id",
+            (guild_id, user_ids[start:start + 1000])
+        )
+        archived.update(row[0] for row in cursor.fetchall())
+    reset = len(archived.union(locked))
+    
+    conn.commit()
+    conn.close()
+    
+    notify_stats_changed(guild_id)
+    return reset
+
+# Импорт итогов из других ботов: строки загружаются во временную таблицу (COPY) и сливаются одним запросом
+
+IMPORT_MODES = ('set', 'add')
+
+def import_user_totals(guild_id, rows, mode='set'):
+    """Load (user_id, total_seconds) rows into UserStats with one upsert.
+
+    mode='set' replaces users' time (the largest value wins for repeated
+    users), mode='add' adds to it (repeated users are summed). Levels are
+    raised in bulk afterwards. Returns {'rows', 'users', 'leveled_up'}.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Неизвестный режим импорта: {mode}")
+    config = get_guild_config(guild_id)
+    conn = get_db_connection(autocommit=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("CREATE TEMP TABLE ImportStaging (user_id BIGINT, total_seconds BIGINT)")
+        loaded = storage.copy_rows(cursor, 'ImportStaging', ('user_id', 'total_seconds'), rows)
+        
+        # Архивные пользователи возвращаются со своим временем: 'add' прибавит к нему
+        restore_archived_users(cursor, guild_id, "user_id IN (SELECT user_id FROM ImportStaging)")
+        
+        # Время до импорта: строки блокируются, чтобы разница для GuildTotals была точной
+        cursor.execute(
+            """
+            SELECT total_seconds FROM UserStats
+            WHERE guild_id = %s AND user_id IN (SELECT user_id FROM ImportStaging)
+            FOR UPDATE
+            """,
+            (guild_id,)
+        )
+        existing = cursor.fetchall()
+        seconds_before = sum(row[0] for row in existing)
+        
+        if mode == 'set':
+            aggregate, merged = "MAX(total_seconds)", "EXCLUDED.total_seconds"
+        else:
+            aggregate, merged = "SUM(total_seconds)", "UserStats.total_seconds + EXCLUDED.total_seconds"
+        # WHERE 1 = 1 нужен SQLite, чтобы ON CONFLICT не читался как условие соединения
+        cursor.execute(
+            f"""
+            INSERT INTO UserStats (user_id, guild_id, total_seconds, current_level, last_active_at)
+            SELECT user_id, %s, {aggregate}, 0, %s
+            FROM ImportStaging
+            WHERE 1 = 1
+            GROUP BY user_id
+            ON CONFLICT (user_id, guild_id) DO UPDATE
+            SET total_seconds = {merged}
+            """,
+            (guild_id, datetime.now().isoformat())
+        )
+        users = cursor.rowcount
+        
+        cursor.execute(
+            """
+            SELECT user_id, total_seconds, current_level FROM UserStats
+            WHERE guild_id = %s AND user_id IN (SELECT user_id FROM ImportStaging)
+            """,
+            (guild_id,)
+        )
+        imported = cursor.fetchall()
+        leveled_up = _raise_levels(cursor, guild_id, imported, config)
+        
+        cursor.execute("DROP TABLE ImportStaging")
+        # Импорт уровни только повышает, поэтому max_level пересчитывать не нужно
+        if imported:
+            apply_guild_totals_delta(
+                cursor, guild_id,
+                user_count=len(imported) - len(existing),
+                total_seconds=sum(row[1] for row in imported) - seconds_before,
+                level=max(leveled_up.get(row[0], row[2]) for row in imported)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+    
+    logger.info(f"Импортировано {loaded} строк ({users} пользователей) на сервер {guild_id}, режим {mode}")
+    notify_stats_changed(guild_id)
+    return {'rows': loaded, 'users': users, 'leveled_up': leveled_up}
+
+# Архив: пользователи, которые давно не заходили в голосовые каналы и ушли с сервера
+
+def get_archive_candidates(guild_id, inactive_before, after_user_id=-1, limit=500):
+    """User ids of a guild with no voice activity since inactive_before (ISO time), by user_id.
+
+    Users currently in voice are never candidates; whether a candidate is
+    still a guild member is up to the caller (see archival.py).
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
     cursor.execute(
         """
-        UPDATE UserStats 
-        SET total_seconds = 0, current_level = 0
-        WHERE guild_id = %s
+        SELECT user_id FROM UserStats
+        WHERE guild_id = %s AND user_id > %s
+          AND (last_active_at IS NULL OR last_active_at < %s)
+          AND user_id NOT IN (SELECT user_id FROM ActiveUsers WHERE guild_id = %s)
+        ORDER BY user_id
+        LIMIT %s
         """,
-        (guild_id,)
+        (guild_id, after_user_id, inactive_before, guild_id, limit)
     )
+    user_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return user_ids
+
+def archive_users(guild_id, user_ids, inactive_before):
+    """Move users out of UserStats into UserStatsArchive; returns how many were moved.
+
+    Inactivity is re-checked inside the transaction, so a user who joined
+    voice since get_archive_candidates stays where they are.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return 0
+    conn = get_db_connection(autocommit=False)
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
     
     cursor.execute(
         """
-        DELETE FROM ActiveUsers 
-        WHERE guild_id = %s
+        SELECT user_id, total_seconds FROM UserStats
+        WHERE guild_id = %s AND user_id = ANY(%s)
+          AND (last_active_at IS NULL OR last_active_at < %s)
+          AND user_id NOT IN (SELECT user_id FROM ActiveUsers WHERE guild_id = %s)
+        FOR UPDATE
         """,
-        (guild_id,)
+        (guild_id, user_ids, inactive_before, guild_id)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        conn.rollback()
+        conn.close()
+        return 0
+    moved = [row[0] for row in rows]
+    
+    # Если пользователь уже был в архиве (его строку создали заново), время складывается
+    cursor.execute(
+        """
+        INSERT INTO UserStatsArchive (user_id, guild_id, total_seconds, current_level, last_active_at, archived_at)
+        SELECT user_id, guild_id, total_seconds, current_level, last_active_at, %s
+        FROM UserStats
+        WHERE guild_id = %s AND user_id = ANY(%s)
+        ON CONFLICT (user_id, guild_id) DO UPDATE
+        SET total_seconds = UserStatsArchive.total_seconds + EXCLUDED.total_seconds,
+            current_level = GREATEST(UserStatsArchive.current_level, EXCLUDED.current_level),
+            last_active_at = EXCLUDED.last_active_at,
+            archived_at = EXCLUDED.archived_at
+        """,
+        (now, guild_id, moved)
+    )
+    cursor.execute(
+        "DELETE FROM UserStats WHERE guild_id = %s AND user_id = ANY(%s)",
+        (guild_id, moved)
     )
+    apply_guild_totals_delta(cursor, guild_id, user_count=-len(rows), total_seconds=-sum(row[1] for row in rows))
+    refresh_guild_max_level(cursor, guild_id)
     
+    conn.commit()
+    conn.close()
+    
+    metrics.USERS_ARCHIVED.inc(len(moved))
+    notify_stats_changed(guild_id)
+    return len(moved)
+
+def restore_archived_user(cursor, user_id, guild_id):
+    """Take a user out of the archive inside the caller's transaction; (total_seconds, level) or None.
+
+    The caller inserts the returned stats back into UserStats.
+    """
+    cursor.execute(
+        "SELECT total_seconds, current_level FROM UserStatsArchive WHERE user_id = %s AND guild_id = %s FOR UPDATE",
+        (user_id, guild_id)
+    )
+    result = cursor.fetchone()
+    if result is None:
+        return None
+    cursor.execute(
+        "DELETE FROM UserStatsArchive WHERE user_id = %s AND guild_id = %s",
+        (user_id, guild_id)
+    )
+    metrics.USERS_RESTORED.inc()
+    logger.info(f"Пользователь {user_id} вернулся на сервер {guild_id}, статистика восстановлена из архива")
+    return result
+
+def restore_archived_users(cursor, guild_id, user_filter, params=()):
+    """Move archived users matching user_filter back into UserStats inside the caller's transaction.
+
+    user_filter is a condition on user_id with its params. Returns how many
+    users were restored; GuildTotals gets the restored users and their time.
+    """
+    cursor.execute(
+        f"""
+        SELECT COALESCE(SUM(CASE WHEN EXISTS (
+                   SELECT 1 FROM UserStats s
+                   WHERE s.guild_id = UserStatsArchive.guild_id AND s.user_id = UserStatsArchive.user_id
+               ) THEN 0 ELSE 1 END), 0),
+               COALESCE(SUM(total_seconds), 0), COALESCE(MAX(current_level), 0)
+        FROM UserStatsArchive
+        WHERE guild_id = %s AND {user_filter}
+        """,
+        (guild_id, *params)
+    )
+    new_users, new_seconds, max_level = cursor.fetchone()
+    # WHERE перед ON CONFLICT обязателен для SQLite (см. import_user_totals)
+    cursor.execute(
+        f"""
+        INSERT INTO UserStats (user_id, guild_id, total_seconds, current_level, last_active_at)
+        SELECT user_id, guild_id, total_seconds, current_level, %s
+        FROM UserStatsArchive
+        WHERE guild_id = %s AND {user_filter}
+        ON CONFLICT (user_id, guild_id) DO UPDATE
+        SET total_seconds = UserStats.total_seconds + EXCLUDED.total_seconds,
+            current_level = GREATEST(UserStats.current_level, EXCLUDED.current_level),
+            last_active_at = EXCLUDED.last_active_at
+        """,
+        (datetime.now().isoformat(), guild_id, *params)
+    )
+    cursor.execute(f"DELETE FROM UserStatsArchive WHERE guild_id = %s AND {user_filter}", (guild_id, *params))
+    restored = cursor.rowcount
+    if restored:
+        apply_guild_totals_delta(cursor, guild_id, user_count=new_users, total_seconds=new_seconds, level=max_level)
+    if restored:
+        metrics.USERS_RESTORED.inc(restored)
+        logger.info(f"Из архива восстановлено {restored} пользователей сервера {guild_id}")
+    return restored
+
+def count_archived_users(guild_id=None):
+    """Number of archived users of a guild (or of all guilds)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if guild_id is None:
+        cursor.execute("SELECT COUNT(*) FROM UserStatsArchive")
+    else:
+        cursor.execute("SELECT COUNT(*) FROM UserStatsArchive WHERE guild_id = %s", (guild_id,))
+    count = cursor.fetchone()[0]
     conn.close()
+    return count
@@ -0,0 +1,24 @@
+"""
+Скрипт для пересчета таблицы GuildTotals по данным UserStats.
+Запустите его, если итоги серверов разошлись с реальными данными:
+python rebuild_guild_totals.py [guild_id]
+"""
+
+import sys
+import logging
+from models import rebuild_guild_totals
+from invalidation_bus import publish, GUILD_STATS
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+
+logger = logging.getLogger(__name__)
+
+if __name__ == "__main__":
+    guild_id = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    rebuild_guild_totals(guild_id)
+    publish(GUILD_STATS, guild_id)
@@ -0,0 +1,152 @@
+"""
+Маршрутизация чтения на реплику Postgres (DATABASE_REPLICA_URL).
+
+Только читающие функции models.py и страницы main.py берут соединение
+через models.get_read_connection. Оно идет на реплику, если:
+
+    * реплика задана и доступна;
+    * ее отставание, которое проверяется не чаще раза в
+      REPLICA_LAG_CHECK_INTERVAL секунд, не больше REPLICA_MAX_LAG;
+    * в сервер, о котором запрос, недавно не писали. После записи
+      (models.notify_stats_changed / notify_config_changed, в том числе
+      пришедших от других процессов через шину инвалидации) чтение этого
+      сервера REPLICA_READ_YOUR_WRITES секунд плюс текущее отставание идет
+      на основную базу, чтобы команда бота сразу видела свое изменение.
+
+Иначе чтение идет на основную базу, как раньше.
+"""
+
+import os
+import time
+import logging
+import threading
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 10))
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 5))
+REPLICA_READ_YOUR_WRITES = float(os.environ.get('REPLICA_READ_YOUR_WRITES', 5))
+
+# guild_id -> monotonic time of the last local or announced write; None = all guilds
+_recent_writes = {}
+_writes_lock = threading.Lock()
+
+_state = {'lag': None, 'checked': 0.0, 'healthy': False, 'error': None}
+_check_lock = threading.Lock()
+
+# Отставание реплики в секундах: 0, если она догнала основную базу (или это не реплика)
+_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def enabled():
+    return bool(DATABASE_REPLICA_URL)
+
+
+def mark_written(guild_id=None):
+    """Remember that a guild (or every guild) was just written to."""
+    if not enabled():
+        return
+    now = time.monotonic()
+    with _writes_lock:
+        _recent_writes[guild_id] = now
+        # Старые отметки больше ни на что не влияют
+        if len(_recent_writes) > 10000:
+            horizon = now - REPLICA_READ_YOUR_WRITES - REPLICA_MAX_LAG
+            for key in [key for key, at in _recent_writes.items() if at < horizon]:
+                del _recent_writes[key]
+
+
+def _written_recently(guild_id, now):
+    window = REPLICA_READ_YOUR_WRITES + (_state['lag'] or 0)
+    with _writes_lock:
+        last = max(_recent_writes.get(guild_id, 0.0), _recent_writes.get(None, 0.0))
+    return last and now - last < window
+
+
+def _lag_ok():
+    return _state['healthy'] and _state['lag'] is not None and _state['lag'] <= REPLICA_MAX_LAG
+
+
+def _check_lag(connect):
+    """Measure the lag; returns the probed connection if the replica is usable, else None."""
+    try:
+        conn = connect()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+        except Exception:
+            conn.close()
+            raise
+    except Exception as e:
+        if _state['healthy'] or _state['error'] is None:
+            logger.warning(f"Реплика недоступна, чтение идет на основную базу: {e}")
+        _state.update(healthy=False, error=str(e))
+        return None
+    if _state['healthy'] and lag > REPLICA_MAX_LAG:
+        logger.warning(f"Реплика отстает на {lag:.1f} с, чтение идет на основную базу")
+    _state.update(lag=lag, healthy=True, error=None)
+    if not _lag_ok():
+        conn.close()
+        return None
+    return conn
+
+
+def choose(guild_id, connect):
+    """Where a read about guild_id should go: ('replica' | 'primary', reason, replica connection or None).
+
+    The lag is re-checked every REPLICA_LAG_CHECK_INTERVAL; the connection
+    used for that check serves the read, so a read opens at most one
+    replica connection.
+    """
+    if not enabled():
+        return 'primary', 'no_replica', None
+    now = time.monotonic()
+    if _written_recently(guild_id, now):
+        return 'primary', 'recent_write', None
+
+    conn = None
+    if now - _state['checked'] >= REPLICA_LAG_CHECK_INTERVAL and _check_lock.acquire(blocking=False):
+        try:
+            _state['checked'] = now
+            conn = _check_lag(connect)
+        finally:
+            _check_lock.release()
+    if conn is None:
+        if not _lag_ok():
+            return 'primary', 'lag' if _state['healthy'] else 'unavailable', None
+        try:
+            conn = connect()
+        except Exception as e:
+            failed(e)
+            return 'primary', 'unavailable', None
+    return 'replica', 'ok', conn
+
+
+def failed(e):
+    """A replica connection failed: use the primary until the next lag check."""
+    logger.warning(f"Ошибка соединения с репликой: {e}")
+    _state.update(healthy=False, error=str(e), checked=time.monotonic())
+
+
+def status():
+    """Replica state for /health."""
+    if not enabled():
+        return None
+    return {
+        'healthy': _state['healthy'],
+        'lag_s': _state['lag'],
+        'max_lag_s': REPLICA_MAX_LAG,
+        'error': _state['error'],
+    }
+
+
+metrics.DB_REPLICA_LAG_SECONDS.set_function(lambda: {(): _state['lag']} if _state['lag'] is not None else {})
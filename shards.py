@@ -0,0 +1,151 @@
+"""
+Многопроцессный запуск бота: шарды Discord распределяются по процессам.
+
+    python shards.py [--shards N] [--processes M]
+
+Координатор узнает у Discord рекомендуемое число шардов (или берет
+--shards / SHARD_COUNT). Затем он делит шарды на SHARD_PROCESSES процессов
+подряд идущими группами и запускает для каждой группы процесс бота
+(AutoShardedBot с SHARD_IDS этой группы). Упавший процесс перезапускается
+через SHARD_RESTART_DELAY секунд.
+
+Каждый процесс сам ведет учет голосового времени своих серверов: у
+каждого шарда свой конвейер событий (voice_ingest.py) и свои сессии в
+ActiveUsers. Общие части:
+
+    * глобальные slash-команды синхронизирует только процесс с шардом 0
+      (BOT_SYNC_COMMANDS=1), остальные только загружают модули;
+    * кэши настроек и страниц процессы сбрасывают друг у друга через шину
+      инвалидации (invalidation_bus.py, Postgres LISTEN/NOTIFY), поэтому
+      нескольким процессам нужна PostgreSQL, а не SQLite.
+
+Веб-интерфейс запускается отдельно (run_web.sh).
+"""
+
+import os
+import sys
+import time
+import signal
+import logging
+import argparse
+import subprocess
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+SHARD_PROCESSES = int(os.environ.get('SHARD_PROCESSES', os.cpu_count() or 1))
+SHARD_RESTART_DELAY = float(os.environ.get('SHARD_RESTART_DELAY', 5))
+
+GATEWAY_URL = 'https://discord.com/api/v10/gateway/bot'
+
+
+def recommended_shard_count(token):
+    """Shard count Discord recommends for this bot."""
+    response = requests.get(GATEWAY_URL, headers={'Authorization': f'Bot {token}'}, timeout=10)
+    response.raise_for_status()
+    return response.json()['shards']
+
+
+def plan(shard_count, processes):
+    """Split shard ids 0..shard_count-1 into at most `processes` contiguous groups."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+
+def _spawn(shard_ids, shard_count):
+    env = dict(os.environ,
+               SHARD_COUNT=str(shard_count),
+               SHARD_IDS=','.join(str(shard_id) for shard_id in shard_ids),
+               BOT_SYNC_COMMANDS='1' if 0 in shard_ids else '0')
+    logger.info(f"Запуск процесса шардов {shard_ids}")
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--worker'], env=env)
+
+
+def run_worker():
+    """Worker process: run the shards from SHARD_IDS."""
+    import card_pool
+    import invalidation_bus
+    from bot import bot
+
+    # Процессы отрисовки карточек создаем до запуска потоков
+    card_pool.start()
+    invalidation_bus.start()
+    bot.run(os.environ.get('DISCORD_TOKEN'))
+
+
+def supervise(groups, shard_count):
+    """Keep one process per shard group running until SIGINT/SIGTERM."""
+    processes = {tuple(group): _spawn(group, shard_count) for group in groups}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while not stopping:
+        time.sleep(1)
+        for group, process in list(processes.items()):
+            if process.poll() is None or stopping:
+                continue
+            logger.error(f"Процесс шардов {list(group)} завершился с кодом {process.returncode}, "
+                         f"перезапуск через {SHARD_RESTART_DELAY} с")
+            time.sleep(SHARD_RESTART_DELAY)
+            processes[group] = _spawn(list(group), shard_count)
+
+    logger.info("Остановка процессов шардов...")
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    for process in processes.values():
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск бота шардами в нескольких процессах")
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('SHARD_COUNT') or 0),
+                        help="число шардов (по умолчанию рекомендованное Discord)")
+    parser.add_argument('--processes', type=int, default=SHARD_PROCESSES, help="число процессов бота")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker()
+        return
+
+    token = os.environ.get('DISCORD_TOKEN')
+    if not token:
+        sys.exit("Установите переменную окружения DISCORD_TOKEN")
+    shard_count = args.shards or recommended_shard_count(token)
+    groups = plan(shard_count, args.processes)
+
+    if len(groups) > 1:
+        import models
+        import storage
+        if not storage.get_backend(models.DATABASE_URL).supports_notify:
+            sys.exit("Для нескольких процессов бота нужна PostgreSQL: SQLite обслуживает только один процесс")
+
+    logger.info(f"Шардов: {shard_count}, процессов: {len(groups)}")
+    supervise(groups, shard_count)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    main()
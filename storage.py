@@ -0,0 +1,857 @@
+"""
+Хранилища данных бота: PostgreSQL или встроенный SQLite.
+
+models.get_db_connection берет соединение у бэкенда, выбранного по схеме
+DATABASE_URL:
+
+    postgresql://...          — PostgreSQL через psycopg2 (как раньше);
+    sqlite:///voice_leveler.db — файл SQLite рядом с ботом (относительный путь),
+    sqlite:////var/lib/bot.db  — файл SQLite по абсолютному пути.
+
+Соединения обоих бэкендов ведут себя как соединения psycopg2: cursor(),
+execute с параметрами %s, fetchone/fetchall, commit/rollback/close. Поэтому
+функции models.py и маршруты main.py работают с любым из них без изменений.
+
+SQLite работает в режиме WAL. Чтение идет из соединений потоков-читателей
+и не ждет записи. Все записи выполняет один поток-писатель: транзакции
+вызывающих потоков становятся точками сохранения (SAVEPOINT) внутри общей
+транзакции писателя, и все, что накопилось в очереди (до
+SQLITE_WRITE_BATCH транзакций), фиксируется одним COMMIT. commit()
+возвращается только после этого COMMIT, так что записанное сразу видно
+всем читателям. Postgres-специфичный синтаксис запросов переводится:
+%s -> ?, "= ANY(%s)" со списком -> IN (...), GREATEST/LEAST -> MAX/MIN,
+FOR UPDATE убирается (писатель и так выполняет транзакции по очереди).
+"""
+
+import io
+import os
+import abc
+import re
+import csv
+import time
+import queue
+import sqlite3
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import db_stats
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))  # 0 — без пула, соединение на каждый вызов
+# Сверх DB_POOL_SIZE открываются временные соединения: вложенные вызовы одного
+# потока (например, чтение настроек внутри транзакции) не ждут друг друга
+DB_POOL_OVERFLOW = int(os.environ.get('DB_POOL_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_PREPARE_STATEMENTS = os.environ.get('DB_PREPARE_STATEMENTS', '1') != '0'
+SQLITE_WRITE_BATCH = int(os.environ.get('SQLITE_WRITE_BATCH', 64))
+SQLITE_COMMIT_DELAY_MS = float(os.environ.get('SQLITE_COMMIT_DELAY_MS', 0))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_TRANSACTION_TIMEOUT = float(os.environ.get('SQLITE_TRANSACTION_TIMEOUT', 30))
+
+
+class StorageBackend(abc.ABC):
+    """Source of DB-API connections that accept psycopg2-style SQL."""
+    name = None
+    # Поддерживает ли бэкенд LISTEN/NOTIFY (межпроцессная шина инвалидации)
+    supports_notify = False
+
+    @abc.abstractmethod
+    def connect(self, autocommit=True, dedicated=False):
+        """New or pooled connection; dedicated=True bypasses the pool (LISTEN, long-lived use)."""
+
+    def close(self):
+        pass
+
+
+class PooledConnectionMixin:
+    """close() returns the connection to its pool instead of closing it."""
+    pool = None
+    # Поколение пула (меняется после fork), в котором соединение выдано
+    pool_generation = None
+    # Имена запросов реестра, для которых на этом соединении уже сделан PREPARE
+    prepared_statements = None
+
+    def close(self):
+        pool, self.pool = self.pool, None
+        if pool is None:
+            return super().close()
+        pool.putconn(self)
+
+    def discard(self):
+        self.pool = None
+        super().close()
+
+    def __del__(self):
+        # Соединение бросили, не вызвав close() (исключение, ранний return):
+        # само оно закроется вместе с объектом, а место в пуле нужно вернуть
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.release_lost(self.pool_generation)
+
+
+_pooled_classes = {}
+
+
+def _pooled_class(connection_factory):
+    cls = _pooled_classes.get(connection_factory)
+    if cls is None:
+        cls = type(f"Pooled{connection_factory.__name__}", (PooledConnectionMixin, connection_factory), {})
+        _pooled_classes[connection_factory] = cls
+    return cls
+
+
+class ConnectionPool:
+    """Thread-safe pool keeping up to `size` idle Postgres connections.
+
+    At most size + overflow connections are checked out at once; beyond
+    that callers wait up to DB_POOL_TIMEOUT seconds.
+    """
+
+    def __init__(self, dsn, size, connection_factory, overflow=DB_POOL_OVERFLOW):
+        self.dsn = dsn
+        self.size = size
+        self.overflow = overflow
+        self.connection_class = _pooled_class(connection_factory)
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size + overflow)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._inherited = []
+        # Места брошенных соединений: финализатор только кладет сюда отметку,
+        # а вернут их getconn и in_use. Брать блокировку в __del__ нельзя —
+        # сборщик мусора может вызвать его в потоке, который ее уже держит
+        self._lost = queue.SimpleQueue()
+        self.generation = 0
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # Сокеты общие с родителем: закрытие отправило бы серверу Terminate
+        # и оборвало соединение родителя, поэтому просто не используем их
+        self._inherited.extend(self._idle)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size + self.overflow)
+        self._in_use = 0
+        self._lost = queue.SimpleQueue()
+        # Соединения, выданные до fork, не занимают места в новом семафоре
+        self.generation += 1
+
+    def _open(self):
+        if issubclass(self.connection_class, db_stats.InstrumentedConnection):
+            conn = db_stats.connect(self.dsn, self.connection_class)
+        else:
+            conn = psycopg2.connect(self.dsn, connection_factory=self.connection_class)
+        conn.prepared_statements = set()
+        return conn
+
+    def _reclaim_lost(self):
+        """Return the slots of connections dropped without close()."""
+        while True:
+            try:
+                self._lost.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _acquire_slot(self):
+        deadline = time.perf_counter() + DB_POOL_TIMEOUT
+        while True:
+            self._reclaim_lost()
+            # Короткие ожидания: место может освободиться и брошенным соединением
+            if self._slots.acquire(timeout=max(0.0, min(0.1, deadline - time.perf_counter()))):
+                return True
+            if time.perf_counter() >= deadline:
+                return False
+
+    def getconn(self, autocommit=True):
+        started = time.perf_counter()
+        if not self._acquire_slot():
+            raise psycopg2.OperationalError(f"Нет свободного соединения в пуле за {DB_POOL_TIMEOUT} с")
+        metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        try:
+            conn = None
+            with self._lock:
+                while self._idle and conn is None:
+                    conn = self._idle.pop()
+                    if conn.closed:
+                        conn = None
+            if conn is None:
+                conn = self._open()
+            elif isinstance(conn, db_stats.InstrumentedConnection):
+                db_stats.checkout(conn)
+            conn.autocommit = autocommit
+        except Exception:
+            self._slots.release()
+            raise
+        conn.pool = self
+        conn.pool_generation = self.generation
+        with self._lock:
+            self._in_use += 1
+        return conn
+
+    def putconn(self, conn):
+        if conn.pool_generation != self.generation:
+            # Выдано родительскому процессу до fork: сокет общий, не закрываем
+            self._inherited.append(conn)
+            return
+        try:
+            if not conn.closed and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Незафиксированная транзакция при закрытии откатывается, как у обычного соединения
+                conn.rollback()
+        except psycopg2.Error:
+            conn.discard()
+        with self._lock:
+            self._in_use -= 1
+            keep = not conn.closed and len(self._idle) < self.size
+            if keep:
+                self._idle.append(conn)
+        if not keep and not conn.closed:
+            conn.discard()
+        self._slots.release()
+
+    def release_lost(self, generation):
+        """Called from a finalizer: lock-free, the slot is returned later by _reclaim_lost."""
+        if generation == self.generation:
+            self._lost.put(None)
+
+    def in_use(self):
+        self._reclaim_lost()
+        return self._in_use
+
+    def idle(self):
+        return len(self._idle)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+
+
+class PostgresBackend(StorageBackend):
+    name = 'postgres'
+    supports_notify = True
+
+    def __init__(self, dsn, connection_factory=None, pool_size=DB_POOL_SIZE):
+        self.dsn = dsn
+        if connection_factory is None:
+            connection_factory = (db_stats.InstrumentedConnection if db_stats.QUERY_STATS_ENABLED
+                                  else psycopg2.extensions.connection)
+        self.connection_factory = connection_factory
+        self.pool = ConnectionPool(dsn, pool_size, connection_factory) if pool_size > 0 else None
+
+    def connect(self, autocommit=True, dedicated=False):
+        if self.pool is not None and not dedicated:
+            return self.pool.getconn(autocommit)
+        if issubclass(self.connection_factory, db_stats.InstrumentedConnection):
+            conn = db_stats.connect(self.dsn, self.connection_factory)
+        else:
+            conn = psycopg2.connect(self.dsn, connection_factory=self.connection_factory)
+        conn.autocommit = autocommit
+        return conn
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+
+# ------------------------------------------------- Реестр частых запросов
+
+_statements = {}
+_statement_stats = {}  # name -> {'prepared', 'text', 'prepares'}
+_statements_lock = threading.Lock()
+
+
+class Statement:
+    """A hot query defined once; prepared server-side on each pooled Postgres connection."""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        parts = sql.split('%s')
+        self.arity = len(parts) - 1
+        # Текст для PREPARE: параметры %s становятся $1, $2, ...
+        self.prepare_sql = parts[0] + ''.join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+        self.execute_sql = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * self.arity)})" if self.arity else '')
+
+    def execute(self, cursor, params=()):
+        """Run the statement on a cursor of any backend."""
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared_statements', None)
+        if prepared is None or not DB_PREPARE_STATEMENTS:
+            # SQLite и соединения вне пула: обычный текст (sqlite3 сам кэширует подготовленные запросы)
+            _count_statement(self.name, 'text')
+            return cursor.execute(self.sql, params)
+        if self.name not in prepared:
+            cursor.execute(f"PREPARE {self.name} AS {self.prepare_sql}")
+            prepared.add(self.name)
+            _count_statement(self.name, 'prepares')
+        _count_statement(self.name, 'prepared')
+        return cursor.execute(self.execute_sql, params)
+
+
+def _count_statement(name, kind):
+    with _statements_lock:
+        _statement_stats[name][kind] += 1
+    if kind == 'prepares':
+        metrics.DB_STATEMENT_PREPARES.inc(statement=name)
+    else:
+        metrics.DB_STATEMENT_EXECUTIONS.inc(statement=name, mode=kind)
+
+
+def statement(name, sql):
+    """Register a hot query under a unique SQL identifier name."""
+    with _statements_lock:
+        if name in _statements:
+            raise ValueError(f"Запрос {name} уже зарегистрирован")
+        _statements[name] = Statement(name, sql)
+        _statement_stats[name] = {'prepared': 0, 'text': 0, 'prepares': 0}
+    return _statements[name]
+
+
+def statement_stats():
+    """Per-statement use: executions as prepared / plain text and PREPARE count."""
+    with _statements_lock:
+        return {name: dict(stats) for name, stats in _statement_stats.items()}
+
+
+def execute_values(cursor, sql, rows, page_size=1000, fetch=False):
+    """Run sql with its single "VALUES %s" expanded to many rows, page_size rows per statement.
+
+    Postgres uses psycopg2.extras.execute_values; on SQLite the rows become
+    a multi-row VALUES list of "?" placeholders. With fetch=True the rows
+    returned by every page (RETURNING) are collected into one list.
+    """
+    if not isinstance(cursor, SQLiteCursor):
+        return psycopg2.extras.execute_values(cursor, sql, rows, page_size=page_size, fetch=fetch)
+    rows = list(rows)
+    result = []
+    for start in range(0, len(rows), page_size):
+        page = rows[start:start + page_size]
+        values = ', '.join('(' + ', '.join(['%s'] * len(row)) + ')' for row in page)
+        cursor.execute(sql.replace('%s', values, 1), [value for row in page for value in row])
+        if fetch:
+            result.extend(cursor.fetchall())
+    return result if fetch else None
+
+
+class _CSVStream:
+    """Read-only file over an iterator of rows, formatted as CSV for COPY ... FROM STDIN."""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._pending = ''
+        self.count = 0
+
+    def _fill(self, size):
+        # Строки форматируются по мере чтения, весь файл в памяти не собирается
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        for row in itertools.islice(self._rows, max(size // 32, 100)):
+            self._writer.writerow(row)
+            self.count += 1
+        return self._buffer.getvalue()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 1 << 30
+        while len(self._pending) < size:
+            chunk = self._fill(size - len(self._pending))
+            if not chunk:
+                break
+            self._pending += chunk
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def copy_rows(cursor, table, columns, rows, page_size=1000):
+    """Load an iterator of row tuples into table; returns the number of rows loaded.
+
+    Postgres streams them through COPY ... FROM STDIN (CSV); SQLite inserts
+    them with executemany, page_size rows at a time.
+    """
+    if not isinstance(cursor, SQLiteCursor):
+        stream = _CSVStream(rows)
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", stream)
+        return stream.count
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    rows = iter(rows)
+    count = 0
+    while True:
+        page = list(itertools.islice(rows, page_size))
+        if not page:
+            return count
+        cursor.executemany(sql, page)
+        count += len(page)
+
+
+# ---------------------------------------------------------------- SQLite
+
+_PLACEHOLDER = '\0'
+_ANY_RE = re.compile(r"=\s*ANY\s*\(\s*$", re.IGNORECASE)
+_FOR_UPDATE_RE = re.compile(r"\s+FOR\s+UPDATE\b", re.IGNORECASE)
+_GREATEST_RE = re.compile(r"\bGREATEST\s*\(", re.IGNORECASE)
+_LEAST_RE = re.compile(r"\bLEAST\s*\(", re.IGNORECASE)
+_READ_RE = re.compile(r"^\s*(SELECT|EXPLAIN)\b", re.IGNORECASE)
+
+
+def translate(sql, params=None):
+    """Rewrite a psycopg2-style statement for sqlite3; returns (sql, params)."""
+    sql = _FOR_UPDATE_RE.sub('', sql)
+    sql = _GREATEST_RE.sub('MAX(', sql)
+    sql = _LEAST_RE.sub('MIN(', sql)
+    if params is None:
+        return sql, ()
+
+    # Как и psycopg2, "%%" превращаем в "%" только при наличии параметров
+    pieces = sql.replace('%%', _PLACEHOLDER).split('%s')
+    if len(pieces) - 1 != len(params):
+        raise sqlite3.ProgrammingError(
+            f"Запрос ожидает {len(pieces) - 1} параметров, передано {len(params)}"
+        )
+    out = [pieces[0]]
+    args = []
+    for piece, value in zip(pieces[1:], params):
+        if isinstance(value, (list, tuple)) and _ANY_RE.search(out[-1]):
+            out[-1] = _ANY_RE.sub('IN (', out[-1])
+            out.append(', '.join('?' * len(value)) if value else 'NULL')
+            args.extend(value)
+        else:
+            out.append('?')
+            args.append(value)
+        out.append(piece)
+    return ''.join(out).replace(_PLACEHOLDER, '%'), args
+
+
+def is_write(sql):
+    """Statements that must run on the writer thread."""
+    return not _READ_RE.match(sql) or _FOR_UPDATE_RE.search(sql) is not None
+
+
+class DictRow(list):
+    """Row accessible by index and by column name, like psycopg2.extras.DictRow."""
+
+    def __init__(self, values, index):
+        super().__init__(values)
+        self._index = index
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, IndexError):
+            return default
+
+    def keys(self):
+        return iter(self._index)
+
+    def values(self):
+        return iter(self)
+
+    def items(self):
+        return zip(self._index, self)
+
+
+def _row_maker(cursor_factory, description):
+    """Convert sqlite tuples into the row type the psycopg2 cursor_factory would give."""
+    kind = getattr(cursor_factory, '__name__', '')
+    if not description or kind not in ('DictCursor', 'RealDictCursor'):
+        return None
+    columns = [column[0] for column in description]
+    if kind == 'RealDictCursor':
+        return lambda row: dict(zip(columns, row))
+    index = {column: i for i, column in enumerate(columns)}
+    return lambda row: DictRow(row, index)
+
+
+class _Result:
+    __slots__ = ('description', 'rows', 'rowcount', 'lastrowid')
+
+    def __init__(self, cursor):
+        self.description = cursor.description
+        self.rows = cursor.fetchall()
+        self.rowcount = cursor.rowcount
+        self.lastrowid = cursor.lastrowid
+
+
+_transaction_ids = itertools.count(1)
+
+
+class _Transaction:
+    """A caller's transaction, executed by the writer thread inside a savepoint."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        # Вложенная транзакция того же потока идет через очередь внешней
+        self.inbox = parent.inbox if parent else queue.SimpleQueue()
+        self.savepoint = f"tx{next(_transaction_ids)}"
+        self.committed = Future()
+        self.abandoned = False
+        self.finished = False
+
+
+class SQLiteWriter(threading.Thread):
+    """The only thread that writes to the database file; commits transactions in batches."""
+
+    def __init__(self, backend):
+        super().__init__(name='sqlite-writer', daemon=True)
+        self.backend = backend
+        self.transactions = queue.SimpleQueue()
+        self.stats = {'commits': 0, 'transactions': 0, 'max_batch': 0}
+
+    def run(self):
+        conn = self.backend.open(readonly=False)
+        while True:
+            transaction = self.transactions.get()
+            self._begin(conn)
+            pending = []
+            deadline = time.monotonic() + SQLITE_COMMIT_DELAY_MS / 1000
+            while transaction is not None:
+                self._serve(conn, transaction, pending)
+                if len(pending) >= SQLITE_WRITE_BATCH:
+                    break
+                # В пакет попадает все, что уже ждет в очереди (и что придет за SQLITE_COMMIT_DELAY_MS)
+                try:
+                    transaction = self.transactions.get(timeout=max(0.0, deadline - time.monotonic())) \
+                        if SQLITE_COMMIT_DELAY_MS else self.transactions.get_nowait()
+                except queue.Empty:
+                    transaction = None
+            self._commit(conn, pending)
+
+    def _begin(self, conn):
+        delay = 0.1
+        while True:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                return
+            except sqlite3.OperationalError as e:
+                # Файл заблокирован другим процессом дольше SQLITE_BUSY_TIMEOUT_MS
+                logger.warning(f"Не удалось начать транзакцию SQLite: {e}, повтор через {delay} с")
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def _commit(self, conn, pending):
+        try:
+            conn.execute('COMMIT')
+        except Exception as e:
+            logger.error(f"Ошибка фиксации пакета из {len(pending)} транзакций SQLite: {e}")
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+            for transaction in pending:
+                transaction.committed.set_exception(e)
+            return
+        self.stats['commits'] += 1
+        self.stats['transactions'] += len(pending)
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(pending))
+        for transaction in pending:
+            transaction.committed.set_result(None)
+
+    def _serve(self, conn, transaction, pending):
+        """Run the statements of one caller transaction until it commits or rolls back."""
+        conn.execute(f'SAVEPOINT {transaction.savepoint}')
+        while True:
+            try:
+                op, savepoint, payload, future = transaction.inbox.get(timeout=SQLITE_TRANSACTION_TIMEOUT)
+            except queue.Empty:
+                # Вызывающий поток пропал, не закрыв транзакцию: не держим писателя
+                logger.error(f"Транзакция SQLite простаивала дольше {SQLITE_TRANSACTION_TIMEOUT} с, откат")
+                transaction.abandoned = True
+                conn.execute(f'ROLLBACK TO {transaction.savepoint}')
+                conn.execute(f'RELEASE {transaction.savepoint}')
+                transaction.committed.set_exception(TimeoutError("транзакция SQLite отменена по таймауту"))
+                return
+
+            try:
+                if op == 'execute':
+                    sql, params, many = payload
+                    cursor = conn.executemany(sql, params) if many else conn.execute(sql, params)
+                    future.set_result(_Result(cursor))
+                elif op == 'savepoint':
+                    conn.execute(f'SAVEPOINT {savepoint}')
+                    future.set_result(None)
+                elif op == 'release':
+                    conn.execute(f'RELEASE {savepoint}')
+                    if savepoint == transaction.savepoint:
+                        # Ответ вызывающему — после общего COMMIT
+                        pending.append(transaction)
+                        future.set_result(None)
+                        return
+                    future.set_result(None)
+                elif op == 'rollback':
+                    conn.execute(f'ROLLBACK TO {savepoint}')
+                    conn.execute(f'RELEASE {savepoint}')
+                    future.set_result(None)
+                    if savepoint == transaction.savepoint:
+                        transaction.committed.set_result(None)
+                        return
+            except Exception as e:
+                future.set_exception(e)
+
+
+class SQLiteCursor:
+    """psycopg2-like cursor over the SQLite backend."""
+
+    def __init__(self, connection, cursor_factory=None):
+        self.connection = connection
+        self.cursor_factory = cursor_factory
+        self.description = None
+        self.rowcount = -1
+        self.lastrowid = None
+        self.itersize = 2000  # как у именованных курсоров psycopg2; здесь ни на что не влияет
+        self._rows = iter(())
+        self._make_row = None
+
+    def _set_result(self, description, rows, rowcount, lastrowid):
+        self.description = description
+        self.rowcount = rowcount
+        self.lastrowid = lastrowid
+        self._rows = iter(rows)
+        self._make_row = _row_maker(self.cursor_factory, description)
+
+    def execute(self, query, vars=None):
+        sql, params = translate(query, vars)
+        if self.connection._in_writer(query):
+            result = self.connection._send('execute', (sql, params, False), write=is_write(query))
+            self._set_result(result.description, result.rows, result.rowcount, result.lastrowid)
+        else:
+            cursor = self.connection._backend.reader().execute(sql, params)
+            self._set_result(cursor.description, cursor, cursor.rowcount, cursor.lastrowid)
+
+    def executemany(self, query, vars_list):
+        translated = [translate(query, vars) for vars in vars_list]
+        if not translated:
+            return
+        result = self.connection._send('execute', (translated[0][0], [params for _, params in translated], True))
+        self._set_result(None, (), result.rowcount, result.lastrowid)
+
+    def fetchone(self):
+        row = next(self._rows, None)
+        if row is not None and self._make_row:
+            row = self._make_row(row)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = list(itertools.islice(self._rows, size or self.itersize))
+        return [self._make_row(row) for row in rows] if self._make_row else rows
+
+    def fetchall(self):
+        rows = list(self._rows)
+        return [self._make_row(row) for row in rows] if self._make_row else rows
+
+    def __iter__(self):
+        for row in self._rows:
+            yield self._make_row(row) if self._make_row else row
+
+    def close(self):
+        self._rows = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class SQLiteConnection:
+    """psycopg2-like connection: reads go to a reader, a transaction with writes to the writer thread."""
+
+    def __init__(self, backend, autocommit=True):
+        self._backend = backend
+        self.autocommit = autocommit
+        self.closed = 0
+        self._transaction = None
+
+    def cursor(self, name=None, cursor_factory=None, **kwargs):
+        # name (именованный курсор psycopg2) не нужен: SQLite и так отдает строки по мере чтения
+        return SQLiteCursor(self, cursor_factory)
+
+    def _thread_transaction(self):
+        """Open transaction through which the calling thread currently holds the writer."""
+        transaction = getattr(self._backend.local, 'transaction', None)
+        if transaction is None:
+            return None
+        if transaction.finished or transaction.abandoned:
+            # Писатель отменил транзакцию по таймауту: поток больше не держит его
+            self._backend.local.transaction = None
+            return None
+        return transaction
+
+    def _in_writer(self, sql):
+        # Внутри транзакции читаем свои же изменения; пока поток держит писателя,
+        # его чтения через другие соединения тоже идут к писателю
+        return self._transaction is not None or is_write(sql) or self._thread_transaction() is not None
+
+    def _begin(self):
+        parent = self._thread_transaction()
+        transaction = _Transaction(parent)
+        if parent is None:
+            self._backend.local.transaction = transaction
+            self._backend.writer().transactions.put(transaction)
+        else:
+            # Поток уже держит писателя своей транзакцией: новая очередь встала бы за ней навсегда
+            self._call(transaction, 'savepoint', None)
+        self._transaction = transaction
+
+    def _call(self, transaction, op, payload):
+        future = Future()
+        root = transaction.parent or transaction
+        transaction.inbox.put((op, transaction.savepoint, payload, future))
+        while True:
+            try:
+                return future.result(timeout=1)
+            except TimeoutError:
+                if root.abandoned or (root is not transaction and root.finished):
+                    raise sqlite3.OperationalError("транзакция SQLite отменена по таймауту")
+
+    def _send(self, op, payload, write=True):
+        if self.closed:
+            raise sqlite3.InterfaceError("соединение закрыто")
+        if not write and self._transaction is None:
+            return self._call(self._thread_transaction(), op, payload)
+        if self._transaction is None:
+            self._begin()
+        try:
+            return self._call(self._transaction, op, payload)
+        finally:
+            if self.autocommit:
+                self.commit()
+
+    def _finish(self, op):
+        transaction = self._transaction
+        if transaction is None:
+            return
+        self._transaction = None
+        transaction.finished = True
+        if transaction.abandoned or (transaction.parent and transaction.parent.abandoned):
+            if op == 'release':
+                raise sqlite3.OperationalError("транзакция SQLite отменена по таймауту")
+            return
+        self._call(transaction, op, None)
+        if transaction.parent is None:
+            transaction.committed.result()
+
+    def commit(self):
+        self._finish('release')
+
+    def rollback(self):
+        self._finish('rollback')
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # Как в psycopg2: незафиксированная транзакция при закрытии откатывается
+            self.rollback()
+        finally:
+            self.closed = 1
+
+    def __del__(self):
+        # Соединение бросили посреди транзакции, не вызвав close() (исключение,
+        # ранний return): откатываем, не дожидаясь писателя, чтобы не держать
+        # его до SQLITE_TRANSACTION_TIMEOUT. Ответ не ждем — финализатор может
+        # выполниться в любом потоке, в том числе в самом писателе
+        transaction, self._transaction = self._transaction, None
+        if transaction is None or transaction.finished or transaction.abandoned:
+            return
+        transaction.finished = True
+        transaction.inbox.put(('rollback', transaction.savepoint, None, Future()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class SQLiteBackend(StorageBackend):
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def open(self, readonly):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+        if readonly:
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    def reader(self):
+        """Read-only connection of the calling thread."""
+        conn = getattr(self.local, 'reader', None)
+        if conn is None:
+            conn = self.local.reader = self.open(readonly=True)
+        return conn
+
+    def writer(self):
+        with self._lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = SQLiteWriter(self)
+                self._writer.start()
+                logger.info(f"SQLite {self.path}: режим WAL, поток-писатель запущен")
+            return self._writer
+
+    def connect(self, autocommit=True, dedicated=False):
+        return SQLiteConnection(self, autocommit)
+
+
+def backend_for_url(url):
+    """Create the backend named by the DATABASE_URL scheme."""
+    if url and url.startswith('sqlite:'):
+        path = url[len('sqlite:'):]
+        if path.startswith('///'):
+            path = path[3:]
+        return SQLiteBackend(path or 'voice_leveler.db')
+    return PostgresBackend(url)
+
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(url):
+    """Shared backend for a DATABASE_URL (one writer thread per SQLite file, one pool per Postgres URL)."""
+    with _backends_lock:
+        backend = _backends.get(url)
+        if backend is None:
+            backend = _backends[url] = backend_for_url(url)
+        return backend
+
+
+def _pools():
+    with _backends_lock:
+        return [backend.pool for backend in _backends.values() if getattr(backend, 'pool', None) is not None]
+
+
+def _pool_in_use():
+    pools = _pools()
+    return sum(pool.in_use() for pool in pools) if pools else db_stats.connections_in_use()
+
+
+metrics.DB_CONNECTIONS_IN_USE.set_function(_pool_in_use)
+metrics.DB_POOL_IDLE.set_function(lambda: sum(pool.idle() for pool in _pools()))
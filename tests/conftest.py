@@ -0,0 +1,62 @@
+"""
+Общие фикстуры тестов: все тесты работают с временным файлом SQLite.
+
+DATABASE_URL задается до импорта models, поэтому база разработчика и
+переменные окружения не затрагиваются. Каждый тест получает свой guild_id,
+так что тесты не мешают друг другу без очистки таблиц.
+"""
+
+import os
+import sys
+import itertools
+import tempfile
+
+import pytest
+
+_db_dir = tempfile.mkdtemp(prefix='voice-leveler-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.pop('DATABASE_REPLICA_URL', None)
+os.environ.setdefault('CARD_CACHE_DIR', os.path.join(_db_dir, 'card_cache'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import models  # noqa: E402
+
+models.init_db()
+
+_guild_ids = itertools.count(1_000_000)
+
+
+@pytest.fixture
+def guild_id():
+    """A guild no other test touches."""
+    return next(_guild_ids)
+
+
+@pytest.fixture
+def query():
+    """Run one statement on the test database and return all rows."""
+    def run(sql, params=None):
+        conn = models.get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else []
+        finally:
+            conn.close()
+    return run
+
+
+@pytest.fixture
+def assert_totals_consistent(query):
+    """Check that GuildTotals of a guild equals the aggregates of its UserStats rows."""
+    def check(guild_id):
+        expected = query(
+            """
+            SELECT COUNT(*), COALESCE(SUM(total_seconds), 0), COALESCE(MAX(current_level), 0)
+            FROM UserStats WHERE guild_id = %s
+            """,
+            (guild_id,)
+        )[0]
+        totals = models.get_guild_totals(guild_id)
+        assert (totals['user_count'], totals['total_time'], totals['max_level']) == tuple(expected)
+    return check
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import models
+
+
+def _later():
+    """inactive_before that makes every user who is not in voice a candidate."""
+    return (datetime.now() + timedelta(days=1)).isoformat()
+
+
+def _archive(guild_id, user_ids):
+    return models.archive_users(guild_id, user_ids, _later())
+
+
+def test_archive_moves_inactive_users(guild_id, assert_totals_consistent):
+    for user_id, hours in ((1, 10), (2, 20), (3, 30)):
+        models.set_user_contribution(user_id, guild_id, hours)
+
+    assert models.get_archive_candidates(guild_id, _later()) == [1, 2, 3]
+    assert _archive(guild_id, [1, 2]) == 2
+    assert models.count_archived_users(guild_id) == 2
+    assert models.get_archive_candidates(guild_id, _later()) == [3]
+    assert models.get_guild_totals(guild_id)['user_count'] == 1
+    assert_totals_consistent(guild_id)
+    # Статистика архивного пользователя по-прежнему видна
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 10 * 3600
+
+
+def test_recently_active_users_are_not_archived(guild_id):
+    models.set_user_contribution(1, guild_id, 1)
+    assert models.archive_users(guild_id, [1], (datetime.now() - timedelta(days=1)).isoformat()) == 0
+    assert models.get_archive_candidates(guild_id, (datetime.now() - timedelta(days=1)).isoformat()) == []
+
+
+def test_users_in_voice_are_not_archived(guild_id):
+    models.set_user_contribution(1, guild_id, 1)
+    models.apply_voice_event(guild_id, 1, 1, datetime.now(), 10)
+    assert models.get_archive_candidates(guild_id, _later()) == []
+    assert _archive(guild_id, [1]) == 0
+
+
+def test_returning_user_is_restored(guild_id, assert_totals_consistent):
+    models.set_user_contribution(1, guild_id, 5)
+    _archive(guild_id, [1])
+
+    # Пользователь снова зашел в голосовой канал: строка создается из архива
+    models.apply_voice_event(guild_id, 1, 1, datetime.now() - timedelta(hours=1), 10)
+    models.apply_voice_event(guild_id, 1, 2, datetime.now(), None)
+
+    assert models.count_archived_users(guild_id) == 0
+    assert models.get_user_stats(1, guild_id)['total_seconds'] >= 6 * 3600 - 1
+    assert_totals_consistent(guild_id)
+
+
+def test_create_after_archive_sets_last_active(guild_id, query):
+    models.set_user_contribution(1, guild_id, 5)
+    _archive(guild_id, [1])
+    models.adjust_user_contribution(1, guild_id, 1)
+
+    last_active = query("SELECT last_active_at FROM UserStats WHERE guild_id = %s AND user_id = %s", (guild_id, 1))
+    assert last_active[0][0] is not None
+    # Только что созданная строка не попадает в архив снова
+    assert models.get_archive_candidates(guild_id, (datetime.now() - timedelta(minutes=1)).isoformat()) == []
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 6 * 3600
+
+
+def test_reset_archived_user(guild_id, assert_totals_consistent):
+    models.set_user_contribution(1, guild_id, 5)
+    _archive(guild_id, [1])
+
+    models.reset_user_stats(1, guild_id)
+    assert models.count_archived_users(guild_id) == 0
+    # Вернувшийся пользователь начинает с нуля, а не с архивного времени
+    models.adjust_user_contribution(1, guild_id, 1)
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 3600
+    assert_totals_consistent(guild_id)
+
+
+def test_bulk_reset_counts_archived_users(guild_id, assert_totals_consistent):
+    for user_id in (1, 2, 3):
+        models.set_user_contribution(user_id, guild_id, 10)
+    _archive(guild_id, [1, 2])
+
+    assert models.bulk_reset_user_stats(guild_id, [2, 3, 4]) == 2
+    assert models.count_archived_users(guild_id) == 1
+    assert models.get_user_stats(3, guild_id)['total_seconds'] == 0
+    assert_totals_consistent(guild_id)
+
+
+def test_archived_user_rank(guild_id):
+    for user_id, hours in ((1, 10), (2, 20), (3, 30)):
+        models.set_user_contribution(user_id, guild_id, hours)
+    _archive(guild_id, [1, 3])
+
+    # Архивный пользователь получает место по своему архивному времени
+    assert models.get_user_rank(1, guild_id) == 2
+    assert models.get_user_rank(3, guild_id) == 1
+    assert models.get_user_rank(2, guild_id) == 1
+    assert models.get_user_rank(4, guild_id) is None
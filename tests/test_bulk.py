@@ -0,0 +1,40 @@
+import models
+
+
+def test_bulk_set_creates_and_levels_up(guild_id, assert_totals_consistent):
+    leveled_up = models.bulk_set_user_contribution(guild_id, [(1, 1000), (2, 0.5)])
+    assert leveled_up[1] > leveled_up.get(2, 0)
+    assert models.get_user_stats(2, guild_id)['total_seconds'] == 1800
+    assert_totals_consistent(guild_id)
+
+
+def test_bulk_adjust_never_goes_negative(guild_id, assert_totals_consistent):
+    models.bulk_set_user_contribution(guild_id, [(1, 2), (2, 3)])
+    models.bulk_adjust_user_contribution(guild_id, [(1, -5), (2, 1), (3, 1)])
+    assert [models.get_user_stats(user_id, guild_id)['total_seconds'] for user_id in (1, 2, 3)] == [0, 4 * 3600, 3600]
+    assert_totals_consistent(guild_id)
+
+
+def test_bulk_set_level_down_refreshes_max_level(guild_id, assert_totals_consistent):
+    models.bulk_set_user_level(guild_id, [(1, 10), (2, 5)])
+    assert models.get_guild_totals(guild_id)['max_level'] == 10
+    models.bulk_set_user_level(guild_id, [(1, 3)])
+    assert models.get_guild_totals(guild_id)['max_level'] == 5
+    assert_totals_consistent(guild_id)
+
+
+def test_bulk_reset(guild_id, assert_totals_consistent):
+    models.bulk_set_user_contribution(guild_id, [(1, 1000), (2, 10), (3, 1)])
+    assert models.bulk_reset_user_stats(guild_id, [1, 3, 4]) == 2
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 0
+    assert models.get_user_stats(2, guild_id)['total_seconds'] == 10 * 3600
+    assert_totals_consistent(guild_id)
+
+
+def test_bulk_update_restores_archived_user(guild_id, assert_totals_consistent):
+    models.bulk_set_user_contribution(guild_id, [(1, 5)])
+    models.archive_users(guild_id, [1], '9999-01-01')
+    models.bulk_adjust_user_contribution(guild_id, [(1, 1)])
+    assert models.count_archived_users(guild_id) == 0
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 6 * 3600
+    assert_totals_consistent(guild_id)
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import card_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(card_cache, 'CARD_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(card_cache, '_memory', card_cache.OrderedDict())
+    monkeypatch.setattr(card_cache, '_memory_bytes', 0)
+    monkeypatch.setattr(card_cache, '_disk', card_cache.OrderedDict())
+    monkeypatch.setattr(card_cache, '_disk_bytes', 0)
+    monkeypatch.setattr(card_cache, '_disk_loaded', False)
+    return tmp_path
+
+
+def test_peek_never_touches_disk(empty_cache):
+    (empty_cache / 'old.bin').write_bytes(b'old')
+    assert card_cache.peek('old') is None
+    assert not card_cache._disk_loaded
+
+
+def test_disk_tier_survives_restart(empty_cache):
+    (empty_cache / 'old.bin').write_bytes(b'old')
+    card_cache.put('new', b'new')
+    assert list(card_cache._disk) == ['old', 'new']
+    assert card_cache.get_from_disk('old') == b'old'
+    # Прочитанное с диска поднимается в память
+    assert card_cache.peek('old') == b'old'
+    assert card_cache.get('missing') is None
+
+
+def test_disk_tier_evicts_oldest(empty_cache, monkeypatch):
+    monkeypatch.setattr(card_cache, 'CARD_CACHE_DISK_BYTES', 6)
+    for key in ('a', 'b', 'c'):
+        card_cache.put(key, b'xxx')
+    assert list(card_cache._disk) == ['b', 'c']
+    assert not os.path.exists(empty_cache / 'a.bin')
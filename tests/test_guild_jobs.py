@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import models
+import guild_jobs
+
+
+def _populate(guild_id, users=5):
+    for user_id in range(1, users + 1):
+        models.set_user_contribution(user_id, guild_id, user_id)
+
+
+def test_reset_runs_in_batches(guild_id, query, assert_totals_consistent):
+    _populate(guild_id)
+    job = models.reset_guild_stats(guild_id)
+    assert (job['status'], job['total']) == ('pending', 5)
+    assert models.claim_guild_job(guild_id, 'reset', 'a', 60)
+
+    job = models.run_guild_job_batch(guild_id, 'reset', 'a', 2)
+    assert (job['status'], job['last_user_id'], job['processed']) == ('running', 2, 2)
+    assert query("SELECT COUNT(*) FROM UserStats WHERE guild_id = %s AND total_seconds > 0", (guild_id,))[0][0] == 3
+    assert_totals_consistent(guild_id)
+
+    while job['status'] == 'running':
+        job = models.run_guild_job_batch(guild_id, 'reset', 'a', 2)
+    assert (job['status'], job['processed']) == ('done', 5)
+    assert query("SELECT COUNT(*) FROM UserStats WHERE guild_id = %s AND total_seconds > 0", (guild_id,))[0][0] == 0
+    assert_totals_consistent(guild_id)
+
+
+def test_purge_deletes_guild(guild_id, query):
+    _populate(guild_id, 3)
+    models.purge_guild_data(guild_id)
+    job = guild_jobs.run_job(guild_id, 'purge')
+    assert (job['status'], job['processed']) == ('done', 3)
+    for table in ('UserStats', 'GuildTotals', 'GuildSettings'):
+        assert query(f"SELECT COUNT(*) FROM {table} WHERE guild_id = %s", (guild_id,))[0][0] == 0
+
+
+def test_lease_takeover(guild_id, query, assert_totals_consistent):
+    _populate(guild_id)
+    models.reset_guild_stats(guild_id)
+    assert models.claim_guild_job(guild_id, 'reset', 'a', 60)
+    models.run_guild_job_batch(guild_id, 'reset', 'a', 2)
+
+    # Пока владелец обновляет heartbeat, задачу не отдают
+    assert not models.claim_guild_job(guild_id, 'reset', 'b', 60)
+
+    # Владелец остановился: по истечении аренды задачу забирает другой исполнитель
+    stale = (datetime.now() - timedelta(minutes=5)).isoformat()
+    query("UPDATE GuildJobs SET heartbeat_at = %s WHERE guild_id = %s AND kind = 'reset'", (stale, guild_id))
+    assert models.claim_guild_job(guild_id, 'reset', 'b', 60)
+    assert models.run_guild_job_batch(guild_id, 'reset', 'a', 2) is None
+
+    job = models.run_guild_job_batch(guild_id, 'reset', 'b', 2)
+    assert (job['last_user_id'], job['processed']) == (4, 4)
+    while job['status'] == 'running':
+        job = models.run_guild_job_batch(guild_id, 'reset', 'b', 2)
+    assert (job['status'], job['processed']) == ('done', 5)
+    assert_totals_consistent(guild_id)
+
+
+def test_enqueue_returns_unfinished_job(guild_id):
+    _populate(guild_id, 2)
+    first = models.reset_guild_stats(guild_id)
+    assert models.reset_guild_stats(guild_id)['created_at'] == first['created_at']
+    assert [job['kind'] for job in models.get_guild_jobs(guild_id, unfinished=True)] == ['reset']
+
+
+def test_failed_job_resumes_from_cursor(guild_id):
+    _populate(guild_id)
+    models.reset_guild_stats(guild_id)
+    models.claim_guild_job(guild_id, 'reset', 'a', 60)
+    models.run_guild_job_batch(guild_id, 'reset', 'a', 2)
+    models.fail_guild_job(guild_id, 'reset', RuntimeError("boom"))
+
+    job = models.reset_guild_stats(guild_id)
+    assert (job['status'], job['last_user_id'], job['processed']) == ('pending', 2, 2)
+    job = guild_jobs.run_job(guild_id, 'reset')
+    assert (job['status'], job['processed']) == ('done', 5)
@@ -0,0 +1,238 @@
+import gc
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+import psycopg2.extensions
+import pytest
+
+import models
+import storage
+
+
+@pytest.fixture
+def backend():
+    return storage.get_backend(models.DATABASE_URL)
+
+
+@pytest.fixture
+def table(query):
+    """A scratch table for one test."""
+    name = f"StorageTest{time.time_ns()}"
+    query(f"CREATE TABLE {name} (id INTEGER PRIMARY KEY, value INTEGER)")
+    yield name
+    query(f"DROP TABLE {name}")
+
+
+# ------------------------------------------------------------- translate
+
+def test_translate_placeholders():
+    assert storage.translate("SELECT * FROM t WHERE a = %s AND b = %s", (1, 'x')) == \
+        ("SELECT * FROM t WHERE a = ? AND b = ?", [1, 'x'])
+
+
+def test_translate_any_list_becomes_in():
+    sql, params = storage.translate("DELETE FROM t WHERE g = %s AND id = ANY(%s)", (5, [1, 2, 3]))
+    assert sql == "DELETE FROM t WHERE g = ? AND id IN (?, ?, ?)"
+    assert params == [5, 1, 2, 3]
+
+
+def test_translate_empty_any_matches_nothing():
+    sql, params = storage.translate("SELECT 1 FROM t WHERE id = ANY(%s)", ([],))
+    assert sql == "SELECT 1 FROM t WHERE id IN (NULL)"
+    assert params == []
+
+
+def test_translate_postgres_syntax():
+    sql, _ = storage.translate("SELECT GREATEST(a, 1), LEAST(b, 2) FROM t WHERE id = %s FOR UPDATE", (1,))
+    assert sql == "SELECT MAX(a, 1), MIN(b, 2) FROM t WHERE id = ?"
+
+
+def test_translate_percent_escape_only_with_params():
+    assert storage.translate("SELECT '%%' WHERE a = %s", (1,))[0] == "SELECT '%' WHERE a = ?"
+    assert storage.translate("SELECT '%%'")[0] == "SELECT '%%'"
+
+
+def test_translate_param_count_mismatch():
+    with pytest.raises(sqlite3.ProgrammingError):
+        storage.translate("SELECT %s, %s", (1,))
+
+
+def test_is_write():
+    assert not storage.is_write("  SELECT 1")
+    assert storage.is_write("SELECT 1 FROM t FOR UPDATE")
+    assert storage.is_write("UPDATE t SET a = 1")
+
+
+# --------------------------------------------------- SAVEPOINT batching
+
+def _ids(query, table):
+    return sorted(row[0] for row in query(f"SELECT id FROM {table}"))
+
+
+def test_nested_rollback_keeps_outer_transaction(backend, table, query):
+    outer = backend.connect(autocommit=False)
+    outer.cursor().execute(f"INSERT INTO {table} (id) VALUES (%s)", (1,))
+    # Второе соединение того же потока становится точкой сохранения внутри первого
+    inner = backend.connect(autocommit=False)
+    inner.cursor().execute(f"INSERT INTO {table} (id) VALUES (%s)", (2,))
+    inner.rollback()
+    outer.commit()
+    outer.close()
+    inner.close()
+    assert _ids(query, table) == [1]
+
+
+def test_close_rolls_back(backend, table, query):
+    conn = backend.connect(autocommit=False)
+    conn.cursor().execute(f"INSERT INTO {table} (id) VALUES (%s)", (1,))
+    conn.close()
+    assert _ids(query, table) == []
+
+
+def test_concurrent_transactions_share_commits(backend, table, query, monkeypatch):
+    monkeypatch.setattr(storage, 'SQLITE_COMMIT_DELAY_MS', 200)
+    writer = backend.writer()
+    commits, transactions = writer.stats['commits'], writer.stats['transactions']
+    barrier = threading.Barrier(8)
+
+    def insert(i):
+        barrier.wait()
+        with backend.connect(autocommit=False) as conn:
+            conn.cursor().execute(f"INSERT INTO {table} (id) VALUES (%s)", (i,))
+
+    threads = [threading.Thread(target=insert, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert _ids(query, table) == list(range(8))
+    assert writer.stats['transactions'] - transactions == 8
+    assert writer.stats['commits'] - commits < 8
+
+
+def test_abandoned_transaction_releases_writer(backend, table, query, monkeypatch):
+    monkeypatch.setattr(storage, 'SQLITE_TRANSACTION_TIMEOUT', 0.3)
+    stuck = backend.connect(autocommit=False)
+    stuck.cursor().execute(f"INSERT INTO {table} (id) VALUES (%s)", (1,))
+
+    # Запись из другого потока ждет только до таймаута брошенной транзакции
+    done = threading.Event()
+
+    def insert():
+        with backend.connect(autocommit=False) as conn:
+            conn.cursor().execute(f"INSERT INTO {table} (id) VALUES (%s)", (2,))
+        done.set()
+
+    threading.Thread(target=insert).start()
+    assert done.wait(5)
+    with pytest.raises(sqlite3.OperationalError):
+        stuck.commit()
+    stuck.close()
+    assert _ids(query, table) == [2]
+
+
+def test_dropped_connection_rolls_back(backend, table, query):
+    def leave_open():
+        conn = backend.connect(autocommit=False)
+        conn.cursor().execute(f"INSERT INTO {table} (id) VALUES (%s)", (1,))
+
+    thread = threading.Thread(target=leave_open)
+    thread.start()
+    thread.join()
+    gc.collect()
+
+    started = time.monotonic()
+    query(f"INSERT INTO {table} (id) VALUES (%s)", (2,))
+    assert time.monotonic() - started < storage.SQLITE_TRANSACTION_TIMEOUT
+    assert _ids(query, table) == [2]
+
+
+def test_execute_values_fetch(backend, table):
+    with backend.connect(autocommit=False) as conn:
+        cursor = conn.cursor()
+        rows = [(i, i * 10) for i in range(5)]
+        returned = storage.execute_values(
+            cursor, f"INSERT INTO {table} (id, value) VALUES %s RETURNING id", rows, page_size=2, fetch=True
+        )
+    assert sorted(row[0] for row in returned) == list(range(5))
+
+
+# -------------------------------------------------- registry of statements
+
+def test_statement_registry(backend, table):
+    statement = storage.statement(f'test_select_{table.lower()}', f"SELECT value FROM {table} WHERE id = %s")
+    assert statement.prepare_sql.endswith("WHERE id = $1")
+    assert statement.execute_sql == f"EXECUTE {statement.name} (%s)"
+    with pytest.raises(ValueError):
+        storage.statement(statement.name, "SELECT 1")
+
+    conn = backend.connect()
+    conn.cursor().execute(f"INSERT INTO {table} (id, value) VALUES (1, 42)")
+    cursor = conn.cursor()
+    statement.execute(cursor, (1,))
+    assert cursor.fetchone()[0] == 42
+    conn.close()
+    # На SQLite запрос выполняется текстом
+    assert storage.statement_stats()[statement.name] == {'prepared': 0, 'text': 1, 'prepares': 0}
+
+
+# ------------------------------------------------------------ Postgres pool
+
+class _FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.info = SimpleNamespace(transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def close(self):
+        self.closed = 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(storage, 'DB_POOL_TIMEOUT', 0.5)
+    pool = storage.ConnectionPool('', 1, _FakeConnection, overflow=0)
+    monkeypatch.setattr(pool, '_open', pool.connection_class)
+    return pool
+
+
+def test_pool_reuses_connections(pool):
+    conn = pool.getconn()
+    conn.close()
+    assert pool.getconn() is conn
+    assert pool.in_use() == 1
+
+
+def test_pool_reclaims_lost_slot(pool):
+    conn = pool.getconn()
+    assert pool.in_use() == 1
+    del conn
+    gc.collect()
+    assert pool.in_use() == 0
+    pool.getconn()
+
+
+def test_pool_exhausted(pool):
+    held = pool.getconn()
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    held.close()
+
+
+def test_pool_after_fork_ignores_inherited_connections(pool):
+    inherited = pool.getconn()
+    pool._after_fork()
+    assert pool.in_use() == 0
+    # Соединение родителя не возвращается в пул и не освобождает чужое место
+    inherited.close()
+    assert pool.idle() == 0
+    assert not inherited.closed
+    conn = pool.getconn()
+    assert conn is not inherited
+    assert pool.in_use() == 1
@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+import models
+import totals_import
+
+
+def _import(guild_id, text, mode='set'):
+    return totals_import.import_totals(guild_id, io.BytesIO(text.encode()), 'csv', mode)
+
+
+def test_import_set_and_add(guild_id, assert_totals_consistent):
+    report = _import(guild_id, "user_id,total_seconds\n1,3600\n2,7200\n1,1800\n")
+    assert (report['rows'], report['users'], report['skipped']) == (3, 2, 0)
+    # В режиме set повторяющийся пользователь получает наибольшее значение
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 3600
+    assert_totals_consistent(guild_id)
+
+    _import(guild_id, "user_id,total_seconds\n1,60\n1,60\n3,10\n", mode='add')
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 3720
+    assert models.get_user_stats(3, guild_id)['total_seconds'] == 10
+    assert_totals_consistent(guild_id)
+
+
+def test_import_hours_with_semicolons(guild_id):
+    _import(guild_id, "User_ID;Hours\n1;1,5\n")
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 5400
+
+
+def test_import_raises_levels(guild_id, assert_totals_consistent):
+    report = _import(guild_id, "user_id,hours\n1,1000\n")
+    assert report['leveled_up'][1] > 0
+    assert models.get_user_stats(1, guild_id)['current_level'] == report['leveled_up'][1]
+    assert_totals_consistent(guild_id)
+
+
+def test_import_skips_invalid_rows(guild_id):
+    report = _import(guild_id, "\n".join([
+        "user_id,total_seconds",
+        "1,100",
+        "abc,100",
+        "0,100",
+        "2,-5",
+        "3,nan",
+        "4,inf",
+        f"5,{totals_import.IMPORT_MAX_SECONDS + 1}",
+        f"{2 ** 63},100",
+        "6,",
+    ]) + "\n")
+    assert (report['rows'], report['users'], report['skipped']) == (1, 1, 8)
+    assert report['errors'][0] == "строка 3: 'abc', '100'"
+    assert models.get_guild_totals(guild_id)['user_count'] == 1
+
+
+@pytest.mark.parametrize('header', ["id,total_seconds", "user_id,points"])
+def test_import_requires_columns(guild_id, header):
+    with pytest.raises(ValueError):
+        _import(guild_id, f"{header}\n1,100\n")
+
+
+def test_import_rejects_unknown_format_and_mode(guild_id):
+    with pytest.raises(ValueError):
+        totals_import.import_totals(guild_id, io.BytesIO(b"user_id,seconds\n"), 'xlsx')
+    with pytest.raises(ValueError):
+        _import(guild_id, "user_id,seconds\n1,1\n", mode='replace')
+
+
+def test_import_restores_archived_users(guild_id, assert_totals_consistent):
+    models.set_user_contribution(1, guild_id, 1)
+    models.archive_users(guild_id, [1], '9999-01-01')
+    _import(guild_id, "user_id,seconds\n1,60\n", mode='add')
+    assert models.count_archived_users(guild_id) == 0
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 3660
+    assert_totals_consistent(guild_id)
+
+
+def test_format_from_name():
+    assert totals_import.format_from_name("totals.PARQUET") == 'parquet'
+    assert totals_import.format_from_name("totals.csv") == 'csv'
@@ -0,0 +1,95 @@
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+
+import models
+import voice_ingest
+
+
+def _event(guild_id, user_id, seq, channel_id, occurred_at=None):
+    return voice_ingest.VoiceEvent(guild_id, user_id, seq, occurred_at or datetime.now(), channel_id,
+                                   False, False, False, False)
+
+
+def test_next_seq_is_strictly_increasing(guild_id):
+    seqs = [voice_ingest.next_seq(guild_id) for _ in range(100)]
+    assert seqs == sorted(set(seqs))
+
+
+def test_join_then_leave_credits_time(guild_id, assert_totals_consistent):
+    joined = datetime.now() - timedelta(hours=1)
+    assert models.apply_voice_event(*_event(guild_id, 1, 1, 10, joined))['action'] == 'join'
+    assert models.apply_voice_event(*_event(guild_id, 1, 2, 10, joined + timedelta(minutes=5)))['action'] == 'noop'
+    assert models.apply_voice_event(*_event(guild_id, 1, 3, None, joined + timedelta(hours=1)))['action'] == 'leave'
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 3600
+    assert_totals_consistent(guild_id)
+
+
+def test_stale_and_duplicate_events_are_dropped(guild_id):
+    joined = datetime.now() - timedelta(hours=1)
+    models.apply_voice_event(*_event(guild_id, 1, 10, 10, joined))
+    # Запоздавший выход и повтор входа ничего не меняют
+    assert models.apply_voice_event(*_event(guild_id, 1, 5, None))['action'] == 'stale'
+    assert models.apply_voice_event(*_event(guild_id, 1, 10, 10, joined))['action'] == 'stale'
+    assert models.get_active_user_ids(guild_id) == [1]
+
+
+def test_move_credits_old_channel(guild_id):
+    joined = datetime.now() - timedelta(hours=2)
+    models.apply_voice_event(*_event(guild_id, 1, 1, 10, joined))
+    assert models.apply_voice_event(*_event(guild_id, 1, 2, 20, joined + timedelta(hours=1)))['action'] == 'move'
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 3600
+    assert models.get_active_user_ids(guild_id) == [1]
+
+
+def test_batch_applies_in_order(guild_id):
+    joined = datetime.now() - timedelta(hours=1)
+    results = models.apply_voice_events([
+        _event(guild_id, 1, 1, 10, joined),
+        _event(guild_id, 2, 2, 10, joined),
+        _event(guild_id, 1, 3, None, joined + timedelta(minutes=30)),
+    ])
+    assert [result['action'] for result in results] == ['join', 'join', 'leave']
+    assert models.get_active_user_ids(guild_id) == [2]
+    assert models.get_user_stats(1, guild_id)['total_seconds'] == 1800
+
+
+def test_failed_batch_falls_back_to_single_events(guild_id, monkeypatch):
+    monkeypatch.setattr(voice_ingest, 'VOICE_INGEST_RETRIES', 0)
+    apply = models.apply_voice_events
+    batches = []
+
+    def apply_failing_on_poison(events):
+        batches.append([event.user_id for event in events])
+        if any(event.user_id == 666 for event in events):
+            raise RuntimeError("poison")
+        return apply(events)
+
+    monkeypatch.setattr(models, 'apply_voice_events', apply_failing_on_poison)
+
+    # Все три события уже в очереди, поэтому поток берет их одной партией
+    events = queue.Queue()
+    futures = []
+    for seq, user_id in enumerate((1, 666, 2), start=1):
+        future = Future()
+        events.put((_event(guild_id, user_id, seq, 10), future))
+        futures.append(future)
+    threading.Thread(target=voice_ingest._work, args=(events,), daemon=True).start()
+    events.join()
+
+    assert batches == [[1, 666, 2], [1], [666], [2]]
+    assert futures[0].result()['action'] == 'join'
+    with pytest.raises(RuntimeError):
+        futures[1].result()
+    assert futures[2].result()['action'] == 'join'
+    assert sorted(models.get_active_user_ids(guild_id)) == [1, 2]
+
+
+def test_submit_routes_through_pipeline(guild_id):
+    future = voice_ingest.submit(voice_ingest.stamp(guild_id, 1, 10), shard_id=guild_id)
+    assert future.result(timeout=10)['action'] == 'join'
+    voice_ingest.flush()
+    assert models.get_active_user_ids(guild_id) == [1]
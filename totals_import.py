@@ -0,0 +1,133 @@
+"""
+Импорт накопленного времени из других ботов уровней.
+
+Файл CSV (или Parquet, если установлен pyarrow) читается потоком и сразу
+передается в models.import_user_totals, который загружает строки во
+временную таблицу через COPY и сливает их с UserStats одним запросом.
+
+Нужны колонка user_id и одна из колонок со временем:
+total_seconds / seconds (секунды) или contribution / hours (вклад в часах).
+Строки с некорректными значениями пропускаются и попадают в отчет.
+
+Запуск вне бота: python totals_import.py <guild_id> <файл> [set|add]
+"""
+
+import io
+import os
+import csv
+import sys
+import logging
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# Сколько ошибок в строках перечислять в отчете
+IMPORT_ERROR_LIMIT = int(os.environ.get('IMPORT_ERROR_LIMIT', 20))
+
+# Больше этого у одного пользователя не бывает (100 лет). Граница держит и
+# суммы по серверу (GuildTotals) в пределах BIGINT
+IMPORT_MAX_SECONDS = int(os.environ.get('IMPORT_MAX_SECONDS', 100 * 365 * 86400))
+
+# user_id хранится в BIGINT
+_INT64_MAX = 2 ** 63 - 1
+
+# Колонка со временем -> множитель до секунд
+VALUE_COLUMNS = {'total_seconds': 1, 'seconds': 1, 'contribution': 3600, 'hours': 3600}
+
+IMPORT_FORMATS = ('csv', 'parquet')
+
+
+def _value_column(names):
+    names = [name.strip().lower() for name in names]
+    if 'user_id' not in names:
+        raise ValueError("В файле нет колонки user_id")
+    for column, multiplier in VALUE_COLUMNS.items():
+        if column in names:
+            return column, multiplier
+    raise ValueError(f"В файле нет колонки со временем ({', '.join(VALUE_COLUMNS)})")
+
+
+def read_csv(fileobj):
+    """Column names and an iterator of dict records from a CSV file (text or binary)."""
+    if not isinstance(fileobj, io.TextIOBase):
+        fileobj = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    header = fileobj.readline()
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    names = [name.strip().lower() for name in next(csv.reader([header], delimiter=delimiter))]
+    return names, csv.DictReader(fileobj, fieldnames=names, delimiter=delimiter)
+
+
+def read_parquet(fileobj):
+    """Column names and an iterator of dict records from a Parquet file (needs pyarrow)."""
+    try:
+        import pyarrow.parquet as pq
+    except ModuleNotFoundError:
+        raise ValueError("Для импорта Parquet нужен пакет pyarrow (pip install pyarrow)")
+    parquet = pq.ParquetFile(fileobj)
+    names = [name.lower() for name in parquet.schema_arrow.names]
+
+    def records():
+        for batch in parquet.iter_batches():
+            for record in batch.to_pylist():
+                yield {key.lower(): value for key, value in record.items()}
+    return names, records()
+
+
+def _valid_rows(records, column, multiplier, report):
+    """(user_id, total_seconds) for valid records; invalid ones are counted in report."""
+    for line, record in enumerate(records, start=2):
+        try:
+            user_id = int(str(record['user_id']).strip())
+            value = float(str(record[column]).strip().replace(',', '.'))
+            # Сравнение отсекает и inf с nan
+            if not 0 < user_id <= _INT64_MAX or not 0 <= value * multiplier <= IMPORT_MAX_SECONDS:
+                raise ValueError
+        except (TypeError, ValueError, KeyError):
+            report['skipped'] += 1
+            if len(report['errors']) < IMPORT_ERROR_LIMIT:
+                report['errors'].append(f"строка {line}: {record.get('user_id')!r}, {record.get(column)!r}")
+            continue
+        yield user_id, round(value * multiplier)
+
+
+def import_totals(guild_id, fileobj, file_format='csv', mode='set'):
+    """Stream a CSV or Parquet file of totals into a guild.
+
+    Returns a report: rows loaded, users merged, rows skipped with the first
+    errors, and {user_id: new_level} of users who leveled up.
+    """
+    if file_format not in IMPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат файла: {file_format}")
+    names, records = read_parquet(fileobj) if file_format == 'parquet' else read_csv(fileobj)
+    column, multiplier = _value_column(names)
+
+    report = {'skipped': 0, 'errors': []}
+    result = models.import_user_totals(guild_id, _valid_rows(records, column, multiplier, report), mode)
+    report.update(result)
+    return report
+
+
+def format_from_name(filename):
+    """Import format by file extension (csv by default)."""
+    return 'parquet' if filename.lower().endswith(('.parquet', '.pq')) else 'csv'
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler()]
+    )
+    from invalidation_bus import publish, GUILD_STATS
+
+    guild_id, path = int(sys.argv[1]), sys.argv[2]
+    mode = sys.argv[3] if len(sys.argv) > 3 else 'set'
+    with open(path, 'rb') as f:
+        report = import_totals(guild_id, f, format_from_name(path), mode)
+    # Кэши бота и веб-интерфейса живут в других процессах
+    publish(GUILD_STATS, guild_id)
+    logger.info(f"Загружено строк: {report['rows']}, пользователей: {report['users']}, "
+                f"пропущено: {report['skipped']}, повысили уровень: {len(report['leveled_up'])}")
+    for error in report['errors']:
+        logger.warning(f"Пропущена {error}")
@@ -5,6 +5,7 @@
 import logging
 import json
 from models import get_db_connection
+from invalidation_bus import publish, GUILD_CONFIG, GUILD_STATS
 
 # Настройка логирования
 logging.basicConfig(
@@ -82,6 +83,10 @@ def update_all_level_thresholds():
     logger.info(f"Обновлены пороги уровней для всех серверов")
     logger.info(f"Пересчитаны уровни для {updated_count} пользователей")
     
+    # Сообщаем запущенным процессам бота и веб-интерфейса о новых порогах
+    publish(GUILD_CONFIG)
+    publish(GUILD_STATS)
+    
     return True
 
 if __name__ == "__main__":
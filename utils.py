@@ -1,7 +1,8 @@
 import logging
 import discord
+import member_cache
 from datetime import datetime, timedelta
-from models import get_guild_config, get_user_stats
+from models import get_guild_config, get_user_stats, get_user_rank
 
 logger = logging.getLogger(__name__)
 
@@ -30,7 +31,8 @@ async def send_level_up_message(bot, user_id, guild_id, new_level):
             logger.error(f"Could not find guild with ID {guild_id}")
             return
         
-        member = guild.get_member(user_id)
+        # Участник может быть не в кэше: при ленивой загрузке его запрашивают у Discord
+        member = await member_cache.get_member(guild, user_id)
         if not member:
             logger.error(f"Could not find member with ID {user_id} in guild {guild.name}")
             return
@@ -169,3 +171,37 @@ def get_progress_bar(percentage, length=10):
     filled = int(length * percentage / 100)
     empty = length - filled
     return '█' * filled + '░' * empty
+
+
+def get_card_params(bot, user_id, guild_id, theme='default'):
+    """Collect everything drawn on a user's rank card (see future_card.render_card)."""
+    stats = get_user_stats(user_id, guild_id)
+    config = get_guild_config(guild_id)
+    next_info = get_next_level_info(stats, guild_id)
+    
+    user = bot.get_user(user_id)
+    if user is None:
+        guild = bot.get_guild(guild_id)
+        user = member_cache.peek(guild, user_id) if guild else None
+    user_name = user.display_name if user else f"Пользователь {user_id}"
+    avatar_hash = user.display_avatar.key if user else None
+    avatar_url = user.display_avatar.replace(size=256, static_format='png').url if user else None
+    
+    unit_name = config.get('contribution_unit_name', 'часов')
+    if next_info['next_threshold'] is not None:
+        contribution_text = (f"{format_contribution(stats['contribution'])} / "
+                             f"{format_contribution(next_info['next_threshold'])} {unit_name}")
+    else:
+        contribution_text = f"{format_contribution(stats['contribution'])} {unit_name}"
+    
+    return {
+        'user_id': user_id,
+        'user_name': user_name,
+        'avatar_hash': avatar_hash,
+        'avatar_url': avatar_url,
+        'level': stats['current_level'],
+        'progress_percent': next_info['progress_percentage'],
+        'contribution_text': contribution_text,
+        'rank': get_user_rank(user_id, guild_id),
+        'theme': theme
+    }
@@ -0,0 +1,228 @@
+"""
+Прием голосовых событий: порядковые номера, порядок и идемпотентность.
+
+Обработчик on_voice_state_update вызывает on_voice_state_update этого
+модуля (или stamp + submit). Событие сразу, еще в цикле событий бота,
+получает порядковый номер сервера и время. Номер монотонно растет внутри
+процесса и привязан к часам (микросекунды), поэтому номера разных
+процессов и перезапусков тоже идут по времени.
+
+У каждого шарда свой конвейер: VOICE_INGEST_WORKERS потоков, сервер
+закреплен за одним из них. События одного сервера (и значит одного
+пользователя) применяются строго по очереди, а разные потоки не
+конкурируют за строки одного сервера. Поток забирает из очереди до
+VOICE_INGEST_BATCH событий и применяет их одной транзакцией
+(models.apply_voice_events).
+
+Событие применяется как состояние ("пользователь сейчас в канале X"), а не
+как приращение. Событие с номером не больше последнего примененного
+(повтор после resume, дубль от второго процесса, запоздавшее событие)
+отбрасывается. Поэтому при ошибке базы партию можно безопасно повторить до
+VOICE_INGEST_RETRIES раз, а если она так и не применилась — применить ее
+события по одному, чтобы терялось только то, на котором ошибка.
+
+После подключения шарда reconcile_guild сверяет ActiveUsers с
+фактическими голосовыми каналами его серверов: сессии тех, кто вышел,
+пока шард был отключен, закрываются, а незаписанные открываются. Когда
+именно вышел пользователь, неизвестно, поэтому время засчитывается только
+до отключения шарда (mark_disconnected), а если процесс только запущен и
+время отключения неизвестно — сессия закрывается без начисления.
+"""
+
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import Future
+from datetime import datetime
+
+import metrics
+import models
+
+logger = logging.getLogger(__name__)
+
+VOICE_INGEST_WORKERS = int(os.environ.get('VOICE_INGEST_WORKERS', 4))
+VOICE_INGEST_BATCH = int(os.environ.get('VOICE_INGEST_BATCH', 50))
+VOICE_INGEST_RETRIES = int(os.environ.get('VOICE_INGEST_RETRIES', 3))
+
+VoiceEvent = namedtuple('VoiceEvent', [
+    'guild_id', 'user_id', 'seq', 'occurred_at', 'channel_id',
+    'is_muted', 'is_deafened', 'is_server_muted', 'is_server_deafened',
+])
+
+_last_seq = {}  # guild_id -> last issued sequence number
+_seq_lock = threading.Lock()
+
+_pipelines = {}  # shard_id -> list of worker queues
+_pipelines_lock = threading.Lock()
+
+_disconnected_at = {}  # shard_id -> when the shard lost its gateway connection
+
+
+def next_seq(guild_id):
+    """Next sequence number of a guild: strictly increasing, close to the current time in microseconds."""
+    now = time.time_ns() // 1000
+    with _seq_lock:
+        seq = max(_last_seq.get(guild_id, 0) + 1, now)
+        _last_seq[guild_id] = seq
+    return seq
+
+
+def stamp(guild_id, user_id, channel_id, is_muted=False, is_deafened=False, is_server_muted=False, is_server_deafened=False):
+    """A voice event for the user's state right now; channel_id=None means the user left voice."""
+    return VoiceEvent(
+        guild_id, user_id, next_seq(guild_id), datetime.now(), channel_id,
+        bool(is_muted), bool(is_deafened), bool(is_server_muted), bool(is_server_deafened),
+    )
+
+
+def _apply(events):
+    for attempt in range(VOICE_INGEST_RETRIES + 1):
+        try:
+            return models.apply_voice_events(events)
+        except Exception as e:
+            if attempt == VOICE_INGEST_RETRIES:
+                raise
+            logger.warning(f"Ошибка применения {len(events)} голосовых событий, повтор: {e}")
+            time.sleep(0.1 * 2 ** attempt)
+
+
+def _work(events):
+    while True:
+        batch = [events.get()]
+        while len(batch) < VOICE_INGEST_BATCH:
+            try:
+                batch.append(events.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            results = _apply([event for event, _ in batch])
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        except Exception as e:
+            if len(batch) > 1:
+                # Партию могло сорвать одно событие: по одному теряется только оно
+                logger.warning(f"Партия из {len(batch)} голосовых событий не применена ({e}), применяем по одному")
+                _apply_each(batch)
+            else:
+                logger.error(f"Голосовое событие не применено: {e}")
+                batch[0][1].set_exception(e)
+        finally:
+            for _ in batch:
+                events.task_done()
+
+
+def _apply_each(batch):
+    for event, future in batch:
+        try:
+            future.set_result(_apply([event])[0])
+        except Exception as e:
+            logger.error(f"Голосовое событие {event.guild_id}/{event.user_id} (seq {event.seq}) не применено: {e}")
+            future.set_exception(e)
+
+
+def _pipeline(shard_id):
+    with _pipelines_lock:
+        queues = _pipelines.get(shard_id)
+        if queues is None:
+            queues = []
+            for i in range(max(VOICE_INGEST_WORKERS, 1)):
+                events = queue.Queue()
+                threading.Thread(target=_work, args=(events,), name=f'voice-ingest-{shard_id}-{i}', daemon=True).start()
+                queues.append(events)
+            _pipelines[shard_id] = queues
+            logger.info(f"Конвейер голосовых событий шарда {shard_id} запущен ({len(queues)} потоков)")
+    return queues
+
+
+def submit(event, shard_id=0):
+    """Queue an event on its shard's pipeline; returns a Future with apply_voice_event's result."""
+    queues = _pipeline(shard_id)
+    future = Future()
+    queues[hash(event.guild_id) % len(queues)].put((event, future))
+    return future
+
+
+def on_voice_state_update(member, before, after):
+    """Stamp and queue a discord.py voice state change; returns a Future, or None if nothing changed."""
+    if member.bot:
+        return None
+    state = (after.channel.id if after.channel else None, after.self_mute, after.self_deaf, after.mute, after.deaf)
+    previous = (before.channel.id if before.channel else None, before.self_mute, before.self_deaf, before.mute, before.deaf)
+    if state == previous:
+        return None
+    return submit(stamp(member.guild.id, member.id, *state), member.guild.shard_id)
+
+
+def mark_disconnected(shard_id):
+    """Remember when a shard lost its connection (the first disconnect until it is reconciled)."""
+    _disconnected_at.setdefault(shard_id or 0, datetime.now())
+
+
+def mark_resumed(shard_id):
+    """The shard resumed its session: Discord replays the missed events, nothing to reconcile."""
+    _disconnected_at.pop(shard_id or 0, None)
+
+
+async def reconcile_guild(guild, last_seen=None):
+    """Bring ActiveUsers of a guild in line with who is actually in voice; returns the number of events queued.
+
+    Sessions of users who left while the shard was offline are credited up
+    to last_seen, or closed without credit when last_seen is None.
+    """
+    recorded = set(await asyncio.to_thread(models.get_active_user_ids, guild.id))
+    futures = []
+    in_voice = set()
+    for channel in list(guild.voice_channels) + list(guild.stage_channels):
+        for user_id, state in channel.voice_states.items():
+            member = guild.get_member(user_id)
+            if member is not None and member.bot:
+                continue
+            in_voice.add(user_id)
+            event = stamp(guild.id, user_id, channel.id, state.self_mute, state.self_deaf, state.mute, state.deaf)
+            futures.append(submit(event, guild.shard_id))
+    # Вышли, пока шард был отключен: время засчитывается только до отключения
+    for user_id in recorded - in_voice:
+        event = stamp(guild.id, user_id, None)._replace(occurred_at=last_seen)
+        futures.append(submit(event, guild.shard_id))
+    if futures:
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in futures), return_exceptions=True)
+    return len(futures)
+
+
+async def reconcile_shard(bot, shard_id=None):
+    """Reconcile every guild of a shard (or every guild of the bot when shard_id is None)."""
+    guilds = [guild for guild in bot.guilds if shard_id is None or guild.shard_id == shard_id]
+    if shard_id is None:
+        last_seen = {guild.shard_id: _disconnected_at.pop(guild.shard_id, None) for guild in guilds}
+    else:
+        last_seen = {shard_id: _disconnected_at.pop(shard_id, None)}
+    queued = 0
+    for guild in guilds:
+        try:
+            queued += await reconcile_guild(guild, last_seen.get(guild.shard_id))
+        except Exception as e:
+            logger.error(f"Ошибка сверки голосовых сессий сервера {guild.id}: {e}")
+    logger.info(f"Голосовые сессии сверены: шард {shard_id if shard_id is not None else 'все'}, "
+                f"серверов {len(guilds)}, событий {queued}")
+    return queued
+
+
+def flush():
+    """Wait until every queued event has been applied."""
+    with _pipelines_lock:
+        queues = [events for shard in _pipelines.values() for events in shard]
+    for events in queues:
+        events.join()
+
+
+def pending():
+    """Events waiting to be applied, per shard."""
+    with _pipelines_lock:
+        return {(shard_id,): sum(events.qsize() for events in queues) for shard_id, queues in _pipelines.items()}
+
+
+metrics.VOICE_INGEST_PENDING.set_function(pending)
@@ -0,0 +1,118 @@
+"""
+Кэш отрендеренных страниц веб-интерфейса с поддержкой ETag / Last-Modified.
+
+Страницы кэшируются по маршруту и его аргументам на короткое время (TTL)
+и сбрасываются явно, когда меняется статистика или настройки сервера.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g, request, make_response
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Время жизни записи по умолчанию (в секундах) и максимальное число записей
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 30))
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get('PAGE_CACHE_MAX_ENTRIES', 1024))
+
+# key -> {'body', 'content_type', 'etag', 'last_modified', 'expires_at', 'guild_id'}
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+stats = {'hits': 0, 'misses': 0}
+metrics.register_cache('page', stats)
+
+
+def _cache_key():
+    """Build a cache key from the endpoint, its view arguments and query string."""
+    view_args = tuple(sorted((request.view_args or {}).items()))
+    query_args = tuple(sorted(request.args.items(multi=True)))
+    return (request.endpoint, view_args, query_args)
+
+
+def _build_response(entry):
+    """Create a conditional response (200 or 304) from a cache entry."""
+    response = make_response(entry['body'])
+    response.content_type = entry['content_type']
+    response.set_etag(entry['etag'])
+    response.last_modified = entry['last_modified']
+    response.headers['Cache-Control'] = "public, no-cache"
+    return response.make_conditional(request)
+
+
+def cached_page(ttl=PAGE_CACHE_TTL):
+    """Cache the rendered page of a view; pages with a guild_id argument are scoped to that guild."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = _cache_key()
+            now = time.monotonic()
+
+            with _lock:
+                entry = _entries.get(key)
+                if entry is not None and entry['expires_at'] > now:
+                    _entries.move_to_end(key)
+                else:
+                    entry = None
+
+            if entry is not None:
+                stats['hits'] += 1
+                return _build_response(entry)
+
+            stats['misses'] += 1
+
+            response = make_response(view(*args, **kwargs))
+
+            # Страницы с ошибками и не-HTML ответы не кэшируем
+            if response.status_code != 200 or g.get('skip_page_cache') or response.is_streamed:
+                return response
+
+            body = response.get_data()
+            entry = {
+                'body': body,
+                'content_type': response.content_type,
+                'etag': hashlib.sha1(body).hexdigest(),
+                'last_modified': datetime.now(timezone.utc).replace(microsecond=0),
+                'expires_at': now + ttl,
+                'guild_id': kwargs.get('guild_id'),
+            }
+
+            with _lock:
+                _entries[key] = entry
+                _entries.move_to_end(key)
+                while len(_entries) > PAGE_CACHE_MAX_ENTRIES:
+                    _entries.popitem(last=False)
+
+            return _build_response(entry)
+        return wrapper
+    return decorator
+
+
+def invalidate_guild(guild_id, user_id=None):
+    """Drop cached pages of a guild and the pages that list all guilds.
+
+    User pages are dropped together with the guild because a user's rank
+    depends on everyone else's time. guild_id=None drops everything.
+    """
+    if guild_id is None:
+        invalidate_all()
+        return
+
+    with _lock:
+        stale = [key for key, entry in _entries.items()
+                 if entry['guild_id'] is None or entry['guild_id'] == guild_id]
+        for key in stale:
+            del _entries[key]
+
+
+def invalidate_all():
+    """Drop every cached page."""
+    with _lock:
+        _entries.clear()